@@ -0,0 +1,237 @@
+"""
+向量库近似最近邻（ANN）索引 —— 纯 NumPy 实现的 IVF（倒排文件）+ 可选 PQ（乘积量化）。
+
+语料扩充到数万、数十万 chunk 后，逐行暴力打分的耗时随规模线性增长。IVF 先用球面 k-means
+把全部向量聚成 nlist 个簇，检索时只打开与查询最相近的 nprobe 个簇，候选数约为
+N × nprobe / nlist；可选的 PQ 把每个向量切成 m 段、每段用 256 个码字之一编码（每行 m 字节），
+候选先用查表（ADC）近似打分，再只对 shortlist 用向量库原始向量精确重排。
+
+索引目录 knowledge/vector_store/ann/：
+  centroids.npy     float32 (nlist, d)：归一化簇中心
+  list_offsets.npy  int64 (nlist + 1)：各簇在 list_rows 中的起止位置
+  list_rows.npy     int32 (N,)：按簇排列的向量库行号
+  pq_codebooks.npy  可选，float32 (m, ksub, dsub)：各段码本（d 不足 m × dsub 时末尾补零）
+  pq_codes.npy      可选，uint8 (N, m)：与 list_rows 顺序一致的 PQ 编码
+  ann.json          {"nlist", "pq_m", "dsub", "dim", "rows", "nprobe"}
+由 build_vector_store.py --ann 构建；rag.py 检测到该目录时自动使用（RAG_ANN=0 关闭）。
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import shutil
+import time
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+ANN_META_FILE = "ann.json"
+DEFAULT_NPROBE = 16
+# k-means 训练参数
+KMEANS_ITERS = 15
+MAX_TRAIN_ROWS = 20000
+BLOCK_ROWS = 1024
+PQ_KSUB = 256
+# PQ 近似打分后参与精确重排的候选数 = top_k × 该倍数
+PQ_RERANK_FACTOR = 10
+
+
+def _blocks(store, rows: np.ndarray):
+    """按块取稠密向量，避免一次性展开整个矩阵。"""
+    for start in range(0, len(rows), BLOCK_ROWS):
+        yield start, store.dense_rows(rows[start:start + BLOCK_ROWS])
+
+
+def _spherical_kmeans(store, train_rows: np.ndarray, k: int, rng) -> np.ndarray:
+    """球面 k-means（内积相似度、簇中心归一化），返回 (k, d) 簇中心。"""
+    centroids = store.dense_rows(rng.choice(train_rows, size=k, replace=False))
+    for _ in range(KMEANS_ITERS):
+        sums = np.zeros_like(centroids)
+        counts = np.zeros(k, dtype=np.int64)
+        for _, block in _blocks(store, train_rows):
+            assign = np.argmax(block @ centroids.T, axis=1)
+            # 按簇求和用 one-hot 矩阵乘，比 np.add.at 逐行累加快得多
+            onehot = np.zeros((k, len(block)), dtype=np.float32)
+            onehot[assign, np.arange(len(block))] = 1.0
+            sums += onehot @ block
+            counts += np.bincount(assign, minlength=k)
+        empty = counts == 0
+        if empty.any():
+            # 空簇用随机样本重新初始化
+            sums[empty] = store.dense_rows(rng.choice(train_rows, size=int(empty.sum())))
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        centroids = sums / norms
+    return centroids.astype(np.float32)
+
+
+def _l2_kmeans(x: np.ndarray, k: int, rng) -> np.ndarray:
+    """欧氏距离 k-means（PQ 各段码本用），返回 (k, dsub) 码字。"""
+    k = min(k, len(x))
+    codewords = x[rng.choice(len(x), size=k, replace=False)].copy()
+    for _ in range(KMEANS_ITERS):
+        assign = _nearest(x, codewords)
+        sums = np.zeros_like(codewords)
+        np.add.at(sums, assign, x)
+        counts = np.bincount(assign, minlength=k)
+        nonempty = counts > 0
+        codewords[nonempty] = sums[nonempty] / counts[nonempty, None]
+    return codewords
+
+
+def _nearest(x: np.ndarray, codewords: np.ndarray) -> np.ndarray:
+    """每行最近的码字下标：argmin ||c||² - 2 x·c。"""
+    return np.argmin((codewords ** 2).sum(axis=1)[None, :] - 2.0 * (x @ codewords.T), axis=1)
+
+
+def _split(block: np.ndarray, m: int, dsub: int) -> np.ndarray:
+    """(n, d) -> (n, m, dsub)，d 不足 m × dsub 时末尾补零。"""
+    pad = m * dsub - block.shape[1]
+    if pad:
+        block = np.pad(block, ((0, 0), (0, pad)))
+    return block.reshape(len(block), m, dsub)
+
+
+def build_ann(store, out_dir: str, nlist: int = 0, pq_m: int = 0, seed: int = 0) -> dict:
+    """为向量库构建 IVF（可选 PQ）索引并写入 out_dir，返回 ann.json 内容。
+    nlist 为 0 时取 ≈ 4·sqrt(N)；pq_m 为 0 时不做 PQ（候选直接精确打分）。"""
+    rng = np.random.default_rng(seed)
+    n = len(store)
+    nlist = nlist or max(1, int(round(4 * np.sqrt(n))))
+    nlist = min(nlist, n)
+    all_rows = np.arange(n)
+    train_rows = all_rows if n <= MAX_TRAIN_ROWS else rng.choice(n, MAX_TRAIN_ROWS, replace=False)
+
+    centroids = _spherical_kmeans(store, train_rows, nlist, rng)
+    assign = np.empty(n, dtype=np.int64)
+    for start, block in _blocks(store, all_rows):
+        assign[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+    list_rows = np.argsort(assign, kind="stable").astype(np.int32)
+    list_offsets = np.zeros(nlist + 1, dtype=np.int64)
+    np.cumsum(np.bincount(assign, minlength=nlist), out=list_offsets[1:])
+
+    arrays = {"centroids": centroids, "list_offsets": list_offsets, "list_rows": list_rows}
+    dsub = 0
+    if pq_m:
+        dsub = -(-store.dim // pq_m)
+        train = _split(store.dense_rows(train_rows[:min(len(train_rows), 5000)]), pq_m, dsub)
+        codebooks = np.stack([_l2_kmeans(train[:, s], PQ_KSUB, rng) for s in range(pq_m)])
+        codes = np.empty((n, pq_m), dtype=np.uint8)
+        for start, block in _blocks(store, list_rows.astype(np.int64)):
+            parts = _split(block, pq_m, dsub)
+            for s in range(pq_m):
+                codes[start:start + len(block), s] = _nearest(parts[:, s], codebooks[s])
+        arrays["pq_codebooks"] = codebooks.astype(np.float32)
+        arrays["pq_codes"] = codes
+
+    meta = {
+        "nlist": int(nlist),
+        "pq_m": int(pq_m),
+        "dsub": int(dsub),
+        "dim": int(store.dim),
+        "rows": int(n),
+        "nprobe": min(DEFAULT_NPROBE, int(nlist)),
+    }
+    tmp_dir = out_dir.rstrip(os.sep) + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    for name, arr in arrays.items():
+        np.save(os.path.join(tmp_dir, name + ".npy"), arr)
+    with open(os.path.join(tmp_dir, ANN_META_FILE), "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+    shutil.rmtree(out_dir, ignore_errors=True)
+    os.rename(tmp_dir, out_dir)
+    return meta
+
+
+class AnnIndex:
+    """mmap 只读的 IVF(-PQ) 索引。search() 只打分 nprobe 个簇内的候选行。"""
+
+    def __init__(self, index_dir: str):
+        with open(os.path.join(index_dir, ANN_META_FILE), "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+
+        def load(name):
+            return np.load(os.path.join(index_dir, name + ".npy"), mmap_mode="r")
+
+        self.centroids = np.asarray(load("centroids"), dtype=np.float32)
+        self.list_offsets = load("list_offsets")
+        self.list_rows = load("list_rows")
+        self.pq_m = self.meta.get("pq_m", 0)
+        self.dsub = self.meta.get("dsub", 0)
+        self.codebooks = load("pq_codebooks") if self.pq_m else None
+        self.codes = load("pq_codes") if self.pq_m else None
+        self.rows = self.meta["rows"]
+        self.nlist = self.meta["nlist"]
+        self.nprobe = self.meta.get("nprobe", DEFAULT_NPROBE)
+
+    def candidates(self, q: np.ndarray, nprobe: int) -> Tuple[np.ndarray, np.ndarray]:
+        """返回 (候选行号, 在 list_rows 中的位置)，来自与 q 最相近的 nprobe 个簇。"""
+        nprobe = max(1, min(nprobe, self.nlist))
+        cs = self.centroids @ q
+        probe = np.argpartition(-cs, nprobe - 1)[:nprobe] if nprobe < self.nlist else np.arange(self.nlist)
+        starts = np.asarray(self.list_offsets[probe], dtype=np.int64)
+        lengths = np.asarray(self.list_offsets[probe + 1], dtype=np.int64) - starts
+        pos = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(int(lengths.sum()))
+        return np.asarray(self.list_rows[pos], dtype=np.int64), pos
+
+    def search(self, store, q: np.ndarray, top_k: int, nprobe: Optional[int] = None) -> np.ndarray:
+        """近似检索 top_k 行号（按分数降序）。q 为归一化 float32 (d,) 稠密查询向量。"""
+        from vector_store import top_k_indices
+        rows, pos = self.candidates(q, nprobe or self.nprobe)
+        if len(rows) == 0:
+            return rows
+        if self.codes is not None and len(rows) > top_k * PQ_RERANK_FACTOR:
+            # ADC：查询各段与全部码字的内积表，候选得分 = 各段查表求和
+            q_parts = _split(q[None, :], self.pq_m, self.dsub)[0]
+            table = np.einsum("md,mkd->mk", q_parts, self.codebooks)
+            codes = np.asarray(self.codes[pos], dtype=np.int64)
+            approx = table[np.arange(self.pq_m), codes].sum(axis=1)
+            short = top_k_indices(approx, top_k * PQ_RERANK_FACTOR)
+            rows = rows[short]
+        exact = store.score_rows(q, rows)
+        return rows[top_k_indices(exact, top_k)]
+
+
+def load_ann(index_dir: str, store=None) -> Optional[AnnIndex]:
+    """加载 ANN 索引；不存在、损坏或与向量库行数/维度不一致时返回 None。"""
+    if not os.path.isfile(os.path.join(index_dir, ANN_META_FILE)):
+        return None
+    try:
+        index = AnnIndex(index_dir)
+    except Exception:
+        return None
+    if store is not None and (index.rows != len(store) or index.meta.get("dim") != store.dim):
+        return None
+    return index
+
+
+def recall_report(
+    store, index: AnnIndex, queries: List[np.ndarray], top_k: int = 5, nprobes=(1, 2, 4, 8, 16, 32)
+) -> List[dict]:
+    """对比 ANN 与精确检索：各 nprobe 下的 recall@k、平均候选数与平均耗时（毫秒）。"""
+    from vector_store import top_k_indices
+    t0 = time.perf_counter()
+    truth = [set(top_k_indices(store.score(q), top_k).tolist()) for q in queries]
+    exact_ms = (time.perf_counter() - t0) * 1000 / max(len(queries), 1)
+    report = [{"nprobe": "exact", "recall": 1.0, "candidates": len(store), "ms": round(exact_ms, 3)}]
+    for nprobe in nprobes:
+        if nprobe > index.nlist:
+            break
+        hits = 0
+        n_cand = 0
+        t0 = time.perf_counter()
+        for q, gt in zip(queries, truth):
+            found = index.search(store, q, top_k, nprobe)
+            hits += len(gt & set(found.tolist()))
+        elapsed = (time.perf_counter() - t0) * 1000 / max(len(queries), 1)
+        for q in queries:
+            n_cand += len(index.candidates(q, nprobe)[0])
+        report.append({
+            "nprobe": nprobe,
+            "recall": round(hits / max(sum(len(gt) for gt in truth), 1), 4),
+            "candidates": round(n_cand / max(len(queries), 1), 1),
+            "ms": round(elapsed, 3),
+        })
+    return report
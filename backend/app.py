@@ -10,11 +10,15 @@ from dotenv import load_dotenv
 from werkzeug.security import generate_password_hash, check_password_hash
 from functools import wraps
 from datetime import datetime, timedelta
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
 import os
+import threading
+import time
 import json
 import jwt  # PyJWT —— 注意：Python 里 import 名是 jwt，包名是 PyJWT
 
 import database as db
+import intent
 import rag
 from divination import (
     get_time_context, compute_bazi,
@@ -247,6 +251,7 @@ def delete_conversation(conversation_id):
     if not db.conversation_belongs_to_user(conversation_id, request.user_id):
         return jsonify({"error": "无权操作"}), 403
     db.delete_conversation(conversation_id)
+    rag.forget_conversation(conversation_id)
     return jsonify({"success": True})
 
 
@@ -395,13 +400,356 @@ def run_divination_tool(name, arguments):
         return f"工具执行出错: {str(e)}"
 
 
+# 工具结果的这些开头表示没有算出结果：不预先注入，也不记入备忘
+_TOOL_ERROR_PREFIXES = ("工具执行出错", "工具执行超时", "八字排盘出错", "八字排盘功能需要安装", "未知工具")
+
+
+def memo_key(name, arguments):
+    """
+    工具调用的规范化参数（JSON，键排序、补齐默认值），同一对话中 key 相同的调用直接复用之前的结果；
+    按当前时间起卦的梅花/六爻每次结果不同，返回 None（不复用）。
+    """
+    try:
+        args = json.loads(arguments) if isinstance(arguments, str) else (arguments or {})
+        if name == "get_bazi":
+            key = {
+                "year": int(args.get("year", 2000)), "month": int(args.get("month", 1)),
+                "day": int(args.get("day", 1)), "hour": int(args.get("hour", 12)),
+                "minute": int(args.get("minute", 0)),
+                "is_male": bool(args.get("is_male", True)), "is_solar": bool(args.get("is_solar", True)),
+            }
+        elif name in ("get_meihua", "get_liuyao") and args.get("numbers") and len(args["numbers"]) >= 3:
+            key = {"numbers": [int(n) for n in args["numbers"][:3]]}
+        else:
+            return None
+    except Exception:
+        return None
+    return name + ":" + json.dumps(key, sort_keys=True)
+
+
+class ToolMemo:
+    """
+    一个对话的工具结果备忘（持久化在 tool_results 表）：
+    lookup 按 memo_key 取之前算过的结果，record 把本轮新算出的结果挂到本轮用户消息上。
+    record 读写数据库，是阻塞调用。
+    """
+
+    def __init__(self, conversation_id, message_id, rows):
+        self.conversation_id = conversation_id
+        self.message_id = message_id
+        self.results = {row["memo_key"]: row["result"] for row in rows if row["memo_key"]}
+
+    def lookup(self, call):
+        key = memo_key(call["function"]["name"], call["function"]["arguments"])
+        return self.results.get(key) if key else None
+
+    def record(self, call, result):
+        # 出错、超时的结果不记录，下次重新计算
+        if result.startswith(_TOOL_ERROR_PREFIXES):
+            return
+        name, arguments = call["function"]["name"], call["function"]["arguments"]
+        key = memo_key(name, arguments)
+        if key in self.results:
+            return
+        db.add_tool_result(self.conversation_id, self.message_id, name, arguments, key, result)
+        if key:
+            self.results[key] = result
+
+
+def replay_tool_results(history, rows):
+    """
+    把历史消息与之前轮次的工具结果合成为 OpenAI 格式的消息列表：每条用户消息之后，
+    紧跟它那一轮执行过的工具调用与结果（assistant tool_calls + tool），模型追问时无需重新排盘。
+    无论本轮意图是否带工具都会回放；prepare_chat 经 chat_tool_kwargs 为回放引用的工具声明 schema。
+    """
+    by_message = {}
+    for row in rows:
+        by_message.setdefault(row["message_id"], []).append(row)
+    messages = []
+    for msg in history:
+        messages.append({"role": msg["role"], "content": msg["content"]})
+        if msg["role"] == "user" and msg.get("id") in by_message:
+            add_tool_round(messages, None, [
+                ({"id": f"call_memo_{row['id']}", "type": "function",
+                  "function": {"name": row["name"], "arguments": row["arguments"]}}, row["result"])
+                for row in by_message[msg["id"]]
+            ])
+    return messages
+
+
+def prefetch_bazi(user_message, previous, memo):
+    """
+    本地提取出生信息后直接排盘，返回 OpenAI 格式的 (tool_call, 结果)，供 prepare_chat 注入消息列表；
+    模型拿到的就像自己调用过 get_bazi 一样，直接开始解读，省去一整轮模型往返。
+    依次看本轮消息与之前的用户消息（从近到远），用最近一条提到出生信息的消息；
+    置信度不够（见 intent.extract_birth）或排盘失败时返回 None，仍由模型按需调用工具。
+    排盘前先查备忘：出生信息来自之前的消息、当时已排过盘（结果存于 tool_results，由 replay_tool_results
+    回放在那一轮之后）时返回 None，不重复计算也不重复注入；新排的盘记入备忘，后续轮次同样回放。
+    """
+    if not intent.PREFETCH_ENABLED:
+        return None
+    # 只看最近一条提到出生信息的用户消息，它解析不了时不再往前找，以免用上过时的出生信息
+    message = next((m for m in [user_message, *reversed(previous)] if intent.has_birth_info(m)), None)
+    args = intent.extract_birth(message) if message else None
+    if args is None:
+        return None
+    call = {
+        "id": "call_prefetch_bazi", "type": "function",
+        "function": {"name": "get_bazi", "arguments": json.dumps(args, ensure_ascii=False)},
+    }
+    if memo.lookup(call) is not None:
+        return None
+    result = run_divination_tool("get_bazi", call["function"]["arguments"])
+    if result.startswith(_TOOL_ERROR_PREFIXES):
+        return None
+    memo.record(call, result)
+    return call, result
+
+
+# 同一轮的多个工具调用（两人合盘、梅花与六爻一起起卦）并行执行：有界线程池，每个调用单独计时。
+# Python 线程无法从外部中止：超时的工具仍占着所在线程池的一个线程，直到它自己返回。为免几次卡死就占满
+# 线程池、拖住此后所有工具调用，一旦有调用超时就换一个新线程池给后续调用（旧池 shutdown(wait=False)，
+# 其中的线程在各自的工具返回后退出）。代价是卡死的线程一直留在进程里，数量不超过超时次数 × TOOL_THREADS。
+TOOL_THREADS = int(os.getenv("TOOL_THREADS", "4"))
+TOOL_TIMEOUT = float(os.getenv("TOOL_TIMEOUT", "10"))
+_tool_pool_lock = threading.Lock()
+
+
+def _new_tool_pool():
+    return ThreadPoolExecutor(max_workers=TOOL_THREADS, thread_name_prefix="divination-tool")
+
+
+_tool_pool = _new_tool_pool()
+
+
+def tool_timeout_result(call):
+    """工具超时时交给模型的结果文本。"""
+    return f"工具执行超时: {call['function']['name']}（超过 {TOOL_TIMEOUT:g} 秒），请提示用户稍后重试"
+
+
+def submit_tool(call, memo=None):
+    """
+    把一个完整的 tool_call 提交到工具线程池，返回 (call, future, 截止时间, 线程池)；
+    备忘中已有结果时不再计算（线程池为 None）。
+    """
+    cached = memo.lookup(call) if memo is not None else None
+    if cached is not None:
+        future = Future()
+        future.set_result(cached)
+        return call, future, time.monotonic() + TOOL_TIMEOUT, None
+    with _tool_pool_lock:
+        pool = _tool_pool
+        future = pool.submit(run_divination_tool, call["function"]["name"], call["function"]["arguments"])
+    return call, future, time.monotonic() + TOOL_TIMEOUT, pool
+
+
+def abandon_tool(call, pool):
+    """放弃一个超时的调用：它所在的线程池若仍是当前线程池则换掉（见 TOOL_THREADS 处的说明），返回超时结果。"""
+    global _tool_pool
+    with _tool_pool_lock:
+        retired = pool is not None and pool is _tool_pool
+        if retired:
+            _tool_pool = _new_tool_pool()
+    if retired:
+        pool.shutdown(wait=False)
+        print(f"⚠️ 工具 {call['function']['name']} 执行超过 {TOOL_TIMEOUT:g} 秒，已换用新的工具线程池")
+    return tool_timeout_result(call)
+
+
+def collect_tools(pending):
+    """按提交顺序取回工具结果，返回 [(call, 结果)]；每个调用从提交起最多等 TOOL_TIMEOUT 秒。"""
+    results = []
+    for call, future, deadline, pool in pending:
+        try:
+            result = future.result(timeout=max(deadline - time.monotonic(), 0))
+        except FutureTimeout:
+            result = abandon_tool(call, pool)
+        results.append((call, result))
+    return results
+
+
+# 每轮请求模型的公共参数（同步 client 与 asgi.py 的异步 client 共用）
+CHAT_COMPLETION_KWARGS = {"model": "DeepSeek-V3.2-Exp", "temperature": 0.8, "max_tokens": 2000}
+
+
+class ToolCallAssembler:
+    """
+    把流式返回的 tool_call 增量拼装为完整调用（OpenAI 格式 dict）：
+    同一 index 的 id / name 只出现一次，arguments 分多段拼接；下一个 index 开始或流结束时，上一个调用即已完整。
+    """
+
+    def __init__(self):
+        self.pending = {}  # index -> {"id", "type", "function": {"name", "arguments"}}
+        self.current = None
+
+    def _finish(self, index):
+        call = self.pending.pop(index)
+        call["function"]["arguments"] = call["function"]["arguments"] or "{}"
+        return call
+
+    def feed(self, tool_calls) -> list:
+        """处理一个 delta 里的 tool_calls 增量，返回因此变得完整的调用。"""
+        done = []
+        for tc in tool_calls or []:
+            index = getattr(tc, "index", None)
+            if index is None:
+                # 个别兼容接口不给 index：带 id 的增量视为新调用，否则续接当前调用
+                index = 0 if self.current is None else self.current + 1 if tc.id else self.current
+            if index != self.current and self.current in self.pending:
+                done.append(self._finish(self.current))
+            self.current = index
+            call = self.pending.setdefault(index, {
+                "id": "", "type": "function", "function": {"name": "", "arguments": ""},
+            })
+            if tc.id:
+                call["id"] = tc.id
+            fn = getattr(tc, "function", None)
+            if fn is not None:
+                if fn.name:
+                    call["function"]["name"] = fn.name
+                if fn.arguments:
+                    call["function"]["arguments"] += fn.arguments
+        return done
+
+    def flush(self) -> list:
+        """流结束：剩余的调用全部完整。"""
+        return [self._finish(index) for index in sorted(self.pending)]
+
+
+def chunk_delta(chunk):
+    """流式 chunk 的第一个 choice 的 delta；无 choices 时返回 None。"""
+    return chunk.choices[0].delta if chunk.choices else None
+
+
+def stream_completion(messages, tool_kwargs, memo=None):
+    """
+    流式请求一轮模型回复，逐个产出事件：
+      ("content", 文本增量)          模型输出的文本，到达即产出
+      ("tool", (tool_call, 结果))    OpenAI 格式的 tool_call 与工具结果，流结束后按调用顺序产出
+    工具调用拼装完整后立即提交到工具线程池，与后续增量的接收及同一轮的其他工具并行执行，
+    多个工具的总耗时约等于最慢的那个；单个工具超过 TOOL_TIMEOUT 秒时以超时说明作为结果。
+    传入 memo（ToolMemo）时，本对话算过的同样调用直接取备忘，新结果写入备忘。
+    """
+    stream = client.chat.completions.create(messages=messages, stream=True, **CHAT_COMPLETION_KWARGS, **tool_kwargs)
+    assembler = ToolCallAssembler()
+    pending = []
+    for chunk in stream:
+        delta = chunk_delta(chunk)
+        if delta is None:
+            continue
+        if getattr(delta, "content", None):
+            yield "content", delta.content
+        pending.extend(submit_tool(call, memo) for call in assembler.feed(getattr(delta, "tool_calls", None)))
+    pending.extend(submit_tool(call, memo) for call in assembler.flush())
+    for call, result in collect_tools(pending):
+        if memo is not None:
+            memo.record(call, result)
+        yield "tool", (call, result)
+
+
+def add_tool_round(messages, round_text, calls):
+    """将 assistant 的 tool_calls 消息与各工具结果加入消息列表（OpenAI 格式），供下一轮请求。"""
+    messages.append({
+        "role": "assistant",
+        "content": round_text or None,
+        "tool_calls": [call for call, _ in calls],
+    })
+    for call, result in calls:
+        messages.append({
+            "role": "tool",
+            "tool_call_id": call["id"],
+            "content": result,
+        })
+
+
+# SSE 响应头：禁止缓存，并让 nginx 等反向代理不缓冲，增量到达即下发
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+def sse(payload) -> str:
+    """一条 SSE 数据行；payload 为 dict 时 JSON 编码，字符串原样发送（如 [DONE]）。"""
+    data = payload if isinstance(payload, str) else json.dumps(payload, ensure_ascii=False)
+    return f"data: {data}\n\n"
+
+
+def chat_tool_kwargs(names, messages):
+    """
+    本轮请求模型的 tools 参数。names 为 intent.classify 选中的工具，可由模型调用；
+    messages 中回放了之前轮次的工具调用时，被引用的工具也带上 schema——不少 OpenAI 兼容服务
+    在请求不带 tools 时拒绝 role=tool 的消息。本轮没有选中任何工具（闲聊）时以 tool_choice="none"
+    只声明、不允许调用。
+    """
+    replayed = {c["function"]["name"] for m in messages for c in m.get("tool_calls") or ()}
+    tools = [t for t in DIVINATION_TOOLS if t["function"]["name"] in names or t["function"]["name"] in replayed]
+    if not tools:
+        return {}
+    return {"tools": tools, "tool_choice": "auto" if names else "none"}
+
+
+def prepare_chat(conversation_id, user_message):
+    """
+    一轮对话请求模型前的准备：保存用户消息、读取历史、意图分类、检索知识库、组装消息列表，
+    之前轮次的工具结果从备忘回放，能在本地提取出生信息时预先排盘（prefetch_bazi）；
+    tools 参数在消息列表组装完后按意图与回放内容一起决定（chat_tool_kwargs）。
+    返回 (history, messages, tool_kwargs, memo)。全是阻塞调用（数据库、检索、排盘），asgi.py 在线程池中执行。
+    """
+    # 保存用户消息
+    db.add_message(conversation_id, "user", user_message)
+
+    # 获取该对话的历史消息，构建上下文
+    history = db.get_conversation_messages(conversation_id)
+
+    # 本地意图分类：闲聊不检索、不允许调用工具；其余按需暴露排盘工具（见 intent.py 与 chat_tool_kwargs）
+    previous = [m["content"] for m in history[:-1] if m["role"] == "user"]
+    turn = intent.classify(user_message, previous)
+
+    # ---- 动态构建系统提示词：时间上下文 + RAG 知识库检索（第一层「喂书」）----
+    time_ctx = get_time_context()
+    system_content = SYSTEM_PROMPT + "\n\n" + time_ctx
+    # 根据用户问题检索命理知识库，若有结果则注入供模型参考；追问时沿用/扩展本对话上一轮的检索结果
+    if turn.retrieve:
+        knowledge_ref = rag.retrieve_for_conversation(conversation_id, user_message, top_k=5)
+        if knowledge_ref:
+            system_content += "\n\n" + knowledge_ref
+
+    # 构建发送给大模型的消息列表：历史消息，以及之前轮次执行过的工具调用与结果
+    tool_rows = db.get_tool_results(conversation_id)
+    memo = ToolMemo(conversation_id, history[-1]["id"], tool_rows)
+    messages = [{"role": "system", "content": system_content}]
+    messages.extend(replay_tool_results(history, tool_rows))
+
+    # 本轮要暴露 get_bazi 且能在本地提取出生信息时先排盘，作为已完成的工具调用注入
+    # （get_bazi 仍保留在工具列表中，合婚等需要再排一盘时模型可以自己调用）
+    if "get_bazi" in turn.tools:
+        prefetched = prefetch_bazi(user_message, previous, memo)
+        if prefetched is not None:
+            add_tool_round(messages, None, [prefetched])
+    tool_kwargs = chat_tool_kwargs(turn.tools, messages)
+    return history, messages, tool_kwargs, memo
+
+
+def save_reply(conversation_id, history, user_message, full_response):
+    """保存 AI 回复；若是对话的第一轮，用用户消息生成标题并返回，否则返回 None。"""
+    if not full_response:
+        return None
+    db.add_message(conversation_id, "assistant", full_response)
+    if len(history) == 1:
+        title = user_message[:20] + ("..." if len(user_message) > 20 else "")
+        db.update_conversation_title(conversation_id, title)
+        return title
+    return None
+
+
 @app.route("/api/conversations/<conversation_id>/chat", methods=["POST"])
 @login_required
 def chat(conversation_id):
     """
     发送消息并获取 AI 流式回复
     支持 Function Calling：AI 可主动调用 get_bazi / get_meihua / get_liuyao 获取准确排盘后再解读
-    使用 SSE (Server-Sent Events) 实现流式输出
+    （本轮暴露哪些工具、是否检索知识库由 intent.classify 决定，闲聊两者都不带）
+    使用 SSE (Server-Sent Events) 实现流式输出：每轮都以 stream=True 请求模型，文本增量到达即转发，
+    tool_calls 从增量中拼装，某个调用完整后立即提交到工具线程池，同一轮的多个工具并行执行（见 stream_completion）
+    异步部署（asgi.py）以协程实现同一接口，本函数为 WSGI 部署与本地开发使用
     """
     if not db.conversation_belongs_to_user(conversation_id, request.user_id):
         return jsonify({"error": "无权操作"}), 403
@@ -412,121 +760,44 @@ def chat(conversation_id):
     if not user_message:
         return jsonify({"error": "消息不能为空"}), 400
 
-    # 保存用户消息
-    db.add_message(conversation_id, "user", user_message)
-
-    # 获取该对话的历史消息，构建上下文
-    history = db.get_conversation_messages(conversation_id)
-
-    # ---- 动态构建系统提示词：时间上下文 + RAG 知识库检索（第一层「喂书」）----
-    time_ctx = get_time_context()
-    system_content = SYSTEM_PROMPT + "\n\n" + time_ctx
-    # 根据用户问题检索命理知识库，若有结果则注入供模型参考
-    knowledge_ref = rag.retrieve(user_message, top_k=5)
-    if knowledge_ref:
-        system_content += "\n\n" + knowledge_ref
-
-    # 构建发送给大模型的消息列表
-    messages = [{"role": "system", "content": system_content}]
-    for msg in history:
-        messages.append({"role": msg["role"], "content": msg["content"]})
+    history, messages, tool_kwargs, memo = prepare_chat(conversation_id, user_message)
 
     def generate():
-        """生成器函数，用于流式返回 AI 回复；内部可能先执行工具再流式输出"""
+        """生成器函数：每一轮都流式请求模型，文本增量到达即转发；有 tool_calls 时执行工具后再请求下一轮"""
         full_response = ""
         try:
-            # 第一轮：带 tools 的非流式调用，以便处理 tool_calls
-            resp = client.chat.completions.create(
-                model="DeepSeek-V3.2-Exp",
-                messages=messages,
-                stream=False,
-                temperature=0.8,
-                max_tokens=2000,
-                tools=DIVINATION_TOOLS,
-                tool_choice="auto",
-            )
-            choice = resp.choices[0] if resp.choices else None
-            if not choice:
-                yield f"data: {json.dumps({'error': '模型未返回有效内容'}, ensure_ascii=False)}\n\n"
-                yield "data: [DONE]\n\n"
+            received = False
+            while True:
+                round_text, calls = "", []
+                for kind, payload in stream_completion(messages, tool_kwargs, memo):
+                    received = True
+                    if kind == "content":
+                        round_text += payload
+                        full_response += payload
+                        yield sse({"content": payload})
+                    else:
+                        calls.append(payload)
+                if not calls:
+                    break
+                # 继续请求，可能再次返回 tool_calls 或最终文本
+                add_tool_round(messages, round_text, calls)
+
+            if not received:
+                yield sse({"error": "模型未返回有效内容"})
+                yield sse("[DONE]")
                 return
 
-            message = choice.message
-            # 若有 tool_calls，执行工具并把结果加入消息，再请求一轮（流式）
-            while getattr(message, "tool_calls", None):
-                tool_calls = message.tool_calls
-                # 将 assistant 的 tool_calls 消息加入列表（OpenAI 格式）
-                assistant_msg = {
-                    "role": "assistant",
-                    "content": message.content or None,
-                    "tool_calls": [
-                        {
-                            "id": tc.id,
-                            "type": "function",
-                            "function": {"name": tc.function.name, "arguments": tc.function.arguments},
-                        }
-                        for tc in tool_calls
-                    ],
-                }
-                messages.append(assistant_msg)
-
-                for tc in tool_calls:
-                    name = tc.function.name
-                    args_str = tc.function.arguments or "{}"
-                    result = run_divination_tool(name, args_str)
-                    messages.append({
-                        "role": "tool",
-                        "tool_call_id": tc.id,
-                        "content": result,
-                    })
-
-                # 继续请求，可能再次返回 tool_calls 或最终文本
-                resp = client.chat.completions.create(
-                    model="DeepSeek-V3.2-Exp",
-                    messages=messages,
-                    stream=False,
-                    temperature=0.8,
-                    max_tokens=2000,
-                    tools=DIVINATION_TOOLS,
-                    tool_choice="auto",
-                )
-                choice = resp.choices[0] if resp.choices else None
-                if not choice:
-                    break
-                message = choice.message
-
-            # 最终回复内容
-            final_content = getattr(message, "content", None) or ""
-            if final_content:
-                # 流式模拟：按小块发送，前端可逐段渲染
-                chunk_size = 80
-                for i in range(0, len(final_content), chunk_size):
-                    chunk = final_content[i : i + chunk_size]
-                    full_response += chunk
-                    yield f"data: {json.dumps({'content': chunk}, ensure_ascii=False)}\n\n"
-
-            if full_response:
-                db.add_message(conversation_id, "assistant", full_response)
-                if len(history) == 1:
-                    title = user_message[:20] + ("..." if len(user_message) > 20 else "")
-                    db.update_conversation_title(conversation_id, title)
-                    yield f"data: {json.dumps({'title_update': title}, ensure_ascii=False)}\n\n"
-
-            yield "data: [DONE]\n\n"
+            title = save_reply(conversation_id, history, user_message, full_response)
+            if title:
+                yield sse({"title_update": title})
+            yield sse("[DONE]")
 
         except Exception as e:
             error_msg = f"抱歉，AI 服务暂时出现问题：{str(e)}"
-            yield f"data: {json.dumps({'error': error_msg}, ensure_ascii=False)}\n\n"
-            yield "data: [DONE]\n\n"
-
-    return Response(
-        generate(),
-        mimetype="text/event-stream",
-        headers={
-            "Cache-Control": "no-cache",
-            "X-Accel-Buffering": "no",
-        },
-    )
+            yield sse({"error": error_msg})
+            yield sse("[DONE]")
+
+    return Response(generate(), mimetype="text/event-stream", headers=SSE_HEADERS)
 
 
 # ============================================================
@@ -583,13 +854,39 @@ def api_time_context():
     return jsonify({"result": get_time_context()})
 
 
+@app.route("/api/rag/cache-stats", methods=["GET"])
+@login_required
+def api_rag_cache_stats():
+    """知识库检索缓存统计（命中率、淘汰次数、估算节省耗时等）"""
+    return jsonify(rag.cache_stats())
+
+
 # ============================================================
 #  启动
 # ============================================================
 
+_initialized = False
+
+
+def create_app():
+    """应用工厂：初始化数据库，并按 RAG_WARMUP（默认开启）预热知识库，返回 Flask app。
+    gunicorn 以 "app:create_app()" 加 preload_app 启动时只在 master 中执行一次，
+    fork 出的 worker 共享已加载的知识库结构，首个对话不再承担冷加载耗时（见 gunicorn.conf.py）。"""
+    global _initialized
+    if not _initialized:
+        db.init_db()
+        if os.getenv("RAG_WARMUP", "1") != "0":
+            timings = rag.warmup()
+            print(f"📚 知识库预热完成: {timings}")
+        _initialized = True
+    return app
+
+
 if __name__ == "__main__":
     # Zeabur / Railway 等平台通过 PORT 环境变量指定端口
     port = int(os.getenv("PORT", 5000))
     print("🔮 AI+玄学 后端服务启动中...")
     print(f"📡 API 地址: http://localhost:{port}")
+    create_app()
+    rag.start_reloader()
     app.run(debug=True, port=port, host="0.0.0.0")
@@ -0,0 +1,171 @@
+"""
+ASGI 入口 —— 长时间的 SSE 对话不再占住同步 worker
+
+/api/conversations/<id>/chat 由协程处理：AsyncOpenAI（httpx 异步连接池）流式请求模型，等待模型输出期间
+不占线程，一个进程可同时维持数百路流式对话；数据库读写、意图分类与知识库检索这些阻塞调用放进有界线程池
+（ASGI_THREADS，默认 16）执行，不阻塞事件循环；排盘工具（compute_bazi 等）与同步部署一样在 app 的工具线程池中执行。
+其余接口仍是 app.py 中的 Flask 路由，经 a2wsgi 挂载（自带 ASGI_WSGI_THREADS 个线程，默认 16），
+/api/auth/me 等短请求不会排在对话后面。请求/响应格式、SSE 事件与 app.chat 完全一致，前端无需改动。
+
+启动：cd backend && gunicorn -c gunicorn.conf.py -k uvicorn_worker.UvicornWorker asgi:app
+本地：cd backend && uvicorn asgi:app --port 5000
+"""
+
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from a2wsgi import WSGIMiddleware
+from openai import AsyncOpenAI
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Mount, Route
+
+import app as wsgi
+import database as db
+
+# 阻塞调用（数据库、检索、排盘）用的有界线程池
+_pool = ThreadPoolExecutor(
+    max_workers=int(os.getenv("ASGI_THREADS", "16")),
+    thread_name_prefix="asgi-blocking",
+)
+
+# 异步 OpenAI 兼容客户端（SophNet），与 app.client 配置相同
+async_client = AsyncOpenAI(
+    api_key=os.getenv("SOPHNET_API_KEY"),
+    base_url=os.getenv("SOPHNET_BASE_URL"),
+)
+
+# 与 flask-cors 默认配置一致：允许任意来源
+_CORS_HEADERS = {"Access-Control-Allow-Origin": "*"}
+
+
+async def run_blocking(fn, *args, **kwargs):
+    """在有界线程池中执行阻塞调用，不阻塞事件循环"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_pool, partial(fn, *args, **kwargs))
+
+
+def _json(data, status_code=200):
+    return JSONResponse(data, status_code=status_code, headers=_CORS_HEADERS)
+
+
+def _authenticate(request):
+    """与 app.login_required 相同的 Bearer Token 校验，返回 (user_id, 错误响应)"""
+    auth_header = request.headers.get("Authorization", "")
+    token = auth_header.replace("Bearer ", "") if auth_header.startswith("Bearer ") else ""
+    if not token:
+        return None, _json({"error": "请先登录"}, 401)
+    payload = wsgi.verify_token(token)
+    if not payload:
+        return None, _json({"error": "登录已过期，请重新登录"}, 401)
+    return payload["user_id"], None
+
+
+async def _run_tool(call, memo):
+    """
+    在 app 的工具线程池中执行一个工具调用（备忘中已有结果时直接返回），超过 app.TOOL_TIMEOUT 秒返回超时说明。
+    不放进 _pool：卡死的工具只会占住工具线程池（超时后由 app.abandon_tool 换掉），不影响数据库与检索。
+    """
+    _, future, deadline, pool = wsgi.submit_tool(call, memo)
+    try:
+        return await asyncio.wait_for(asyncio.wrap_future(future), timeout=max(deadline - time.monotonic(), 0))
+    except asyncio.TimeoutError:
+        return wsgi.abandon_tool(call, pool)
+
+
+async def stream_completion(messages, tool_kwargs, memo):
+    """
+    app.stream_completion 的异步版本：事件格式相同，工具调用完整后立即作为任务并发执行，流结束后按顺序产出；
+    本对话算过的同样调用取备忘，新结果在线程池中写入备忘
+    """
+    stream = await async_client.chat.completions.create(
+        messages=messages, stream=True, **wsgi.CHAT_COMPLETION_KWARGS, **tool_kwargs
+    )
+    assembler = wsgi.ToolCallAssembler()
+    pending = []
+    async for chunk in stream:
+        delta = wsgi.chunk_delta(chunk)
+        if delta is None:
+            continue
+        if getattr(delta, "content", None):
+            yield "content", delta.content
+        for call in assembler.feed(getattr(delta, "tool_calls", None)):
+            pending.append((call, asyncio.ensure_future(_run_tool(call, memo))))
+    for call in assembler.flush():
+        pending.append((call, asyncio.ensure_future(_run_tool(call, memo))))
+    for call, task in pending:
+        result = await task
+        await run_blocking(memo.record, call, result)
+        yield "tool", (call, result)
+
+
+async def chat(request):
+    """发送消息并获取 AI 流式回复（协程版 app.chat）"""
+    user_id, error = _authenticate(request)
+    if error is not None:
+        return error
+    conversation_id = request.path_params["conversation_id"]
+    if not await run_blocking(db.conversation_belongs_to_user, conversation_id, user_id):
+        return _json({"error": "无权操作"}, 403)
+
+    try:
+        data = await request.json()
+    except ValueError:
+        return _json({"error": "请求体不是有效的 JSON"}, 400)
+    user_message = (data.get("message") or "").strip()
+
+    if not user_message:
+        return _json({"error": "消息不能为空"}, 400)
+
+    history, messages, tool_kwargs, memo = await run_blocking(wsgi.prepare_chat, conversation_id, user_message)
+
+    async def generate():
+        """每一轮都流式请求模型，文本增量到达即转发；有 tool_calls 时执行工具后再请求下一轮"""
+        full_response = ""
+        try:
+            received = False
+            while True:
+                round_text, calls = "", []
+                async for kind, payload in stream_completion(messages, tool_kwargs, memo):
+                    received = True
+                    if kind == "content":
+                        round_text += payload
+                        full_response += payload
+                        yield wsgi.sse({"content": payload})
+                    else:
+                        calls.append(payload)
+                if not calls:
+                    break
+                wsgi.add_tool_round(messages, round_text, calls)
+
+            if not received:
+                yield wsgi.sse({"error": "模型未返回有效内容"})
+                yield wsgi.sse("[DONE]")
+                return
+
+            title = await run_blocking(wsgi.save_reply, conversation_id, history, user_message, full_response)
+            if title:
+                yield wsgi.sse({"title_update": title})
+            yield wsgi.sse("[DONE]")
+
+        except Exception as e:
+            error_msg = f"抱歉，AI 服务暂时出现问题：{str(e)}"
+            yield wsgi.sse({"error": error_msg})
+            yield wsgi.sse("[DONE]")
+
+    return StreamingResponse(
+        generate(),
+        media_type="text/event-stream",
+        headers={**wsgi.SSE_HEADERS, **_CORS_HEADERS},
+    )
+
+
+# create_app() 初始化数据库并预热知识库；gunicorn preload 时只在 master 中执行一次
+app = Starlette(routes=[
+    Route("/api/conversations/{conversation_id}/chat", chat, methods=["POST"]),
+    # 预检请求（OPTIONS）与其余接口交给 Flask（含 flask-cors）
+    Mount("/", app=WSGIMiddleware(wsgi.create_app(), workers=int(os.getenv("ASGI_WSGI_THREADS", "16")))),
+])
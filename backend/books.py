@@ -0,0 +1,12 @@
+"""
+知识库书目：书 id 与显示名的对应，供运行时（rag 按书过滤检索）与离线脚本（切分 chunk、段落对齐）共用。
+chunk id 以书 id 开头（如 ditiansui_baihua_chunk_12），向量库按书 id 分片。
+"""
+
+# 书 id -> 显示名；白话 chunk 的 source 为「显示名（白话）」
+BOOK_DISPLAY = {
+    "yuanhaiziping": "渊海子平",
+    "zipingzhenquan": "子平真诠评注",
+    "sanmingtonghui": "三命通会",
+    "ditiansui": "滴天髓阐微",
+}
@@ -0,0 +1,157 @@
+"""
+命理知识库 chunk 打包存储 —— 把 knowledge/chunks 下数千个零散 JSON 打包成单个二进制文件，
+worker 启动时以只读 mmap 打开，关键词检索不再逐请求扫描目录、打开文件；
+多个 gunicorn worker 映射同一文件，共享操作系统页缓存。
+
+打包文件格式（小端）：
+  magic  b"MXCK" | version u32 | count u32 | header_len u32
+  header  UTF-8 JSON：[[id, source, tags(, 小写 content)], ...]，按 8 字节补齐；content 含大写字母
+          （拼音、英文）时才有第 4 项，关键词匹配与原先 content.lower() 的子串匹配一样不区分大小写
+  offsets (count + 1) × u64：content 在 blob 中的起止字节偏移
+  blob    各条 content 的 UTF-8 字节顺序拼接
+
+由 scripts/pack_chunks.py 构建（raw_to_chunks.py / baihua_to_chunks.py 写完 chunk 后会自动调用）。
+"""
+
+from __future__ import annotations
+
+import json
+import mmap
+import os
+import struct
+from typing import List, Optional
+
+import numpy as np
+
+_MAGIC = b"MXCK"
+_VERSION = 1
+_PREFIX = struct.Struct("<4sIII")
+
+
+def load_chunk_dir(chunks_dir: str) -> List[dict]:
+    """按文件名顺序加载 chunks 目录下所有 JSON，返回 list[dict]。
+    支持单对象或 {"chunks": [...]}；无法解析的文件跳过。"""
+    chunks = []
+    if not os.path.isdir(chunks_dir):
+        return chunks
+    for name in sorted(os.listdir(chunks_dir)):
+        if not name.endswith(".json"):
+            continue
+        path = os.path.join(chunks_dir, name)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if "chunks" in data:
+                chunks.extend(data["chunks"])
+            else:
+                chunks.append(data)
+        except Exception:
+            continue
+    return chunks
+
+
+def write_pack(chunks: List[dict], path: str) -> int:
+    """将 chunk 列表写为打包文件，返回写入条数。
+    先写临时文件再 os.replace 原子替换：正在 mmap 旧文件的 worker 不会读到半截数据。"""
+    header = []
+    offsets = [0]
+    blobs = []
+    for c in chunks:
+        text = c.get("content") or ""
+        content = text.encode("utf-8")
+        entry = [c.get("id", ""), c.get("source", ""), list(c.get("tags", []))]
+        if text.lower() != text:
+            entry.append(text.lower())
+        header.append(entry)
+        blobs.append(content)
+        offsets.append(offsets[-1] + len(content))
+
+    header_bytes = json.dumps(header, ensure_ascii=False).encode("utf-8")
+    header_bytes += b" " * (-(_PREFIX.size + len(header_bytes)) % 8)
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_PREFIX.pack(_MAGIC, _VERSION, len(header), len(header_bytes)))
+        f.write(header_bytes)
+        f.write(np.asarray(offsets, dtype="<u8").tobytes())
+        for b in blobs:
+            f.write(b)
+    os.replace(tmp_path, path)
+    return len(header)
+
+
+class ChunkPack:
+    """只读 mmap 的 chunk 打包文件。header（id/source/tags）常驻内存，content 按需从映射页解码。"""
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, count, header_len = _PREFIX.unpack_from(self._mm, 0)
+        if magic != _MAGIC or version != _VERSION:
+            self._mm.close()
+            raise ValueError(f"不是有效的 chunk 打包文件: {path}")
+        header_end = _PREFIX.size + header_len
+        self._header = json.loads(bytes(self._mm[_PREFIX.size:header_end]).decode("utf-8"))
+        self._offsets = np.frombuffer(self._mm, dtype="<u8", count=count + 1, offset=header_end)
+        self._blob_start = header_end + (count + 1) * 8
+        # 有标签的 chunk 的小写标签文本，关键词匹配用（大多数 chunk 无标签）
+        self.tags_lower = {
+            i: " ".join(h[2]).lower() for i, h in enumerate(self._header) if h[2]
+        }
+        # content 含大写字母的 chunk 的小写 content（少数几条），find_all 在其上补做不区分大小写的匹配
+        self._content_lower = {i: h[3] for i, h in enumerate(self._header) if len(h) > 3}
+
+    def __len__(self) -> int:
+        return len(self._header)
+
+    def _span(self, i: int):
+        return (
+            self._blob_start + int(self._offsets[i]),
+            self._blob_start + int(self._offsets[i + 1]),
+        )
+
+    def content(self, i: int) -> str:
+        start, end = self._span(i)
+        return self._mm[start:end].decode("utf-8")
+
+    def find_all(self, needle: bytes) -> set:
+        """返回 content 中包含该 UTF-8 字节串的 chunk 下标集合；needle 为小写时不区分大小写。
+        直接在映射页上顺序查找全部出现位置，再用 offsets 二分定位所属 chunk，不解码、不拷贝；
+        content 含大写字母的少数 chunk 另在其小写副本上匹配。"""
+        hits = set()
+        if not needle:
+            return hits
+        if self._content_lower:
+            text = needle.decode("utf-8")
+            hits.update(i for i, lower in self._content_lower.items() if text in lower)
+        blob_end = self._blob_start + int(self._offsets[-1])
+        pos = self._mm.find(needle, self._blob_start, blob_end)
+        while pos != -1:
+            rel = pos - self._blob_start
+            i = int(np.searchsorted(self._offsets, rel, side="right")) - 1
+            chunk_end = self._blob_start + int(self._offsets[i + 1])
+            if pos + len(needle) <= chunk_end:
+                hits.add(i)
+                # 同一 chunk 内的后续出现不再计数，直接跳到下一个 chunk
+                pos = self._mm.find(needle, chunk_end, blob_end)
+            else:
+                pos = self._mm.find(needle, pos + 1, blob_end)
+        return hits
+
+    def chunk_id(self, i: int) -> str:
+        return self._header[i][0]
+
+    def get(self, i: int) -> dict:
+        cid, source, tags = self._header[i][:3]
+        return {"id": cid, "source": source, "tags": tags, "content": self.content(i)}
+
+
+def open_pack(path: str) -> Optional[ChunkPack]:
+    """打开打包文件；不存在或格式不对返回 None。"""
+    if not os.path.isfile(path):
+        return None
+    try:
+        return ChunkPack(path)
+    except Exception:
+        return None
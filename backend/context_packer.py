@@ -0,0 +1,137 @@
+"""
+检索结果打包 —— 检索之后、注入系统提示词之前的一道工序，减少提示词长度（首 token 延迟与费用）：
+
+- 清理：原文 chunk 中的 HTML 实体（&#x6DF5; 等）还原为字符，合并多余空白
+- 近重复抑制：字符 shingle + MinHash 估计 Jaccard 相似度，与已选 chunk 过于相似的丢弃
+  （各书互相转引的同一段话、重复切分出的 chunk 等字面上几乎相同的文本）
+- 原文/白话去重：同一段落的原文 chunk 与白话 chunk 字面差别大（MinHash 估计的 Jaccard 实测最高 0.34），
+  按 scripts/align_chunks.py 生成的段落对齐判定，已选其一时另一种写法不再注入
+- 预算：按字符数和/或估算 token 数限制参考文本总长度，放不下时在句末标点处截断
+
+供 rag.py 在拼接参考文本前调用；参数见 pack()。
+"""
+
+from __future__ import annotations
+
+import html
+import re
+import zlib
+from typing import List, Optional
+
+import numpy as np
+
+SHINGLE_SIZE = 3
+NUM_PERM = 64
+# 截断后不足该字符数的片段不再注入（信息量太少）
+MIN_TRIM_CHARS = 80
+_SENTENCE_ENDS = "。！？；!?;\n"
+# MinHash 用的通用哈希 (a·x + b) mod p，p 为梅森素数 2^31 - 1；系数固定，签名可跨进程比较
+_PRIME = (1 << 31) - 1
+_rng = np.random.default_rng(20240601)
+_HASH_A = _rng.integers(1, _PRIME, size=NUM_PERM, dtype=np.uint64)
+_HASH_B = _rng.integers(0, _PRIME, size=NUM_PERM, dtype=np.uint64)
+
+_SPACE_RE = re.compile(r"[ \t　\xa0]+")
+_BLANK_LINES_RE = re.compile(r"\n\s*\n+")
+_NON_WORD_RE = re.compile(r"[\W_]+")
+_CJK_RE = re.compile(r"[\u3400-\u9fff\uf900-\ufaff\U00020000-\U0002ffff]")
+
+
+def clean_text(text: str) -> str:
+    """还原 HTML 实体、合并连续空白与空行。"""
+    text = html.unescape(text or "")
+    text = _SPACE_RE.sub(" ", text)
+    text = _BLANK_LINES_RE.sub("\n", text)
+    return text.strip()
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算 token 数：汉字各算 1 个，其余非空白字符按 4 个字符 1 个 token。"""
+    cjk = len(_CJK_RE.findall(text))
+    rest = len(re.sub(r"\s+", "", text)) - cjk
+    return cjk + (rest + 3) // 4
+
+
+def minhash(text: str) -> Optional[np.ndarray]:
+    """文本（去标点空白后）字符 shingle 集合的 MinHash 签名，uint64 (NUM_PERM,)；文本过短返回 None。"""
+    t = _NON_WORD_RE.sub("", text)
+    shingles = {t[i:i + SHINGLE_SIZE] for i in range(len(t) - SHINGLE_SIZE + 1)}
+    if not shingles:
+        return None
+    x = np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles), dtype=np.uint64, count=len(shingles))
+    return ((_HASH_A[:, None] * x[None, :] + _HASH_B[:, None]) % _PRIME).min(axis=1)
+
+
+def similarity(sig_a: Optional[np.ndarray], sig_b: Optional[np.ndarray]) -> float:
+    """两个 MinHash 签名估计的 Jaccard 相似度。"""
+    if sig_a is None or sig_b is None:
+        return 0.0
+    return float(np.mean(sig_a == sig_b))
+
+
+def trim_to_sentence(text: str, limit: int) -> str:
+    """截到不超过 limit 个字符，并尽量停在最后一个句末标点处；找不到句末时硬截断。"""
+    if len(text) <= limit:
+        return text
+    head = text[:limit]
+    cut = max(head.rfind(ch) for ch in _SENTENCE_ENDS)
+    if cut >= MIN_TRIM_CHARS - 1:
+        return head[:cut + 1].rstrip()
+    return head.rstrip()
+
+
+def pack(
+    chunks,
+    max_items: int,
+    max_chars: int = 0,
+    max_tokens: int = 0,
+    dup_threshold: float = 0.0,
+    paragraphs: Optional[dict] = None,
+) -> List[dict]:
+    """按检索排名依次挑选 chunk，返回内容已清理/截断的 chunk 列表（不修改原 dict）。
+    max_chars / max_tokens 为全部 content 的总预算（0 表示不限）；dup_threshold 在 (0, 1) 内时，
+    与已选 chunk 的估计 Jaccard 相似度不低于该值的 chunk 视为近重复丢弃。
+    paragraphs 为 {chunk id: 段落键列表}：与已选的另一种写法（原文 / 白话）共享段落键的 chunk 丢弃，
+    同为原文或同为白话的相邻 chunk 不受影响。"""
+    selected, signatures = [], []
+    # 已选 chunk 的段落键 -> 已出现的写法（True 为白话）
+    seen_forms = {}
+    chars_left = max_chars if max_chars > 0 else None
+    tokens_left = max_tokens if max_tokens > 0 else None
+    dedup = 0.0 < dup_threshold < 1.0
+    for c in chunks:
+        if len(selected) >= max_items:
+            break
+        if (chars_left is not None and chars_left <= 0) or (tokens_left is not None and tokens_left <= 0):
+            break
+        content = clean_text(c.get("content") or "")
+        if not content:
+            continue
+        keys = paragraphs.get(c.get("id"), ()) if paragraphs else ()
+        baihua = "_baihua_" in (c.get("id") or "")
+        if any((not baihua) in seen_forms.get(k, ()) for k in keys):
+            continue
+        if dedup:
+            sig = minhash(content)
+            if any(similarity(sig, s) >= dup_threshold for s in signatures):
+                continue
+        limit = len(content)
+        if chars_left is not None:
+            limit = min(limit, chars_left)
+        if tokens_left is not None and estimate_tokens(content) > tokens_left:
+            # 按本段的字符/token 比例折算可容纳的字符数
+            limit = min(limit, len(content) * tokens_left // max(estimate_tokens(content), 1))
+        if limit < len(content):
+            content = trim_to_sentence(content, limit)
+            if len(content) < MIN_TRIM_CHARS:
+                break
+        if dedup:
+            signatures.append(sig)
+        for k in keys:
+            seen_forms.setdefault(k, set()).add(baihua)
+        if chars_left is not None:
+            chars_left -= len(content)
+        if tokens_left is not None:
+            tokens_left -= estimate_tokens(content)
+        selected.append(dict(c, content=content))
+    return selected
@@ -1,5 +1,5 @@
 """
-SQLite 数据库模块 —— 管理用户、对话和消息的持久化存储
+SQLite 数据库模块 —— 管理用户、对话、消息和工具结果的持久化存储
 """
 
 import sqlite3
@@ -62,6 +62,23 @@ def init_db():
         )
     """)
 
+    # 工具结果表：对话中执行过的排盘/起卦及结果，挂在触发它的用户消息上，后续轮次回放给模型；
+    # memo_key 为规范化的调用参数（按时间起卦等结果会变的调用为 NULL，只回放不复用）
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS tool_results (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            conversation_id TEXT NOT NULL,
+            message_id INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            arguments TEXT NOT NULL,
+            memo_key TEXT,
+            result TEXT NOT NULL,
+            created_at TEXT NOT NULL,
+            UNIQUE (conversation_id, memo_key),
+            FOREIGN KEY (conversation_id) REFERENCES conversations(id) ON DELETE CASCADE
+        )
+    """)
+
     # 检查 conversations 表是否有 user_id 列（兼容旧数据库）
     cursor.execute("PRAGMA table_info(conversations)")
     columns = [col[1] for col in cursor.fetchall()]
@@ -203,6 +220,37 @@ def add_message(conversation_id, role, content):
     return {"role": role, "content": content, "created_at": now}
 
 
+def add_tool_result(conversation_id, message_id, name, arguments, memo_key, result):
+    """记录一次工具调用及结果；同一对话中 memo_key 相同的调用只保留第一次"""
+    conn = get_connection()
+    cursor = conn.cursor()
+
+    cursor.execute(
+        "INSERT OR IGNORE INTO tool_results "
+        "(conversation_id, message_id, name, arguments, memo_key, result, created_at) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+        (conversation_id, message_id, name, arguments, memo_key, result, datetime.now().isoformat()),
+    )
+
+    conn.commit()
+    conn.close()
+
+
+def get_tool_results(conversation_id):
+    """获取指定对话的所有工具结果，按记录顺序"""
+    conn = get_connection()
+    cursor = conn.cursor()
+
+    cursor.execute(
+        "SELECT * FROM tool_results WHERE conversation_id = ? ORDER BY id ASC",
+        (conversation_id,),
+    )
+    rows = [dict(row) for row in cursor.fetchall()]
+
+    conn.close()
+    return rows
+
+
 def update_conversation_title(conversation_id, title):
     """更新对话标题"""
     conn = get_connection()
@@ -218,10 +266,11 @@ def update_conversation_title(conversation_id, title):
 
 
 def delete_conversation(conversation_id):
-    """删除对话及其所有消息"""
+    """删除对话及其所有消息、工具结果"""
     conn = get_connection()
     cursor = conn.cursor()
 
+    cursor.execute("DELETE FROM tool_results WHERE conversation_id = ?", (conversation_id,))
     cursor.execute("DELETE FROM messages WHERE conversation_id = ?", (conversation_id,))
     cursor.execute("DELETE FROM conversations WHERE id = ?", (conversation_id,))
 
@@ -241,7 +290,3 @@ def conversation_belongs_to_user(conversation_id, user_id):
     if not row:
         return False
     return row['user_id'] == user_id
-
-
-# 模块被导入时自动初始化数据库
-init_db()
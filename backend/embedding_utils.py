@@ -2,16 +2,28 @@
 命理知识库向量化：使用字符级 n-gram TF-IDF 生成 embedding，
 纯 Python + numpy 实现，不依赖外部 ML 库，兼容 Python 3.14 且内存友好。
 供 build_vector_store.py 构建向量库，rag.py 做语义检索。
+既可输出稠密向量（embed_texts / embed_query），也可输出 CSR 稀疏行（embed_texts_sparse / embed_query_sparse）。
+
+编码按批向量化：整批文本一次转为 Unicode 码点数组，单字/二字 n-gram 编码为整数键，
+用查表 + searchsorted 映射到词表下标，再用 np.unique / np.bincount 一次性累加词频、
+计算 TF-IDF 与行归一化；不再逐条文本、逐 n-gram 做 Python 循环与字符串拼接。
+构建大规模向量库时可用 workers 参数开多进程分片编码。
+
+词表以二进制存于向量库目录：vocab_keys.npy（已排序的 n-gram 整数键）、vocab_ids.npy（对应词表下标）、
+idf.npy（按词表下标排列），加载时直接得到查表结构，不解析 JSON、不建 token -> 下标的 dict。
+
+可选的 LSA 投影（lsa.py，build_vector_store.py --lsa-dim 构建）：向量库目录下有 lsa_projection.npy 时，
+embed_texts / embed_query 输出投影到 k 维并重新归一化的稠密向量；稀疏接口始终输出 TF-IDF。
+
+词表与投影打包为只读的 Vocab 对象，随向量库版本（store_versions）一起加载；各编码函数可显式传入 vocab，
+热切换版本时 rag 把新词表与新向量库一起换入，单次检索内查询编码与打分始终用同一版本。
 """
 
 from __future__ import annotations
 
 import json
-import math
 import os
-import re
-from collections import Counter
-from typing import List, Optional
+from typing import List, Optional, Tuple
 
 import numpy as np
 
@@ -24,122 +36,333 @@ MAX_VOCAB = 8000
 MIN_DF = 2
 # 最大文档频率比例（超过 80% 文档都出现的 n-gram 丢弃）
 MAX_DF_RATIO = 0.80
+# 多进程编码时每个分片的最少文本数，批量太小时不值得开进程
+MIN_TEXTS_PER_WORKER = 200
 
 # ---------- 向量库路径 ----------
+# 向量库根目录；发布的版本在其下 versions/<版本>/，当前版本见 store_versions.current_dir()
 _VECTOR_STORE_DIR = os.path.join(
     os.path.dirname(os.path.abspath(__file__)),
     "knowledge", "vector_store",
 )
-_VOCAB_FILE = os.path.join(_VECTOR_STORE_DIR, "vocab.json")
+# 二进制词表：已排序的 n-gram 整数键、对应的词表下标、按词表下标排列的 IDF
+VOCAB_KEYS_FILE = "vocab_keys.npy"
+VOCAB_IDS_FILE = "vocab_ids.npy"
+IDF_FILE = "idf.npy"
+# LSA 投影矩阵 float32 (vocab_size, k)，存在时稠密向量为投影后的 k 维向量
+PROJECTION_FILE = "lsa_projection.npy"
+# 旧版 JSON 词表 {"vocab": {token: index}, "idf": [...]}，无二进制词表时读取
+LEGACY_VOCAB_FILE = "vocab.json"
+
+# ---------- n-gram 整数键 ----------
+# 单字键 = 码点；二字键 = (码点1 + 1) * _CP_LIMIT + 码点2，两类键不会重叠
+_CP_LIMIT = 0x110000
+# 分词时去掉的字符：英文字母与所有 Unicode 空白（与 str.isspace / 正则 \s 一致）
+_DROP_CODEPOINTS = np.array(
+    [c for c in range(0x3001) if chr(c).isspace()]
+    + list(range(ord("A"), ord("Z") + 1))
+    + list(range(ord("a"), ord("z") + 1)),
+    dtype=np.int64,
+)
 
 # ---------- 缓存 ----------
-_vocab: Optional[dict] = None   # token -> index
-_idf: Optional[np.ndarray] = None  # shape (vocab_size,)
-
-
-def _tokenize(text: str) -> List[str]:
-    """将文本拆分为字符级 n-gram tokens。
-    保留中文字符和少量标点，去除纯空白和英文。"""
-    # 只保留中文字符、数字和少量标点
-    text = re.sub(r"[a-zA-Z]", "", text)
-    text = re.sub(r"\s+", "", text)
-    chars = list(text)
-    tokens = []
-    for n in range(NGRAM_RANGE[0], NGRAM_RANGE[1] + 1):
-        for i in range(len(chars) - n + 1):
-            gram = "".join(chars[i:i + n])
-            if len(gram.strip()) >= n:
-                tokens.append(gram)
-    return tokens
+_vocab: Optional["Vocab"] = None  # 当前词表（整体替换，不原地修改）
+_store_dir: Optional[str] = None  # 显式指定的词表目录（构建脚本指向待发布的版本目录）
+
+
+def _codepoints(texts: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """整批文本转为 (码点 int64, 所属文本下标 int64)，已去掉英文字母与空白。"""
+    lengths = np.fromiter((len(t) for t in texts), dtype=np.int64, count=len(texts))
+    joined = "".join(texts).encode("utf-32-le", "surrogatepass")
+    cps = np.frombuffer(joined, dtype="<u4").astype(np.int64)
+    doc = np.repeat(np.arange(len(texts), dtype=np.int64), lengths)
+    keep = ~np.isin(cps, _DROP_CODEPOINTS)
+    return cps[keep], doc[keep]
+
+
+def _ngram_keys(cps: np.ndarray, doc: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """返回全部单字 + 二字 n-gram 的 (整数键, 所属文本下标)；二字 n-gram 不跨文本。"""
+    same = doc[1:] == doc[:-1]
+    bi_keys = (cps[:-1][same] + 1) * _CP_LIMIT + cps[1:][same]
+    return np.concatenate([cps, bi_keys]), np.concatenate([doc, doc[:-1][same]])
+
+
+def _key_to_token(key: int) -> str:
+    if key < _CP_LIMIT:
+        return chr(key)
+    return chr(key // _CP_LIMIT - 1) + chr(key % _CP_LIMIT)
+
+
+def _token_to_key(tok: str) -> int:
+    if len(tok) == 1:
+        return ord(tok)
+    return (ord(tok[0]) + 1) * _CP_LIMIT + ord(tok[1])
+
+
+class Vocab:
+    """一份只读词表：IDF、n-gram 查表结构与可选的 LSA 投影。加载后不再修改；
+    重建或热切换时整体换成新对象，正在使用旧对象的请求不受影响。"""
+
+    def __init__(self, keys: np.ndarray, ids: np.ndarray, idf: np.ndarray, projection: Optional[np.ndarray] = None):
+        # 单字用码点直查表，二字用已排序键 + searchsorted
+        keys = np.asarray(keys, dtype=np.int64)
+        ids = np.asarray(ids, dtype=np.int32)
+        n_uni = int(np.searchsorted(keys, _CP_LIMIT))
+        table = np.full(int(keys[n_uni - 1]) + 1 if n_uni else 1, -1, dtype=np.int32)
+        table[keys[:n_uni]] = ids[:n_uni]
+        self.uni_table = table
+        self.bi_keys = keys[n_uni:]
+        self.bi_index = ids[n_uni:]
+        self.idf = np.asarray(idf, dtype=np.float32)
+        self.projection = projection
+
+    def __len__(self) -> int:
+        return len(self.idf)
+
+    @property
+    def dim(self) -> int:
+        """稠密向量长度：有 LSA 投影时为投影维度，否则为词表维度。"""
+        return int(self.projection.shape[1]) if self.projection is not None else len(self.idf)
+
+    def with_projection(self, projection: Optional[np.ndarray]) -> "Vocab":
+        vocab = Vocab.__new__(Vocab)
+        vocab.__dict__.update(self.__dict__)
+        vocab.projection = projection
+        return vocab
+
+    def lookup(self, keys: np.ndarray) -> np.ndarray:
+        """n-gram 整数键 -> 词表下标，不在词表中的为 -1。"""
+        out = np.full(len(keys), -1, dtype=np.int32)
+        is_uni = keys < len(self.uni_table)
+        out[is_uni] = self.uni_table[keys[is_uni]]
+        is_bi = keys >= _CP_LIMIT
+        if len(self.bi_keys) and is_bi.any():
+            bk = keys[is_bi]
+            pos = np.minimum(np.searchsorted(self.bi_keys, bk), len(self.bi_keys) - 1)
+            out[is_bi] = np.where(self.bi_keys[pos] == bk, self.bi_index[pos], -1)
+        return out
+
+
+def load_vocab(store_dir: str) -> Vocab:
+    """读取某个向量库目录的词表：优先读二进制词表（几个小 .npy，无需解析 JSON、不建 Python dict），
+    否则读旧版 vocab.json；有 lsa_projection.npy 时一并 mmap 加载。"""
+    keys_path = os.path.join(store_dir, VOCAB_KEYS_FILE)
+    idf_path = os.path.join(store_dir, IDF_FILE)
+    projection_path = os.path.join(store_dir, PROJECTION_FILE)
+    projection = np.load(projection_path, mmap_mode="r") if os.path.isfile(projection_path) else None
+    if os.path.isfile(keys_path) and os.path.isfile(idf_path):
+        return Vocab(np.load(keys_path), np.load(os.path.join(store_dir, VOCAB_IDS_FILE)), np.load(idf_path), projection)
+    legacy_path = os.path.join(store_dir, LEGACY_VOCAB_FILE)
+    if not os.path.exists(legacy_path):
+        raise FileNotFoundError(
+            f"词汇表文件不存在: {idf_path}，请先运行 build_vector_store.py"
+        )
+    with open(legacy_path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    pairs = sorted((_token_to_key(tok), idx) for tok, idx in data["vocab"].items())
+    return Vocab(
+        np.array([k for k, _ in pairs], dtype=np.int64),
+        np.array([i for _, i in pairs], dtype=np.int32),
+        np.array(data["idf"], dtype=np.float32),
+        projection,
+    )
+
+
+def vocab_dir() -> str:
+    """当前读写词表的目录：use_store_dir() 指定的目录，否则为向量库当前发布的版本目录。"""
+    if _store_dir is not None:
+        return _store_dir
+    from store_versions import current_dir
+    return current_dir(_VECTOR_STORE_DIR) or _VECTOR_STORE_DIR
+
+
+def use_store_dir(store_dir: Optional[str]):
+    """指定之后加载/保存词表的目录（None 恢复为当前发布版本），并丢弃已加载的词表。"""
+    global _store_dir, _vocab
+    _store_dir = store_dir
+    _vocab = None
+
+
+def set_vocab(vocab: Optional[Vocab]):
+    """整体替换当前词表（热切换向量库版本时与向量库一起换入）。"""
+    global _vocab
+    _vocab = vocab
+
+
+def _load_vocab() -> Vocab:
+    """懒加载当前词表。"""
+    global _vocab
+    vocab = _vocab
+    if vocab is None:
+        vocab = _vocab = load_vocab(vocab_dir())
+    return vocab
+
+
+def _save_array(path: str, arr: np.ndarray):
+    # 先写临时文件再替换：正在使用旧文件的进程不会读到半截数据
+    with open(path + ".tmp", "wb") as f:
+        np.save(f, arr)
+    os.replace(path + ".tmp", path)
 
 
 def build_vocab(texts: List[str]):
-    """从语料构建词汇表和 IDF 权重，保存到 vocab.json。"""
+    """从语料构建词汇表和 IDF 权重，保存为二进制词表（vocab_keys.npy / vocab_ids.npy / idf.npy）。"""
     n_docs = len(texts)
-    # 统计文档频率
-    df = Counter()
-    for text in texts:
-        unique_tokens = set(_tokenize(text))
-        for tok in unique_tokens:
-            df[tok] += 1
+    # 统计文档频率：(文本, n-gram) 去重后按 n-gram 计数
+    keys, doc = _ngram_keys(*_codepoints(texts))
+    pairs = np.unique(doc * (_CP_LIMIT * (_CP_LIMIT + 1)) + keys)
+    uniq_keys, df = np.unique(pairs % (_CP_LIMIT * (_CP_LIMIT + 1)), return_counts=True)
 
     # 过滤：去掉太稀有和太常见的 token
     min_df_count = MIN_DF
     max_df_count = int(n_docs * MAX_DF_RATIO)
-    filtered = {
-        tok: freq for tok, freq in df.items()
-        if min_df_count <= freq <= max_df_count
-    }
-    # 按频率排序，取 top MAX_VOCAB
-    sorted_tokens = sorted(
-        filtered.items(), key=lambda x: x[1], reverse=True
-    )[:MAX_VOCAB]
-    vocab = {tok: idx for idx, (tok, _) in enumerate(sorted_tokens)}
+    mask = (df >= min_df_count) & (df <= max_df_count)
+    uniq_keys, df = uniq_keys[mask], df[mask]
+    # 按频率降序（同频按键升序，保证每次构建结果一致），取 top MAX_VOCAB
+    order = np.lexsort((uniq_keys, -df))[:MAX_VOCAB]
+    vocab_keys = uniq_keys[order]
 
     # 计算 IDF: log(N / df) + 1
-    idf_values = np.zeros(len(vocab), dtype=np.float32)
-    for tok, idx in vocab.items():
-        idf_values[idx] = math.log(n_docs / df[tok]) + 1.0
-
-    # 保存
-    os.makedirs(_VECTOR_STORE_DIR, exist_ok=True)
-    with open(_VOCAB_FILE, "w", encoding="utf-8") as f:
-        json.dump(
-            {"vocab": vocab, "idf": idf_values.tolist()},
-            f, ensure_ascii=False,
-        )
+    idf_values = (np.log(n_docs / df[order]) + 1.0).astype(np.float32)
 
-    global _vocab, _idf
-    _vocab = vocab
-    _idf = idf_values
+    # 保存：键升序排列，词表下标即按频率排序的位置
+    sort = np.argsort(vocab_keys)
+    keys, ids = vocab_keys[sort].astype(np.int64), sort.astype(np.int32)
+    out_dir = vocab_dir()
+    os.makedirs(out_dir, exist_ok=True)
+    for name, arr in ((VOCAB_KEYS_FILE, keys), (VOCAB_IDS_FILE, ids), (IDF_FILE, idf_values)):
+        _save_array(os.path.join(out_dir, name), arr)
+    # 旧版 JSON 词表与基于旧词表的 LSA 投影都不再对应新词表
+    for name in (LEGACY_VOCAB_FILE, PROJECTION_FILE):
+        path = os.path.join(out_dir, name)
+        if os.path.isfile(path):
+            os.remove(path)
+
+    set_vocab(Vocab(keys, ids, idf_values))
+    vocab = {_key_to_token(int(k)): idx for idx, k in enumerate(vocab_keys)}
     return vocab, idf_values
 
 
-def _load_vocab():
-    """懒加载词汇表和 IDF 权重。"""
-    global _vocab, _idf
-    if _vocab is not None and _idf is not None:
-        return
-    if not os.path.exists(_VOCAB_FILE):
-        raise FileNotFoundError(
-            f"词汇表文件不存在: {_VOCAB_FILE}，请先运行 build_vector_store.py"
-        )
-    with open(_VOCAB_FILE, "r", encoding="utf-8") as f:
-        data = json.load(f)
-    _vocab = data["vocab"]
-    _idf = np.array(data["idf"], dtype=np.float32)
-
-
-def _text_to_tfidf(text: str) -> np.ndarray:
-    """将单条文本转为 TF-IDF 向量（L2 归一化）。"""
-    _load_vocab()
-    tokens = _tokenize(text)
-    tf = Counter(tokens)
-    vec = np.zeros(len(_vocab), dtype=np.float32)
-    for tok, count in tf.items():
-        idx = _vocab.get(tok)
-        if idx is not None:
-            # TF 使用 sublinear: 1 + log(tf)
-            vec[idx] = (1.0 + math.log(count)) * _idf[idx]
+def _encode_batch(texts: List[str], vocab: Optional[Vocab] = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """整批文本一次编码为 L2 归一化的 TF-IDF CSR 三元组 (indptr, indices, data)。"""
+    vocab = _load_vocab() if vocab is None else vocab
+    n, v = len(texts), len(vocab)
+    keys, doc = _ngram_keys(*_codepoints(texts))
+    idx = vocab.lookup(keys)
+    hit = idx >= 0
+    # (文本, 词表下标) 组合键去重计数即词频；np.unique 的结果已按行、列升序
+    pairs, tf = np.unique(doc[hit] * v + idx[hit], return_counts=True)
+    rows = pairs // v
+    cols = (pairs % v).astype(np.int32)
+    # TF 使用 sublinear: 1 + log(tf)
+    data = ((1.0 + np.log(tf)) * vocab.idf[cols]).astype(np.float32)
     # L2 归一化
-    norm = np.linalg.norm(vec)
-    if norm > 0:
-        vec /= norm
-    return vec
+    norms = np.sqrt(np.bincount(rows, weights=data.astype(np.float64) ** 2, minlength=n))
+    norms[norms == 0] = 1.0
+    data /= norms[rows].astype(np.float32)
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=n), out=indptr[1:])
+    return indptr, cols, data
+
+
+def _concat_csr(parts) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    indptrs, offset = [np.zeros(1, dtype=np.int64)], 0
+    for indptr, _, _ in parts:
+        indptrs.append(indptr[1:] + offset)
+        offset += int(indptr[-1])
+    return (
+        np.concatenate(indptrs),
+        np.concatenate([p[1] for p in parts]),
+        np.concatenate([p[2] for p in parts]),
+    )
+
+
+def embed_texts_sparse(
+    texts: List[str], workers: int = 1, vocab: Optional[Vocab] = None
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """对多段文本生成稀疏 TF-IDF 矩阵，返回 CSR 三元组 (indptr int64, indices int32, data float32)。
+    一段几百字的文本只涉及几百个 n-gram，远小于词表维度。
+    workers > 1 且文本足够多时，按分片用多进程编码（词表随任务传给子进程）。
+    vocab 默认为当前词表；热切换场景由调用方传入与向量库配套的词表。"""
+    vocab = _load_vocab() if vocab is None else vocab
+    n_parts = min(workers, len(texts) // MIN_TEXTS_PER_WORKER)
+    if n_parts <= 1:
+        return _encode_batch(list(texts), vocab)
+    from functools import partial
+    from multiprocessing import Pool
+    bounds = np.linspace(0, len(texts), n_parts + 1).astype(int)
+    pieces = [list(texts[a:b]) for a, b in zip(bounds[:-1], bounds[1:])]
+    with Pool(n_parts) as pool:
+        parts = pool.map(partial(_encode_batch, vocab=vocab.with_projection(None)), pieces)
+    return _concat_csr(parts)
 
 
-def embed_texts(texts: List[str]) -> List[List[float]]:
-    """对多段文本生成 TF-IDF 向量，返回 list of list of float。"""
+def embed_query_sparse(text: str, vocab: Optional[Vocab] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """对单条查询生成稀疏 TF-IDF 行 (indices, data)。"""
+    _, indices, data = _encode_batch([text], vocab)
+    return indices, data
+
+
+def save_projection(projection: Optional[np.ndarray]):
+    """保存（projection 为 None 时删除）LSA 投影矩阵，此后 embed_texts / embed_query 按其投影。"""
+    path = os.path.join(vocab_dir(), PROJECTION_FILE)
+    if projection is None:
+        if os.path.isfile(path):
+            os.remove(path)
+    else:
+        projection = np.asarray(projection, dtype=np.float32)
+        _save_array(path, projection)
+    set_vocab(_load_vocab().with_projection(projection))
+
+
+def embed_texts(texts: List[str], workers: int = 1, vocab: Optional[Vocab] = None) -> np.ndarray:
+    """对多段文本生成稠密向量，返回 float32 (len(texts), embedding_dim())：
+    无 LSA 投影时为 TF-IDF 向量，有投影时为投影后重新 L2 归一化的 k 维向量。"""
+    vocab = _load_vocab() if vocab is None else vocab
     if not texts:
-        return []
-    _load_vocab()
-    results = []
-    for text in texts:
-        vec = _text_to_tfidf(text)
-        results.append(vec.tolist())
-    return results
-
-
-def embed_query(text: str) -> List[float]:
-    """对单条查询生成 TF-IDF 向量。"""
-    return _text_to_tfidf(text).tolist()
+        return np.zeros((0, vocab.dim), dtype=np.float32)
+    indptr, indices, data = embed_texts_sparse(texts, workers, vocab)
+    if vocab.projection is not None:
+        from lsa import csr_matmul
+        out = csr_matmul((indptr, indices, data), vocab.projection)
+        norms = np.linalg.norm(out, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return out / norms
+    out = np.zeros((len(texts), len(vocab)), dtype=np.float32)
+    rows = np.repeat(np.arange(len(texts)), np.diff(indptr))
+    out[rows, indices] = data
+    return out
+
+
+def embed_query(text: str, vocab: Optional[Vocab] = None) -> np.ndarray:
+    """对单条查询生成稠密向量（TF-IDF，或有 LSA 投影时的 k 维向量），float32 (embedding_dim(),)。"""
+    return embed_texts([text], vocab=vocab)[0]
+
+
+def doc_freq(texts: List[str]) -> np.ndarray:
+    """当前词表下各词条的文档频率（包含该 n-gram 的文本数），int64 (vocab_size,)。
+    增量构建据此维护全库 DF，判断 IDF 是否漂移到需要重建词表。"""
+    vocab = _load_vocab()
+    v = len(vocab)
+    if not texts:
+        return np.zeros(v, dtype=np.int64)
+    keys, doc = _ngram_keys(*_codepoints(list(texts)))
+    idx = vocab.lookup(keys)
+    hit = idx >= 0
+    pairs = np.unique(doc[hit] * v + idx[hit])
+    return np.bincount(pairs % v, minlength=v).astype(np.int64)
+
+
+def idf_weights() -> np.ndarray:
+    """当前词表的 IDF 权重（构建词表时的语料统计），float32 (vocab_size,)。"""
+    return _load_vocab().idf.copy()
+
+
+def vocab_size() -> int:
+    """词表维度（即 TF-IDF 向量长度）。"""
+    return len(_load_vocab())
+
+
+def embedding_dim() -> int:
+    """embed_texts / embed_query 输出的稠密向量长度：有 LSA 投影时为投影维度，否则为词表维度。"""
+    return _load_vocab().dim
@@ -0,0 +1,33 @@
+"""
+gunicorn 配置 —— preload 模式：master 中执行 create_app()（初始化数据库 + 预热知识库）后再 fork worker，
+各 worker 共享同一份只读知识库结构：npy / chunks.pack 为 mmap（共享页缓存），
+词表、meta 等 Python 对象按写时复制共享。fork 前冻结 GC，避免 worker 里的分代回收触碰这些对象、
+把共享页逐页复制成私有页。
+知识库热更新线程（rag.start_reloader）不会随 fork 继承，在每个 worker fork 后各自启动。
+
+启动（ASGI，Railway 默认）：cd backend && gunicorn -c gunicorn.conf.py -k uvicorn_worker.UvicornWorker asgi:app
+  对话接口为协程，长时间的流式对话不占住 worker，见 asgi.py
+启动（WSGI 同步 worker）：cd backend && gunicorn -c gunicorn.conf.py "app:create_app()"
+环境变量：PORT、WEB_CONCURRENCY（worker 数，默认 2）、GUNICORN_TIMEOUT、GUNICORN_PRELOAD=0 关闭预加载、
+  RAG_RELOAD_INTERVAL（热更新检查间隔秒数，0 关闭）
+"""
+
+import gc
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+workers = int(os.getenv("WEB_CONCURRENCY", "2"))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+preload_app = os.getenv("GUNICORN_PRELOAD", "1") != "0"
+
+
+def when_ready(server):
+    # preload 时应用已在 master 中加载完毕，此后才 fork worker
+    if preload_app:
+        gc.freeze()
+
+
+def post_fork(server, worker):
+    # 每个 worker 各自轮询知识库新版本并热切换
+    import rag
+    rag.start_reloader()
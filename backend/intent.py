@@ -0,0 +1,310 @@
+"""
+对话意图分类 —— 调用大模型前在本地判断本轮是否需要检索知识库、需要向模型暴露哪些排盘工具。
+
+寒暄、致谢、告别等闲聊（「你好」「谢谢」「好的」）不检索、不带工具：系统提示词之外不再注入知识库参考文本，
+也不发送三个工具的 schema，模型不会先走一轮工具调用，延迟与 token 都明显下降。其余消息照常检索，
+工具按需暴露：
+  get_bazi                  本轮或本对话之前的用户消息里有出生日期（之前排过的盘由 app 从 tool_results 回放，
+                            模型通常不必再调用；保留工具以便换一组出生信息或合婚时再排）
+  get_meihua / get_liuyao   提到梅花易数 / 六爻；只说「起卦」「占卜」时两个都给
+  全部工具                  只说「帮我算算」「看看运势」等，无法判断用哪种方法时
+判断完全基于规则与词典：命理术语词典复用 rag 的术语同义词组（Aho-Corasick 自动机，单次扫描），
+再加上本模块的排盘/起卦触发词；单条消息耗时在微秒级。INTENT_GATING=0 关闭（每轮都检索并暴露全部工具）。
+
+extract_birth 从消息中提取 get_bazi 的参数（公历/农历、阿拉伯/中文数字日期，时刻或时辰，性别），
+只在高置信度时返回：恰好一个合法的年月日，且明确是出生日期（旁边有「出生」「八字」「男命」等说法，
+或「日期 时刻 男/女」的报生辰写法），时刻与性别都给出；提取到后 app.prepare_chat 在请求模型前先排盘，
+结果作为工具调用注入，省去「模型返回 get_bazi → 执行 → 再请求」的一整轮往返。BAZI_PREFETCH=0 关闭。
+"""
+
+from __future__ import annotations
+
+import datetime
+import os
+import re
+from typing import Dict, Iterable, Optional, Tuple
+
+GATING_ENABLED = os.getenv("INTENT_GATING", "1") != "0"
+PREFETCH_ENABLED = os.getenv("BAZI_PREFETCH", "1") != "0"
+
+TOOL_NAMES = ("get_bazi", "get_meihua", "get_liuyao")
+
+# 闲聊：去掉标点、空白与语气词后，整句只由这些说法组成
+_SMALLTALK_RE = re.compile(
+    r"^(?:你好|您好|你们好|嗨|哈喽|hello|hi|hey|在吗|在不在|在么|早上好|上午好|中午好|下午好|晚上好|早安|晚安|"
+    r"谢谢你?|谢谢您|谢啦|多谢|感谢|辛苦了|好的|好滴|好吧|好|行|可以|嗯+|哦+|噢+|ok|okay|收到|明白了?|知道了|懂了|"
+    r"了解|再见|拜拜|bye|回头见|哈+|呵+|嘿+|666|赞|厉害|牛|太准了|真准|你是谁|你叫什么名字?|"
+    r"啊|呀|哦|啦|了|呢|吧|的|嘛|老师|大师|师傅|玄明子)+$"
+)
+_STRIP_RE = re.compile(r"[\s\W_]+", re.UNICODE)
+
+# 出生日期：公历数字日期、「X月X日」、中文数字年份，或明确的农历/公历与生辰说法
+_BIRTH_RE = re.compile(
+    r"(?:1[89]|20)\d{2}\s*[年/.\-]|\d{1,2}\s*月\s*\d{1,2}\s*[日号]|[一二三四五六七八九零〇]{4}年|"
+    r"农历|阴历|阳历|公历|出生|生日|生辰|几点生|[子丑寅卯辰巳午未申酉戌亥]时生"
+)
+_MEIHUA_WORDS = ("梅花", "梅花易数")
+_LIUYAO_WORDS = ("六爻", "摇卦", "铜钱卦", "纳甲")
+# 起卦但未指明方法
+_GUA_WORDS = ("起卦", "起个卦", "起一卦", "算一卦", "算个卦", "占卜", "卜卦", "问卦", "测一卦", "卦象")
+# 想算命但未指明方法
+_FORTUNE_WORDS = ("算命", "算算", "算一下", "帮我算", "给我算", "看看运势", "测一测", "测测", "预测一下")
+_BAZI_WORDS = ("八字", "四柱", "排盘", "命盘", "命局", "命造")
+
+# ---- 出生信息提取 ----
+_CN_DIGITS = {"〇": 0, "零": 0, "一": 1, "二": 2, "两": 2, "三": 3, "四": 4, "五": 5,
+              "六": 6, "七": 7, "八": 8, "九": 9}
+_CN_NUM = r"[〇零一二两三四五六七八九十廿]{1,3}"
+_NUM = rf"(?:\d{{1,2}}|{_CN_NUM})"
+# 年份：四位阿拉伯数字或四位中文数字；月：数字或正月/冬月/腊月，可带「闰」；日：数字或初一、廿三等
+_DATE_RE = re.compile(
+    rf"((?:1[89]|20)\d{{2}}|[〇零一二三四五六七八九]{{4}})\s*(?:年\s*(闰)?\s*({_NUM}|正|冬|腊)\s*月\s*(初?{_NUM})\s*[日号]?"
+    rf"|[/.\-]\s*(\d{{1,2}})\s*[/.\-]\s*(\d{{1,2}})(?!\d))"
+)
+_CLOCK_RE = re.compile(
+    rf"(凌晨|早上|早晨|清晨|上午|中午|下午|傍晚|晚上|夜里|夜间|半夜)?\s*"
+    rf"(?:(\d{{1,2}})\s*[:：]\s*(\d{{2}})|({_NUM})\s*[点时](?:\s*(半|{_NUM})\s*分?)?)"
+)
+_SHICHEN_RE = re.compile(r"([子丑寅卯辰巳午未申酉戌亥])时")
+# 时辰取中点所在的整点（子时取 0 点）
+_SHICHEN_HOUR = {z: (i * 2) % 24 for i, z in enumerate("子丑寅卯辰巳午未申酉戌亥")}
+# 性别：男朋友/男友/男方、女朋友/女友/女方说的是别人，不算（「先生」「老公」同理不收）
+_MALE_RE = re.compile(r"男命|男性|男孩|男生|乾造|儿子|(?<![男女])男(?![女朋友方])")
+_FEMALE_RE = re.compile(r"女命|女性|女孩|女生|坤造|女士|女儿|(?<![男女儿])女(?![男朋友方])")
+# 日期旁边这些说法表明它是出生日期，而不是「2023年5月1日我换了工作」这类事件日期
+_BIRTH_CUE_RE = re.compile(r"出生|出世|生于|生日|生辰|八字|四柱|命盘|排盘|男命|女命|乾造|坤造")
+# 紧跟在日期/时刻后面的「生」（「1990年5月1日生」「晚上九点半生的」）
+_BORN_RE = re.compile(r"^\s*生|[点时分半]\s*生")
+# 报生辰写法中，日期（及时刻）之后只剩性别
+_GENDER_ONLY_RE = re.compile(r"\s*(?:男|女)(?:命|性|生|孩)?\s*")
+_LUNAR_RE = re.compile(r"农历|阴历|旧历")
+_SOLAR_RE = re.compile(r"公历|阳历|新历|西历")
+# 日期之后这么多字符内出现的时刻/时辰才视为出生时间
+_TIME_WINDOW = 16
+_CLAUSE_SPLIT_RE = re.compile(r"[，,、；;。！？!?\n]")
+_SENTENCE_SPLIT_RE = re.compile(r"[；;。！？!?\n]")
+
+
+class Intent:
+    """一轮对话的分类结果：label、是否检索、暴露给模型的工具名。"""
+
+    __slots__ = ("label", "retrieve", "tools")
+
+    def __init__(self, label: str, retrieve: bool, tools: Tuple[str, ...] = ()):
+        self.label = label
+        self.retrieve = retrieve
+        self.tools = tools
+
+    def __repr__(self) -> str:
+        return f"Intent({self.label!r}, retrieve={self.retrieve}, tools={self.tools})"
+
+
+def is_smalltalk(message: str) -> bool:
+    """寒暄、致谢、告别、应答等不需要知识库与排盘的短句。"""
+    text = _STRIP_RE.sub("", (message or "").lower())
+    return not text or (len(text) <= 12 and _SMALLTALK_RE.match(text) is not None)
+
+
+def has_birth_info(message: str) -> bool:
+    """消息中是否给出了出生日期/时辰。"""
+    return bool(message) and _BIRTH_RE.search(message) is not None
+
+
+def _cn_number(text: str) -> Optional[int]:
+    """阿拉伯数字或一百以内的中文数字（十二、廿三、三十一、初五）；无法解析返回 None。"""
+    text = text.lstrip("初")
+    if text.isdigit():
+        return int(text)
+    text = text.replace("廿", "二十")
+    if "十" in text:
+        tens, _, ones = text.partition("十")
+        if len(tens) > 1 or len(ones) > 1:
+            return None
+        t = _CN_DIGITS.get(tens, -1) if tens else 1
+        o = _CN_DIGITS.get(ones, -1) if ones else 0
+        return t * 10 + o if t >= 0 and o >= 0 else None
+    return _CN_DIGITS.get(text) if len(text) == 1 else None
+
+
+def _parse_year(text: str) -> Optional[int]:
+    if text.isdigit():
+        return int(text)
+    digits = [_CN_DIGITS.get(ch) for ch in text]
+    return None if None in digits else int("".join(map(str, digits)))
+
+
+def _parse_date(m) -> Optional[Tuple[int, int, int]]:
+    """_DATE_RE 匹配 → (年, 月, 日)，闰月以负数表示（与 lunar_python 一致）。"""
+    year = _parse_year(m.group(1))
+    if m.group(3) is not None:
+        month = {"正": 1, "冬": 11, "腊": 12}.get(m.group(3)) or _cn_number(m.group(3))
+        day = _cn_number(m.group(4))
+    else:
+        month, day = int(m.group(5)), int(m.group(6))
+    if year is None or month is None or day is None:
+        return None
+    return year, -month if m.group(2) else month, day
+
+
+def _parse_time(text: str) -> Optional[Tuple[int, int]]:
+    """
+    日期后面的出生时刻（「早上8点」「20:30」「晚上九点半」）或时辰（「辰时」）→ (时, 分)。
+    只看日期所在分句；下一分句须以时段词或时辰开头（「1990年5月1日出生，早上8点」），
+    避免把「想问问3点钟方向」之类当成出生时间。
+    """
+    clauses = _CLAUSE_SPLIT_RE.split(text, maxsplit=2)
+    clock = _parse_clock(clauses[0])
+    if clock is None and len(clauses) > 1:
+        nxt = clauses[1].lstrip()
+        m = _CLOCK_RE.match(nxt)
+        if m is not None and m.group(1):
+            clock = _parse_clock(nxt)
+        elif _SHICHEN_RE.match(nxt):
+            clock = _SHICHEN_HOUR[nxt[0]], 0
+    return clock
+
+
+def _parse_clock(text: str) -> Optional[Tuple[int, int]]:
+    m = _CLOCK_RE.search(text)
+    if m is not None:
+        period = m.group(1)
+        if m.group(2) is not None:
+            hour, minute = int(m.group(2)), int(m.group(3))
+        else:
+            hour = _cn_number(m.group(4))
+            minute = 30 if m.group(5) == "半" else _cn_number(m.group(5)) if m.group(5) else 0
+            if hour is None or minute is None:
+                return None
+        if period in ("下午", "傍晚") and hour < 12:
+            hour += 12
+        elif period in ("晚上", "夜里", "夜间") and 5 <= hour < 12:
+            hour += 12
+        elif period == "中午" and hour < 3:
+            hour += 12
+        elif period in ("凌晨", "半夜", "晚上", "夜里", "夜间") and hour == 12:
+            # 晚上/夜里 12 点是子夜（0 点），不是中午
+            hour = 0
+        if 0 <= hour <= 23 and 0 <= minute <= 59:
+            return hour, minute
+        return None
+    m = _SHICHEN_RE.search(text)
+    if m is not None:
+        return _SHICHEN_HOUR[m.group(1)], 0
+    return None
+
+
+def _valid_date(year: int, month: int, day: int, is_solar: bool) -> bool:
+    if not 1900 <= year <= 2100:
+        return False
+    if not is_solar:
+        return 1 <= abs(month) <= 12 and 1 <= day <= 30
+    if month < 0:
+        return False
+    try:
+        datetime.date(year, month, day)
+    except ValueError:
+        return False
+    return True
+
+
+def _has_birth_cue(message: str, m) -> bool:
+    """
+    日期 m 是否明确是出生日期：
+      - 同一句中日期之前有出生/八字类说法（「帮我排个八字，1990年……」）
+      - 日期之后同一分句内有（「1990年5月1日出生」「……晚上九点半生的」）
+      - 报生辰的写法：日期（及时刻）之后本分句只剩性别，或本分句结束、下一分句只有性别（「……早上8点，男」）
+    「2023年5月1日我换了工作，帮我看看八字」这类事件日期不算。
+    """
+    if _BIRTH_CUE_RE.search(_SENTENCE_SPLIT_RE.split(message[:m.start()])[-1]):
+        return True
+    clauses = _CLAUSE_SPLIT_RE.split(message[m.end():], maxsplit=2)
+    rest = clauses[0]
+    if _BIRTH_CUE_RE.search(rest) or _BORN_RE.search(rest):
+        return True
+    rest = _SHICHEN_RE.sub("", _CLOCK_RE.sub("", rest, count=1), count=1)
+    if _GENDER_ONLY_RE.fullmatch(rest):
+        return True
+    return not rest.strip() and len(clauses) > 1 and _GENDER_ONLY_RE.fullmatch(clauses[1]) is not None
+
+
+def extract_birth(message: str) -> Optional[Dict]:
+    """
+    从消息中提取出生信息，返回 get_bazi 的参数 dict（year/month/day/hour/minute/is_male/is_solar）；
+    置信度不够时返回 None，交给模型自己决定是否调用工具、是否追问时辰与性别：
+      - 恰好一个（去重后）完整的年月日，年份四位；日期合法（公历按日历校验，农历月 1-12、日 1-30）
+      - 日期明确是出生日期（见 _has_birth_cue）
+      - 给出了出生时刻或时辰，且能与日期对应上；给出了性别，且男女不矛盾
+      - 没有同时出现农历与公历字样（可能给了两种写法）
+    「初五」「正月」「闰四月」视为农历。
+    """
+    if not message or not has_birth_info(message):
+        return None
+    matches = list(_DATE_RE.finditer(message))
+    dates = [_parse_date(m) for m in matches]
+    if not dates or None in dates or len(set(dates)) != 1:
+        return None
+    year, month, day = dates[0]
+    m = matches[0]
+
+    lunar, solar = _LUNAR_RE.search(message) is not None, _SOLAR_RE.search(message) is not None
+    lunar_form = m.group(2) is not None or m.group(3) in ("正", "冬", "腊") or (m.group(4) or "").startswith("初")
+    if (lunar or lunar_form) and solar:
+        return None
+    is_solar = not (lunar or lunar_form)
+    if not _valid_date(year, month, day, is_solar) or not _has_birth_cue(message, m):
+        return None
+
+    male, female = _MALE_RE.search(message) is not None, _FEMALE_RE.search(message) is not None
+    if male == female:
+        return None
+    # 没给时辰时不按 12 点排盘，由模型按系统提示词先问清时辰
+    clock = _parse_time(message[m.end():m.end() + _TIME_WINDOW])
+    if clock is None:
+        return None
+    hour, minute = clock
+    return {
+        "year": year, "month": month, "day": day, "hour": hour, "minute": minute,
+        "is_male": male, "is_solar": is_solar,
+    }
+
+
+def _has_any(text: str, words) -> bool:
+    return any(w in text for w in words)
+
+
+def _domain_terms(text: str) -> set:
+    """命中的命理术语（rag 的术语同义词组词典）。"""
+    from rag import _get_term_matcher
+    return _get_term_matcher().find(text)
+
+
+def classify(message: str, previous: Optional[Iterable[str]] = None) -> Intent:
+    """对本轮用户消息分类；previous 为本对话之前的用户消息（判断是否已给过出生日期）。"""
+    if not GATING_ENABLED:
+        return Intent("all", True, TOOL_NAMES)
+    if is_smalltalk(message):
+        return Intent("smalltalk", False)
+
+    text = message.lower()
+    tools = []
+    if has_birth_info(message) or any(has_birth_info(m) for m in previous or ()):
+        tools.append("get_bazi")
+    meihua, liuyao = _has_any(text, _MEIHUA_WORDS), _has_any(text, _LIUYAO_WORDS)
+    if not (meihua or liuyao) and _has_any(text, _GUA_WORDS):
+        meihua = liuyao = True
+    if meihua:
+        tools.append("get_meihua")
+    if liuyao:
+        tools.append("get_liuyao")
+    if not tools and _has_any(text, _FORTUNE_WORDS):
+        tools = list(TOOL_NAMES)
+
+    if "get_bazi" in tools or _has_any(text, _BAZI_WORDS):
+        label = "bazi"
+    elif tools:
+        label = "divination"
+    elif _domain_terms(text):
+        label = "knowledge"
+    else:
+        label = "general"
+    return Intent(label, True, tuple(tools))
@@ -0,0 +1,171 @@
+"""
+关键词倒排索引 + BM25 —— 构建期把全部 chunk 切成字符 n-gram 与标签词条，
+posting list 以紧凑整数数组存盘；检索时只遍历查询词条的 posting list，
+耗时与 posting 长度成正比，而不是每次请求都扫一遍全部语料。
+
+索引目录 knowledge/keyword_index/（与 chunks.pack 的下标一一对应）：
+  terms.npy         已排序的词条（定长 unicode），标签词条带 "#" 前缀，构建期预打的术语词条带 "@" 前缀
+  term_offsets.npy  int64 (T + 1)：各词条 posting 在 doc_ids/tfs 中的起止位置
+  doc_ids.npy       int32：posting 中的 chunk 下标（每个词条内升序）
+  tfs.npy           uint16：对应词频
+  doc_len.npy       int32：各 chunk 的 n-gram 总数（BM25 长度归一化用）
+由 scripts/pack_chunks.py 在打包时一并构建，加载时 mmap 只读，多 worker 共享页缓存。
+"""
+
+from __future__ import annotations
+
+import heapq
+import math
+import os
+import re
+import shutil
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+# 与 embedding_utils.NGRAM_RANGE 一致：单字 + 二字
+NGRAM_RANGE = (1, 2)
+TAG_PREFIX = "#"
+# 构建期用术语自动机（term_matcher）在 content 中找到的完整术语，整词作为一个词条
+TERM_PREFIX = "@"
+# BM25 参数
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+_FILES = ("terms", "term_offsets", "doc_ids", "tfs", "doc_len")
+# 连续的文字/数字片段；n-gram 不跨越标点与空白
+_RUN_RE = re.compile(r"\w+")
+
+
+def text_ngrams(text: str, ngram_range: Tuple[int, int] = NGRAM_RANGE) -> List[str]:
+    """将文本切为小写字符 n-gram，n-gram 不跨越标点与空白。"""
+    grams = []
+    for run in _RUN_RE.findall(text.lower()):
+        for n in range(ngram_range[0], ngram_range[1] + 1):
+            for i in range(len(run) - n + 1):
+                grams.append(run[i:i + n])
+    return grams
+
+
+def build_index(chunks: List[dict], out_dir: str, term_matcher=None) -> int:
+    """为 chunk 列表（顺序即下标，需与 chunks.pack 一致）构建倒排索引并写入 out_dir，返回词条数。
+    传入 term_matcher（term_matcher.TermMatcher）时，每个 chunk 的 content 用自动机扫一遍，
+    出现的术语以 "@术语" 词条及出现次数入索引，检索时扩展术语直接查整词 posting。
+    先写到临时目录再整体换入，避免运行中的 worker 读到新旧混杂的文件。"""
+    postings: Dict[str, List[Tuple[int, int]]] = {}
+    doc_len = np.zeros(len(chunks), dtype=np.int32)
+    for doc_id, c in enumerate(chunks):
+        grams = text_ngrams(c.get("content") or "")
+        doc_len[doc_id] = len(grams)
+        tf = Counter(grams)
+        for tag in c.get("tags", []):
+            tf[TAG_PREFIX + tag.lower()] += 1
+        if term_matcher is not None:
+            for term, count in term_matcher.counts(c.get("content") or "").items():
+                tf[TERM_PREFIX + term] += count
+        for term, count in tf.items():
+            postings.setdefault(term, []).append((doc_id, min(count, 65535)))
+
+    terms = sorted(postings)
+    term_offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+    for t, term in enumerate(terms):
+        term_offsets[t + 1] = term_offsets[t] + len(postings[term])
+    doc_ids = np.empty(int(term_offsets[-1]), dtype=np.int32)
+    tfs = np.empty(int(term_offsets[-1]), dtype=np.uint16)
+    for t, term in enumerate(terms):
+        plist = postings[term]
+        start, end = term_offsets[t], term_offsets[t + 1]
+        doc_ids[start:end] = [d for d, _ in plist]
+        tfs[start:end] = [f for _, f in plist]
+
+    arrays = {
+        "terms": np.array(terms, dtype=str) if terms else np.array([], dtype="<U1"),
+        "term_offsets": term_offsets,
+        "doc_ids": doc_ids,
+        "tfs": tfs,
+        "doc_len": doc_len,
+    }
+    out_dir = os.path.abspath(out_dir)
+    tmp_dir = out_dir + ".tmp"
+    old_dir = out_dir + ".old"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    for name in _FILES:
+        np.save(os.path.join(tmp_dir, name + ".npy"), arrays[name])
+    if os.path.isdir(out_dir):
+        shutil.rmtree(old_dir, ignore_errors=True)
+        os.rename(out_dir, old_dir)
+    os.rename(tmp_dir, out_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+    return len(terms)
+
+
+class KeywordIndex:
+    """mmap 只读的倒排索引，提供 BM25 打分与堆式 top-k。"""
+
+    def __init__(self, index_dir: str):
+        arrays = {
+            name: np.load(os.path.join(index_dir, name + ".npy"), mmap_mode="r")
+            for name in _FILES
+        }
+        self.terms = arrays["terms"]
+        self.term_offsets = arrays["term_offsets"]
+        self.doc_ids = arrays["doc_ids"]
+        self.tfs = arrays["tfs"]
+        self.doc_len = np.asarray(arrays["doc_len"], dtype=np.float32)
+        self.n_docs = len(self.doc_len)
+        # 是否带构建期预打的术语词条（旧索引没有，检索时扩展术语退回 n-gram）
+        t = int(np.searchsorted(self.terms, TERM_PREFIX))
+        self.has_term_tags = t < len(self.terms) and str(self.terms[t]).startswith(TERM_PREFIX)
+        self.avg_len = float(self.doc_len.mean()) if self.n_docs else 0.0
+        # BM25 长度归一化项 k1 * (1 - b + b * dl / avgdl)，与查询无关，预先算好
+        self._len_norm = BM25_K1 * (
+            1.0 - BM25_B + BM25_B * self.doc_len / (self.avg_len or 1.0)
+        )
+
+    def __len__(self) -> int:
+        return self.n_docs
+
+    def postings(self, term: str):
+        """返回词条的 (doc_ids, tfs)；词条不存在时返回 None。"""
+        t = int(np.searchsorted(self.terms, term))
+        if t >= len(self.terms) or self.terms[t] != term:
+            return None
+        start, end = int(self.term_offsets[t]), int(self.term_offsets[t + 1])
+        return self.doc_ids[start:end], self.tfs[start:end]
+
+    def score(self, term_weights: Dict[str, float]) -> np.ndarray:
+        """按 BM25 对全部 chunk 打分（只累加命中词条的 posting），返回 float32 (n_docs,)。"""
+        scores = np.zeros(self.n_docs, dtype=np.float32)
+        for term, weight in term_weights.items():
+            hit = self.postings(term)
+            if hit is None:
+                continue
+            docs, tf = hit
+            idf = math.log(1.0 + (self.n_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+            tf = tf.astype(np.float32)
+            scores[docs] += weight * idf * tf * (BM25_K1 + 1.0) / (tf + self._len_norm[docs])
+        return scores
+
+    def search(
+        self, term_weights: Dict[str, float], top_k: int, allowed: Optional[np.ndarray] = None
+    ) -> List[Tuple[int, float]]:
+        """返回得分最高的 top_k 个 (chunk 下标, 分数)，只在有得分的 chunk 上建堆。
+        allowed 为可选的 bool (n_docs,) 掩码（如按书过滤），掩码外的 chunk 不参与排序。"""
+        scores = self.score(term_weights)
+        if allowed is not None:
+            scores[~allowed] = 0.0
+        candidates = np.flatnonzero(scores)
+        best = heapq.nlargest(top_k, candidates.tolist(), key=scores.__getitem__)
+        return [(i, float(scores[i])) for i in best]
+
+
+def load_index(index_dir: str) -> Optional[KeywordIndex]:
+    """加载索引目录；不存在或损坏返回 None。"""
+    if not os.path.isdir(index_dir):
+        return None
+    try:
+        return KeywordIndex(index_dir)
+    except Exception:
+        return None
@@ -0,0 +1,83 @@
+"""
+潜在语义分析（LSA）—— 对 TF-IDF 矩阵做截断 SVD，把 8000 维的字符 n-gram 向量压到 128～384 维稠密向量。
+
+TF-IDF 只认字面：古文「财官」与白话「财星官星」共享的 n-gram 很少，余弦相似度偏低。
+截断 SVD 保留语料中共现最强的 k 个方向，经常一起出现的古今说法落在相近方向上；
+同时向量维度降到原来的几十分之一，暴力打分的乘法量随之下降。
+
+纯 NumPy 的随机化 SVD（Halko, Martinsson & Tropp 2011）：
+  1. 随机高斯矩阵 Ω (d, k + p) 采样列空间 Y = A·Ω，做 n_iter 次幂迭代 (A·Aᵀ)ⁿ 拉开奇异值
+  2. Y 正交化得 Q，投影到小矩阵 B = Qᵀ·A ((k + p) × d)，对 B 做精确 SVD
+  3. 取前 k 个右奇异向量 V (d, k) 作为投影矩阵：文档向量 = A·V（再归一化），查询同样右乘 V
+A 始终以 CSR 参与乘法，乘积耗时与非零元个数成正比，不展开稠密矩阵。
+
+由 build_vector_store.py --lsa-dim 构建；投影矩阵由 embedding_utils 保存、加载，
+embed_query / embed_texts 检测到投影矩阵时自动投影。
+"""
+
+from __future__ import annotations
+
+from typing import Tuple
+
+import numpy as np
+
+# 随机化 SVD 的过采样列数与默认幂迭代次数
+OVERSAMPLE = 10
+DEFAULT_ITERS = 4
+# CSR 乘稠密矩阵时每块的行数：临时乘积只占一块的非零元 × 列数
+BLOCK_ROWS = 512
+
+Csr = Tuple[np.ndarray, np.ndarray, np.ndarray]
+
+
+def csr_matmul(csr: Csr, b: np.ndarray) -> np.ndarray:
+    """CSR (n, d) 乘稠密矩阵 b (d, r)，返回 float32 (n, r)。按行分块：gather 非零元对应的 b 行，
+    逐元相乘后用 reduceat 按行求和（只对非空行求和，空行保持为零）。"""
+    indptr, indices, data = csr
+    n = len(indptr) - 1
+    out = np.zeros((n, b.shape[1]), dtype=np.float32)
+    for a in range(0, n, BLOCK_ROWS):
+        e = min(a + BLOCK_ROWS, n)
+        s, t = int(indptr[a]), int(indptr[e])
+        if s == t:
+            continue
+        prod = np.asarray(data[s:t], dtype=np.float32)[:, None] * b[np.asarray(indices[s:t])]
+        starts = np.asarray(indptr[a:e], dtype=np.int64) - s
+        nonempty = np.diff(np.asarray(indptr[a:e + 1])) > 0
+        out[a:e][nonempty] = np.add.reduceat(prod, starts[nonempty], axis=0)
+    return out
+
+
+def _orthonormal(y: np.ndarray) -> np.ndarray:
+    q, _ = np.linalg.qr(y)
+    return q.astype(np.float32)
+
+
+def randomized_svd(
+    csr: Csr, n_cols: int, k: int, n_iter: int = DEFAULT_ITERS, seed: int = 0
+) -> Tuple[np.ndarray, np.ndarray]:
+    """CSR 矩阵 A (n, n_cols) 的前 k 个奇异值与右奇异向量，返回 (s (k,), V (n_cols, k))。"""
+    from vector_store import csr_transpose
+    n = len(csr[0]) - 1
+    k = min(k, n, n_cols)
+    width = min(k + OVERSAMPLE, n, n_cols)
+    csr_t = csr_transpose(csr, n_cols)
+    rng = np.random.default_rng(seed)
+    omega = rng.standard_normal((n_cols, width)).astype(np.float32)
+    q = _orthonormal(csr_matmul(csr, omega))
+    for _ in range(n_iter):
+        # 每步都重新正交化，避免小奇异值方向在 float32 下被舍入误差淹没
+        q = _orthonormal(csr_matmul(csr_t, q))
+        q = _orthonormal(csr_matmul(csr, q))
+    # B = Qᵀ·A，即 (Aᵀ·Q)ᵀ
+    bt = csr_matmul(csr_t, q)
+    _, s, vt = np.linalg.svd(bt.T.astype(np.float64), full_matrices=False)
+    return s[:k].astype(np.float32), vt[:k].T.astype(np.float32)
+
+
+def fit_lsa(csr: Csr, n_cols: int, dim: int, n_iter: int = DEFAULT_ITERS, seed: int = 0) -> Tuple[np.ndarray, float]:
+    """对（已行归一化的）TF-IDF CSR 矩阵拟合 LSA 投影，返回 (投影矩阵 float32 (n_cols, dim), 保留能量占比)。
+    保留能量占比 = Σ s² / ‖A‖²_F，即投影后平均保留的向量长度平方。"""
+    s, v = randomized_svd(csr, n_cols, dim, n_iter=n_iter, seed=seed)
+    total = float(np.square(np.asarray(csr[2], dtype=np.float64)).sum())
+    return v, float(np.square(s.astype(np.float64)).sum() / total) if total else 0.0
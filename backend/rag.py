@@ -1,42 +1,158 @@
 """
 RAG 检索模块 —— 第一层「喂书」：从命理知识库中检索相关片段，供大模型参考
-优先使用白话文向量库（embeddings.npy + meta.json）语义检索；无向量库时回退到关键词匹配
+优先使用白话文向量库（向量 mmap 加载；行元数据列式存储，content 只为命中的行解码）语义检索；无向量库时回退到关键词匹配
+关键词检索读取 knowledge/chunks.pack（只读 mmap）+ keyword_index/ 倒排索引做 BM25 打分，未打包时才扫描 chunks 目录
+retrieve(query, sources=[...]) 只在指定的书（分片）内检索，多本书时在线程池中并行打分后合并 top-k
+
+热更新：向量库按版本发布（store_versions.py），chunks.pack / keyword_index 以原子替换写出。
+已加载的知识库以快照对象持有（向量库 + 配套词表 + ANN；chunk 打包 + 倒排索引），每次检索开始时取一次引用，
+整次检索只用这一份快照。后台线程（start_reloader，RAG_RELOAD_INTERVAL 秒轮询）发现新版本后在请求路径之外
+校验、加载、预热，再用一次赋值整体换入；正在进行的检索继续用旧快照，不会读到半新半旧的数据。
 """
 
-import os
 import json
+import os
+import re
+import threading
+import time
+
+from retrieval_cache import ConversationContexts, RetrievalCache
 
 _BASE = os.path.dirname(os.path.abspath(__file__))
 _CHUNKS_DIR = os.path.join(_BASE, "knowledge", "chunks")
+_CHUNKS_PACK = os.path.join(_BASE, "knowledge", "chunks.pack")
+_KEYWORD_INDEX_DIR = os.path.join(_BASE, "knowledge", "keyword_index")
+_CHUNK_ALIGNMENT = os.path.join(_BASE, "knowledge", "chunk_alignment.json")
 _VECTOR_STORE_DIR = os.path.join(_BASE, "knowledge", "vector_store")
-_EMBEDDINGS_FILE = "embeddings.npy"
-_META_FILE = "meta.json"
 
-_vector_embeddings = None
-_vector_meta = None
+_vector_state = None   # _VectorState：当前向量库版本的快照，热切换时整体替换
+_keyword_state = None  # _KeywordState：当前 chunk 打包 + 倒排索引 + 段落对齐的快照
+_hybrid_row_map = None
+_shard_pool = None
+_pack_shard_masks = None
+_term_matcher = None
+
+# 向量检索精确重排：量化存储时先按近似分数取 top_k × 该倍数的 shortlist，
+# 再用 float32 精确向量重排；设为 0 关闭重排
+_VECTOR_RERANK_FACTOR = int(os.getenv("RAG_VECTOR_RERANK_FACTOR", "4"))
+
+# 近似最近邻：向量库目录下有 ann/ 索引时自动使用；RAG_ANN=0 关闭，RAG_ANN_NPROBE 覆盖探测簇数
+_ANN_ENABLED = os.getenv("RAG_ANN", "1") != "0"
+_ANN_NPROBE = int(os.getenv("RAG_ANN_NPROBE", "0"))
+
+# 参考文本打包：content 总字符预算、估算 token 预算（0 为不限）、近重复判定的 MinHash Jaccard 阈值
+# （0 关闭去重），以及为去重后补位而多取的候选数。原文/白话互为翻译的 chunk 按段落对齐去重，不看阈值
+_CONTEXT_MAX_CHARS = int(os.getenv("RAG_CONTEXT_MAX_CHARS", "2500"))
+_CONTEXT_MAX_TOKENS = int(os.getenv("RAG_CONTEXT_MAX_TOKENS", "0"))
+_CONTEXT_DUP_THRESHOLD = float(os.getenv("RAG_CONTEXT_DUP_THRESHOLD", "0.5"))
+_CONTEXT_OVERFETCH = int(os.getenv("RAG_CONTEXT_OVERFETCH", "3"))
+
+# 批量检索每批的查询数：限制 (批大小 × 向量库行数) 分数矩阵的内存
+_BATCH_QUERIES = int(os.getenv("RAG_BATCH_QUERIES", "256"))
+
+# 分书检索：多个分片并行打分的线程数
+_SHARD_WORKERS = int(os.getenv("RAG_SHARD_WORKERS", "4"))
+
+# 热更新：后台线程检查新版本的间隔（秒，0 关闭）；加载新向量库版本前是否按 checksums.json 校验
+_RELOAD_INTERVAL = float(os.getenv("RAG_RELOAD_INTERVAL", "30"))
+_RELOAD_VERIFY = os.getenv("RAG_RELOAD_VERIFY", "1") != "0"
+_reload_lock = threading.Lock()
+_reloader = None  # (pid, 线程)：fork 出的子进程没有父进程的线程，按 pid 判断是否需要重新启动
+_reload_attempted = {}  # 各快照最近一次尝试加载的版本，校验失败或不完整时不在每次轮询重复加载
+
+# 检索结果缓存：条目数 / 结果总字符数上限 + TTL（秒）；RAG_CACHE_SIZE=0 关闭
+_cache = RetrievalCache(
+    max_entries=int(os.getenv("RAG_CACHE_SIZE", "512")),
+    max_chars=int(os.getenv("RAG_CACHE_MAX_CHARS", "2000000")),
+    ttl=float(os.getenv("RAG_CACHE_TTL", "3600")),
+)
+# 对话内检索复用（retrieve_for_conversation）：按对话保存上一轮的组合查询、查询向量与选中的 chunk。
+# 不超过 RAG_FOLLOWUP_MAX_CHARS 字的追问视为跟进；与上一轮查询向量余弦不低于 RAG_FOLLOWUP_MIN_SIM 视为同一话题；
+# 扩展检索时组合最近 RAG_CONVERSATION_TURNS 轮问题
+_conversations = ConversationContexts(
+    max_entries=int(os.getenv("RAG_CONVERSATION_CACHE_SIZE", "1024")),
+    ttl=float(os.getenv("RAG_CONVERSATION_TTL", "3600")),
+)
+_FOLLOWUP_MAX_CHARS = int(os.getenv("RAG_FOLLOWUP_MAX_CHARS", "16"))
+_FOLLOWUP_MIN_SIM = float(os.getenv("RAG_FOLLOWUP_MIN_SIM", "0.15"))
+_CONVERSATION_TURNS = int(os.getenv("RAG_CONVERSATION_TURNS", "3"))
+# 追问的常见说法：短句含这些词且不含术语时直接沿用上一轮结果
+_FOLLOWUP_MARKERS = ("那", "呢", "详细", "具体", "展开", "继续", "还有", "再说", "为什么", "怎么说", "什么意思")
+_conversation_counts = {"reuse": 0, "extend": 0, "new": 0}
+
+# chunk 打包、倒排索引与段落对齐的版本依据：文件/目录的 (inode, mtime, 大小)，原子替换后 inode 必变
+_KEYWORD_PATHS = (_CHUNKS_PACK, _KEYWORD_INDEX_DIR, _CHUNK_ALIGNMENT)
+_BACKENDS = ("auto", "hybrid", "vector", "keyword")
+# retrieve() 未指定 backend 时使用的检索方式。默认 hybrid：黄金集上 auto/vector 的 recall@5 明显低于
+# 关键词与混合检索（见 scripts/bench_retrieval.py），向量库构建后 auto 会变成向量优先
+_DEFAULT_BACKEND = os.getenv("RAG_BACKEND", "hybrid")
+
+# 混合检索各阶段预算：第一阶段关键词候选数、参与融合的每路排名深度、RRF 常数与向量路权重
+_HYBRID_KEYWORD_CANDIDATES = int(os.getenv("RAG_HYBRID_KEYWORD_CANDIDATES", "300"))
+_HYBRID_FUSION_DEPTH = int(os.getenv("RAG_HYBRID_FUSION_DEPTH", "50"))
+_HYBRID_RRF_K = 60
+_HYBRID_VECTOR_WEIGHT = float(os.getenv("RAG_HYBRID_VECTOR_WEIGHT", "1.0"))
+
+# 倒排索引打分时扩展术语与标签词条相对 query 原文 n-gram 的权重
+_EXPAND_TERM_WEIGHT = 0.5
+_TAG_TERM_WEIGHT = 2.0
+
+
+class _VectorState:
+    """一个向量库版本的只读快照：版本名、向量库（mmap）、配套词表与 ANN 索引。未构建时 store 为 None。"""
+
+    __slots__ = ("version", "store", "vocab", "ann")
+
+    def __init__(self, version, store=None, vocab=None, ann=None):
+        self.version = version
+        self.store = store
+        self.vocab = vocab
+        self.ann = ann
+
+
+class _KeywordState:
+    """chunk 打包、倒排索引与段落对齐的只读快照；索引与打包条数不一致时 index 为 None，
+    paragraphs 为 {chunk id: 段落键列表}（未生成时为空 dict）。"""
+
+    __slots__ = ("version", "pack", "index", "paragraphs")
+
+    def __init__(self, version, pack=None, index=None, paragraphs=None):
+        self.version = version
+        self.pack = pack
+        self.index = index
+        self.paragraphs = paragraphs or {}
+
+
+def _open_vector_state(version):
+    """加载向量库当前发布的版本（或旧版平铺目录）及其词表、ANN 索引。"""
+    from embedding_utils import load_vocab
+    from store_versions import current_dir
+    from vector_store import load_store, ANN_DIR
+    store_dir = current_dir(_VECTOR_STORE_DIR)
+    store = load_store(store_dir) if store_dir else None
+    if store is None:
+        return _VectorState(version)
+    vocab = load_vocab(store_dir)
+    ann = None
+    if _ANN_ENABLED:
+        from ann_index import load_ann
+        ann = load_ann(os.path.join(store_dir, ANN_DIR), store)
+    return _VectorState(version, store, vocab, ann)
+
+
+def _load_vector_state():
+    """懒加载向量库快照；检索时先取一次引用，整次检索只用这一份。"""
+    global _vector_state
+    state = _vector_state
+    if state is None:
+        from store_versions import current_version
+        state = _vector_state = _open_vector_state(current_version(_VECTOR_STORE_DIR))
+    return state
 
 
 def _load_vector_store():
-    """懒加载向量库：embeddings 数组与 meta 列表。未构建则返回 (None, None)。"""
-    global _vector_embeddings, _vector_meta
-    if _vector_embeddings is not None:
-        return _vector_embeddings, _vector_meta
-    emb_path = os.path.join(_VECTOR_STORE_DIR, _EMBEDDINGS_FILE)
-    meta_path = os.path.join(_VECTOR_STORE_DIR, _META_FILE)
-    if not os.path.isfile(emb_path) or not os.path.isfile(meta_path):
-        return None, None
-    try:
-        import numpy as np
-        _vector_embeddings = np.load(emb_path)
-        with open(meta_path, "r", encoding="utf-8") as f:
-            _vector_meta = json.load(f)
-        if len(_vector_meta) == 0 or _vector_embeddings.shape[0] != len(_vector_meta):
-            _vector_embeddings = None
-            _vector_meta = None
-            return None, None
-        return _vector_embeddings, _vector_meta
-    except Exception:
-        return None, None
+    """懒加载向量库（vector_store.VectorStore，矩阵 mmap 只读）。未构建则返回 None。"""
+    return _load_vector_state().store
 
 # 命理术语同义/扩展：query 中出现任一词则加入整组，提高召回
 _QUERY_EXPAND_TERMS = [
@@ -62,104 +178,707 @@ _QUERY_EXPAND_TERMS = [
 ]
 
 
+def _get_term_matcher():
+    """懒编译术语扩展词典的 Aho-Corasick 自动机（term_matcher.GroupMatcher）；
+    scripts/pack_chunks.py 构建倒排索引时用同一个自动机给 chunk 预打术语词条。"""
+    global _term_matcher
+    if _term_matcher is None:
+        from term_matcher import GroupMatcher
+        _term_matcher = GroupMatcher(_QUERY_EXPAND_TERMS)
+    return _term_matcher
+
+
 def _load_chunks():
-    """加载 chunks 目录下所有 JSON 文件，返回 list[dict]"""
-    chunks = []
-    if not os.path.isdir(_CHUNKS_DIR):
-        return chunks
-    for name in os.listdir(_CHUNKS_DIR):
-        if not name.endswith(".json"):
-            continue
-        path = os.path.join(_CHUNKS_DIR, name)
+    """加载 chunks 目录下所有 JSON 文件，返回 list[dict]（未打包时的回退路径）"""
+    from chunk_store import load_chunk_dir
+    return load_chunk_dir(_CHUNKS_DIR)
+
+
+def _keyword_version() -> tuple:
+    """chunk 打包文件、倒排索引目录与段落对齐文件的 (inode, mtime, 大小) 快照。"""
+    version = []
+    for path in _KEYWORD_PATHS:
         try:
-            with open(path, "r", encoding="utf-8") as f:
-                data = json.load(f)
-                # 支持单对象或 {"chunks": [...]}
-                if "chunks" in data:
-                    chunks.extend(data["chunks"])
-                else:
-                    chunks.append(data)
-        except Exception:
-            continue
-    return chunks
+            st = os.stat(path)
+            version.append((st.st_ino, st.st_mtime_ns, st.st_size))
+        except OSError:
+            version.append(None)
+    return tuple(version)
 
 
-def _retrieve_vector(query: str, top_k: int) -> str:
-    """使用本地向量库（npy + meta）语义检索白话文知识库。"""
-    emb, meta = _load_vector_store()
-    if emb is None or not meta:
-        return ""
+def _load_paragraphs() -> dict:
+    """读取 scripts/align_chunks.py 生成的原文/白话段落对齐；未生成或损坏时返回空 dict（只做 MinHash 去重）。"""
+    try:
+        with open(_CHUNK_ALIGNMENT, "r", encoding="utf-8") as f:
+            return json.load(f).get("paragraphs") or {}
+    except (OSError, ValueError, AttributeError):
+        return {}
+
+
+def _open_keyword_state(version):
+    """打开 chunk 打包文件（只读 mmap）、倒排索引（mmap 只读）与段落对齐；索引未构建或条数不一致时不用索引。"""
+    from chunk_store import open_pack
+    from keyword_index import load_index
+    pack = open_pack(_CHUNKS_PACK)
+    index = load_index(_KEYWORD_INDEX_DIR) if pack is not None else None
+    if index is not None and len(index) != len(pack):
+        index = None
+    return _KeywordState(version, pack, index, _load_paragraphs())
+
+
+def _load_keyword_state():
+    """懒加载 chunk 打包 + 倒排索引快照；检索时先取一次引用，整次检索只用这一份。"""
+    global _keyword_state
+    state = _keyword_state
+    if state is None:
+        state = _keyword_state = _open_keyword_state(_keyword_version())
+    return state
+
+
+def _load_chunk_pack():
+    """当前快照的 chunk 打包文件。未打包返回 None。"""
+    return _load_keyword_state().pack
+
+
+def _load_keyword_index():
+    """当前快照的倒排索引。未构建或与打包文件条数不一致时返回 None。"""
+    return _load_keyword_state().index
+
+
+def _fetch_k(top_k: int) -> int:
+    """检索阶段实际取的候选数：比 top_k 多取几条，近重复被去掉后可以补位。"""
+    return top_k + max(_CONTEXT_OVERFETCH, 0)
+
+
+def _pack_refs(chunks, top_k: int) -> list:
+    """检索到的 chunk 去重、按预算截断，返回最多 top_k 个 chunk。"""
+    from context_packer import pack
+    return pack(
+        chunks,
+        max_items=top_k,
+        max_chars=_CONTEXT_MAX_CHARS,
+        max_tokens=_CONTEXT_MAX_TOKENS,
+        dup_threshold=_CONTEXT_DUP_THRESHOLD,
+        paragraphs=_load_keyword_state().paragraphs,
+    )
+
+
+def _format_refs(chunks) -> str:
+    """把打包后的 chunk 拼成注入系统提示词的参考文本；无有效内容时返回空串。"""
+    lines = ["【命理知识库参考】"]
+    for c in chunks:
+        source = c.get("source", "")
+        content = (c.get("content") or "").strip()
+        if content:
+            lines.append(f"来源：{source}\n{content}\n")
+    return "\n".join(lines) if len(lines) > 1 else ""
+
+
+def _embed_query_dense(query: str, vocab=None):
+    """查询的归一化稠密 TF-IDF 向量（float32）；vocab 为与向量库配套的词表（见 _VectorState）。"""
+    from embedding_utils import embed_query
+    import numpy as np
+    return np.asarray(embed_query(query, vocab), dtype=np.float32)
+
+
+def _query_rows(store, queries: list, vocab=None):
+    """查询编码为与向量库同一空间的 CSR 三元组：csr 布局为稀疏 TF-IDF；
+    dense 布局取 embed_texts 的稠密向量（LSA 库为投影后的 k 维向量）再转为 CSR。"""
+    import numpy as np
+    from embedding_utils import embed_texts, embed_texts_sparse
+    if store.layout == "csr" or not store.lsa_dim:
+        return embed_texts_sparse(queries, vocab=vocab)
+    dense = embed_texts(queries, vocab=vocab)
+    rows, cols = np.nonzero(dense)
+    indptr = np.zeros(len(queries) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=len(queries)), out=indptr[1:])
+    return indptr, cols.astype(np.int32), dense[rows, cols]
+
+
+def _resolve_sources(sources) -> tuple:
+    """把 sources（书 id 或书名，如 "ditiansui" / "滴天髓阐微" / "滴天髓阐微（白话）"）规范为排序后的书 id 元组。"""
+    if not sources:
+        return ()
+    from books import BOOK_DISPLAY
+    by_name = {name: bid for bid, name in BOOK_DISPLAY.items()}
+    shards = set()
+    for s in ([sources] if isinstance(sources, str) else sources):
+        name = s.strip().replace("（白话）", "")
+        bid = name if name in BOOK_DISPLAY else by_name.get(name)
+        if bid is None:
+            raise ValueError(f"未知书目: {s}，可选 {list(BOOK_DISPLAY)} 或 {list(by_name)}")
+        shards.add(bid)
+    return tuple(sorted(shards))
+
+
+def _get_shard_pool():
+    global _shard_pool
+    if _shard_pool is None:
+        from concurrent.futures import ThreadPoolExecutor
+        _shard_pool = ThreadPoolExecutor(max_workers=max(1, _SHARD_WORKERS), thread_name_prefix="rag-shard")
+    return _shard_pool
+
+
+def _search_shards(store, q_sparse, top_k: int, shards: tuple):
+    """只对指定书打分；多本书时每本书一个任务并行打分，各取 top_k 后合并。返回行号数组。"""
+    import numpy as np
+    from vector_store import top_k_indices
+
+    def search_one(shard):
+        rows, scores = store.score_shard(shard, *q_sparse)
+        best = top_k_indices(scores, top_k)
+        return rows[best], scores[best]
+
+    if len(shards) == 1:
+        parts = [search_one(shards[0])]
+    else:
+        parts = list(_get_shard_pool().map(search_one, shards))
+    rows = np.concatenate([r for r, _ in parts])
+    scores = np.concatenate([sc for _, sc in parts])
+    return rows[top_k_indices(scores, top_k)]
+
+
+def _retrieve_vector(query: str, top_k: int, shards: tuple = ()) -> list:
+    """使用本地向量库（npy + meta）语义检索白话文知识库；shards 非空时只检索这些书。"""
+    state = _load_vector_state()
+    store, vocab = state.store, state.vocab
+    if store is None:
+        return []
     q = query.strip()
     if not q:
-        return ""
+        return []
+    k = _fetch_k(top_k)
     try:
-        from embedding_utils import embed_query
-        import numpy as np
-        q_vec = np.array(embed_query(q), dtype=np.float32).reshape(1, -1)
-        # 余弦相似度：emb (N,d) @ q_vec.T (d,1) -> (N,1)，再归一化
-        norms = np.linalg.norm(emb, axis=1, keepdims=True)
-        norms[norms == 0] = 1e-9
-        emb_n = emb / norms
-        q_n = q_vec / (np.linalg.norm(q_vec) or 1e-9)
-        scores = emb_n @ q_n.T
-        scores = scores.flatten()
-        top_idx = np.argsort(-scores)[:top_k]
-        lines = ["【命理知识库参考】"]
-        for i in top_idx:
-            m = meta[i]
-            source = m.get("source", "")
-            content = (m.get("content") or "").strip()
-            if content:
-                lines.append(f"来源：{source}\n{content}\n")
-        return "\n".join(lines) if len(lines) > 1 else ""
+        from embedding_utils import embed_query_sparse
+        from vector_store import top_k_indices
+        if shards:
+            _, q_indices, q_data = _query_rows(store, [q], vocab)
+            top_idx = _search_shards(store, (q_indices, q_data), k, shards)
+            return _pack_refs((store.meta[i] for i in top_idx), top_k)
+        if state.ann is not None:
+            # IVF(-PQ)：只打分最相近的 nprobe 个簇内的候选
+            top_idx = state.ann.search(store, _embed_query_dense(q, vocab), k, _ANN_NPROBE or None)
+            return _pack_refs((store.meta[i] for i in top_idx), top_k)
+        # 向量库已按行归一化，查询向量（本身已归一化）与之相乘即为余弦相似度
+        if store.layout == "csr":
+            # 稀疏库：只遍历查询非零 n-gram 对应的列
+            scores = store.score_sparse(*embed_query_sparse(q, vocab))
+        else:
+            q_vec = _embed_query_dense(q, vocab)
+            scores = store.score(q_vec)
+        if store.exact is not None and _VECTOR_RERANK_FACTOR > 0:
+            shortlist = top_k_indices(scores, k * _VECTOR_RERANK_FACTOR)
+            exact = store.exact_scores(q_vec, shortlist)
+            top_idx = shortlist[top_k_indices(exact, k)]
+        else:
+            top_idx = top_k_indices(scores, k)
+        return _pack_refs((store.meta[i] for i in top_idx), top_k)
     except Exception:
-        return ""
+        return []
 
 
-def _retrieve_keyword(query: str, top_k: int) -> str:
-    """关键词/标签匹配检索（回退方案）。"""
-    chunks = _load_chunks()
-    if not chunks:
-        return ""
-
+def _expand_query(query: str):
+    """返回 (小写 query, 查询词集合)：按空白/标点切出的长词 + 命中的术语扩展组（自动机一次扫描）。"""
     query_lower = query.strip().lower()
     query_words = set()
     for w in query_lower.replace("，", " ").replace("。", " ").split():
         if len(w) >= 2:
             query_words.add(w)
-    for group in _QUERY_EXPAND_TERMS:
-        if any(t in query_lower for t in group):
-            query_words.update(group)
+    query_words.update(_get_term_matcher().expand(query_lower))
+    return query_lower, query_words
+
+
+def _index_term_weights(query_lower: str, query_words: set, index=None) -> dict:
+    """把查询转为倒排索引词条及权重：query 本身的二字 n-gram、扩展术语（索引带预打术语词条时查整词，
+    否则拆成 n-gram，单字术语用单字），以及所有查询词对应的标签词条（标签是人工整理的，权重更高）。"""
+    from keyword_index import text_ngrams, TAG_PREFIX, TERM_PREFIX
+    term_tags = index is not None and index.has_term_tags
+    matcher = _get_term_matcher()
+    weights = {}
+    for g in text_ngrams(query_lower, (2, 2)) or text_ngrams(query_lower, (1, 1)):
+        weights[g] = 1.0
+    for w in query_words:
+        if term_tags and w in matcher:
+            weights[TERM_PREFIX + w] = _EXPAND_TERM_WEIGHT
+        else:
+            grams = text_ngrams(w, (1, 1)) if len(w) == 1 else text_ngrams(w, (2, 2))
+            for g in grams:
+                weights.setdefault(g, _EXPAND_TERM_WEIGHT)
+        weights[TAG_PREFIX + w] = _TAG_TERM_WEIGHT
+    return weights
+
+
+def _pack_shard_mask(pack, shards: tuple):
+    """chunk 打包下标是否属于指定书的 bool 掩码；shards 为空时返回 None。按 (pack, shards) 缓存。"""
+    global _pack_shard_masks
+    if not shards:
+        return None
+    if _pack_shard_masks is None or _pack_shard_masks[0] is not pack:
+        _pack_shard_masks = (pack, {})
+    masks = _pack_shard_masks[1]
+    if shards not in masks:
+        import numpy as np
+        from vector_store import shard_of
+        wanted = set(shards)
+        masks[shards] = np.array([shard_of(pack.chunk_id(i)) in wanted for i in range(len(pack))], dtype=bool)
+    return masks[shards]
+
+
+def _keyword_from_index(index, pack, query_lower, query_words, top_k, shards=()):
+    """倒排索引 + BM25：只遍历查询词条的 posting list。"""
+    hits = index.search(_index_term_weights(query_lower, query_words, index), top_k, _pack_shard_mask(pack, shards))
+    return [pack.get(i) for i, _ in hits]
+
+
+def _keyword_from_pack(pack, query_words, top_k, shards=()):
+    """无索引时在打包文件上做子串匹配：标签在内存中匹配，content 直接在 mmap 页上按 UTF-8 字节查找。"""
+    scores = {}
+    mask = _pack_shard_mask(pack, shards)
+    for w in query_words:
+        hits = pack.find_all(w.encode("utf-8"))
+        hits.update(i for i, tags in pack.tags_lower.items() if w in tags)
+        for i in hits:
+            if mask is not None and not mask[i]:
+                continue
+            scores[i] = scores.get(i, 0) + 1
+    scored = sorted(scores.items(), key=lambda x: (-x[1], x[0]))
+    return [pack.get(i) for i, _ in scored[:top_k]]
 
+
+def _keyword_from_dir(query_words, top_k, shards=()):
+    """未打包时逐个读取 chunks 目录做子串匹配：查询词编译为一个自动机，每个 chunk 只扫一遍。"""
+    from term_matcher import TermMatcher
+    from vector_store import shard_of
+    matcher = TermMatcher(query_words)
     scored = []
-    for c in chunks:
+    for c in _load_chunks():
+        if shards and shard_of(c.get("id", "")) not in shards:
+            continue
         tags = " ".join(c.get("tags", []))
         content = (c.get("content") or "")
         text = (tags + " " + content).lower()
-        score = sum(1 for w in query_words if w in text)
+        score = len(matcher.find(text))
         if score > 0:
             scored.append((score, c))
-
     scored.sort(key=lambda x: -x[0])
-    selected = [c for _, c in scored[:top_k]]
+    return [c for _, c in scored[:top_k]]
 
-    if not selected:
-        return ""
 
-    lines = ["【命理知识库参考】"]
-    for c in selected:
-        source = c.get("source", "")
-        content = (c.get("content") or "").strip()
-        lines.append(f"来源：{source}\n{content}\n")
-    return "\n".join(lines)
+def _retrieve_keyword(query: str, top_k: int, shards: tuple = ()) -> list:
+    """关键词/标签匹配检索（回退方案）。
+    优先用倒排索引 BM25 打分；无索引时退化为打包文件 / chunks 目录上的子串匹配。"""
+    query_lower, query_words = _expand_query(query)
+    if not query_lower:
+        return []
+
+    state = _load_keyword_state()
+    pack, index = state.pack, state.index
+    k = _fetch_k(top_k)
+    if index is not None:
+        selected = _keyword_from_index(index, pack, query_lower, query_words, k, shards)
+    elif pack is not None:
+        selected = _keyword_from_pack(pack, query_words, k, shards)
+    else:
+        selected = _keyword_from_dir(query_words, k, shards)
+
+    return _pack_refs(selected, top_k)
+
+
+def _vector_rows_for_pack(pack, store):
+    """chunk 打包下标 -> 向量库行号的映射数组（无向量的 chunk 为 -1），按 (pack, store) 缓存。"""
+    global _hybrid_row_map
+    if _hybrid_row_map is None or _hybrid_row_map[0] is not pack or _hybrid_row_map[1] is not store:
+        import numpy as np
+        row_ids = store.row_ids()
+        rows = np.array([row_ids.get(pack.chunk_id(i), -1) for i in range(len(pack))], dtype=np.int64)
+        _hybrid_row_map = (pack, store, rows)
+    return _hybrid_row_map[2]
+
+
+def _retrieve_hybrid(query: str, top_k: int, shards: tuple = ()) -> list:
+    """混合检索：第一阶段用术语扩展 + 倒排索引 BM25 取候选，第二阶段只对候选行算 TF-IDF 余弦，
+    两路排名用 RRF（reciprocal rank fusion）融合。单次耗时只与候选数有关，不随语料规模增长。
+    无倒排索引时返回空列表（由调用方回退）。"""
+    keyword_state = _load_keyword_state()
+    pack, index = keyword_state.pack, keyword_state.index
+    query_lower, query_words = _expand_query(query)
+    if index is None or not query_lower:
+        return []
+    try:
+        import numpy as np
+        weights = _index_term_weights(query_lower, query_words, index)
+        candidates = index.search(weights, _HYBRID_KEYWORD_CANDIDATES, _pack_shard_mask(pack, shards))
+        if not candidates:
+            return []
+        cand = np.array([i for i, _ in candidates], dtype=np.int64)
+        kw_rrf = 1.0 / (_HYBRID_RRF_K + np.arange(1, len(cand) + 1))
+        fused = dict(zip(cand[:_HYBRID_FUSION_DEPTH].tolist(), kw_rrf[:_HYBRID_FUSION_DEPTH].tolist()))
+
+        vector_state = _load_vector_state()
+        store = vector_state.store
+        has_vec = np.zeros(len(cand), dtype=bool)
+        if store is not None:
+            rows = _vector_rows_for_pack(pack, store)[cand]
+            has_vec = rows >= 0
+            if has_vec.any():
+                q_vec = _embed_query_dense(query_lower, vector_state.vocab)
+                vec_scores = store.score_rows(q_vec, rows[has_vec])
+                order = np.argsort(-vec_scores, kind="stable")[:_HYBRID_FUSION_DEPTH]
+                for rank, j in enumerate(cand[has_vec][order].tolist()):
+                    fused[j] = fused.get(j, 0.0) + _HYBRID_VECTOR_WEIGHT / (_HYBRID_RRF_K + rank + 1)
+        # 不在向量库中的 chunk（原文 chunk、手工整理的概念 chunk）没有向量排名，按其关键词排名补足，
+        # 避免融合时天然吃亏
+        for pos in np.flatnonzero(~has_vec[:_HYBRID_FUSION_DEPTH]).tolist():
+            j = int(cand[pos])
+            fused[j] += _HYBRID_VECTOR_WEIGHT * kw_rrf[pos]
+
+        best = sorted(fused.items(), key=lambda x: (-x[1], x[0]))[:_fetch_k(top_k)]
+        return _pack_refs((pack.get(i) for i, _ in best), top_k)
+    except Exception:
+        return []
+
+
+def _store_version() -> tuple:
+    """当前已加载快照的版本，作为缓存版本号：热切换后缓存随之清空，检索结果与所用快照一致。"""
+    return _load_vector_state().version, _load_keyword_state().version
+
+
+def _swap_vector_state(state):
+    global _vector_state
+    from embedding_utils import set_vocab
+    _vector_state = state
+    # 不显式传词表的调用方（embed_query 等）同样换用新版本的词表
+    set_vocab(state.vocab)
+
+
+def check_reload() -> dict:
+    """检查向量库与 chunk 打包 / 倒排索引是否有新版本；有则校验、加载、预热后整体换入。
+    返回本次换入的快照及耗时（毫秒），无变化时返回空 dict。由 start_reloader 的后台线程周期调用，
+    也可手动调用；尚未加载过的部分不处理（首次检索时自然加载最新版本）。"""
+    global _keyword_state
+    from store_versions import current_dir, current_version, verify
+    swapped = {}
+    with _reload_lock:
+        old = _vector_state
+        version = current_version(_VECTOR_STORE_DIR)
+        if old is not None and version != old.version and _reload_attempted.get("vector") != version:
+            _reload_attempted["vector"] = version
+            start = time.perf_counter()
+            store_dir = current_dir(_VECTOR_STORE_DIR)
+            if version is not None and _RELOAD_VERIFY and not verify(store_dir):
+                print(f"⚠️ 向量库版本 {version} 校验失败，继续使用 {old.version}")
+            else:
+                state = _open_vector_state(version)
+                if state.store is not None:
+                    state.store.row_ids()
+                    state.store.prepare_shards()
+                    _swap_vector_state(state)
+                    swapped["vector"] = {
+                        "from": old.version, "to": version,
+                        "ms": round((time.perf_counter() - start) * 1000, 1),
+                    }
+
+        old = _keyword_state
+        version = _keyword_version()
+        if old is not None and version != old.version and _reload_attempted.get("keyword") != version:
+            _reload_attempted["keyword"] = version
+            start = time.perf_counter()
+            state = _open_keyword_state(version)
+            # 打包文件已换而索引尚未重建（或相反）时条数不一致，等两者都就位再换入
+            if state.pack is not None and (state.index is not None or version[1] is None):
+                _keyword_state = state
+                swapped["keyword"] = {"ms": round((time.perf_counter() - start) * 1000, 1)}
+
+        if swapped and _keyword_state is not None and _vector_state is not None:
+            # 预热混合检索的行映射（旧快照的请求仍按对象身份取用各自的映射）
+            pack, store = _keyword_state.pack, _vector_state.store
+            if pack is not None and store is not None:
+                _vector_rows_for_pack(pack, store)
+    return swapped
+
+
+def _reload_loop(interval: float):
+    while True:
+        time.sleep(interval)
+        try:
+            swapped = check_reload()
+            if swapped:
+                print(f"📚 知识库已热切换: {swapped}")
+        except Exception as e:
+            print(f"⚠️ 知识库热更新检查失败: {e}")
+
+
+def start_reloader(interval: float = None) -> bool:
+    """启动后台热更新线程（每进程一个，daemon）；interval 默认取 RAG_RELOAD_INTERVAL，为 0 时不启动。
+    线程不会被 fork 继承：gunicorn 在每个 worker fork 后调用（见 gunicorn.conf.py 的 post_fork）。"""
+    global _reloader
+    interval = _RELOAD_INTERVAL if interval is None else interval
+    if interval <= 0:
+        return False
+    if _reloader is not None and _reloader[0] == os.getpid() and _reloader[1].is_alive():
+        return True
+    thread = threading.Thread(target=_reload_loop, args=(interval,), name="rag-reloader", daemon=True)
+    thread.start()
+    _reloader = (os.getpid(), thread)
+    return True
+
+
+def _normalize_query(query: str) -> str:
+    """缓存键用的归一化：去首尾空白、小写、合并连续空白、去掉句末标点。"""
+    q = re.sub(r"\s+", " ", query.strip().lower())
+    return q.rstrip("？?！!。.～~ ")
+
+
+def cache_stats() -> dict:
+    """检索缓存的命中/未命中等统计，以及对话内检索复用 / 扩展 / 冷检索的次数。"""
+    stats = _cache.stats()
+    stats["conversation"] = dict(_conversation_counts, contexts=len(_conversations))
+    return stats
+
+
+def warmup() -> dict:
+    """预先加载知识库结构（向量库及其分书分片视图、词表、chunk 打包、倒排索引、ANN、混合检索行映射）并跑一次检索，
+    返回各步耗时（毫秒）。gunicorn preload 模式下在 master 中调用一次，fork 出的 worker 直接共享：
+    npy / chunks.pack 为 mmap，走同一份页缓存；词表、meta 等 Python 对象按写时复制共享。
+    不创建线程池与网络连接，fork 安全。"""
+    timings = {}
+
+    def step(name, fn):
+        start = time.perf_counter()
+        fn()
+        timings[name] = round((time.perf_counter() - start) * 1000, 1)
+
+    def load_vocab():
+        # 词表随向量库快照一起加载，并设为 embedding_utils 的当前词表
+        from embedding_utils import set_vocab
+        set_vocab(_load_vector_state().vocab)
+
+    def load_vectors():
+        store = _load_vector_store()
+        if store is not None:
+            store.row_ids()
+            # 按书检索用的分片视图在 master 中建好，worker 首个按书检索的请求不再现建
+            store.prepare_shards()
+
+    def load_keyword():
+        pack = _load_chunk_pack()
+        _load_keyword_index()
+        store = _load_vector_store()
+        if pack is not None and store is not None:
+            _vector_rows_for_pack(pack, store)
 
+    def first_query():
+        import context_packer  # noqa: F401
+        _retrieve_hybrid("用神", 1)
+        _retrieve_vector("用神", 1)
 
-def retrieve(query: str, top_k: int = 5) -> str:
+    step("vocab_ms", load_vocab)
+    step("vector_store_ms", load_vectors)
+    step("keyword_ms", load_keyword)
+    step("first_query_ms", first_query)
+    return timings
+
+
+def _check_backend(backend: str) -> str:
+    backend = backend or _DEFAULT_BACKEND
+    if backend not in _BACKENDS:
+        raise ValueError(f"未知检索方式: {backend}，可选 {_BACKENDS}")
+    return backend
+
+
+def _search(q: str, top_k: int, backend: str, shards: tuple) -> list:
+    """按 backend 的回退顺序检索，返回打包后的 chunk 列表。"""
+    chunks = []
+    if backend == "hybrid":
+        chunks = _retrieve_hybrid(q, top_k, shards)
+    if not chunks and backend in ("auto", "hybrid", "vector"):
+        chunks = _retrieve_vector(q, top_k, shards)
+    if not chunks and backend in ("auto", "hybrid", "keyword"):
+        chunks = _retrieve_keyword(q, top_k, shards)
+    return chunks
+
+
+def _cached_search(q: str, top_k: int, backend: str, shards: tuple) -> list:
+    """带缓存的 _search：按 (q, top_k, backend, shards) 缓存打包后的 chunk，当前快照版本变化时整体失效。
+    retrieve() 与 retrieve_for_conversation() 的新话题 / 扩展检索共用同一份缓存。"""
+    _cache.check_version(_store_version())
+    key = (q, top_k, backend, shards)
+    chunks = _cache.get(key)
+    if chunks is not None:
+        return list(chunks)
+    start = time.perf_counter()
+    chunks = _search(q, top_k, backend, shards)
+    size = sum(len(c.get("content") or "") for c in chunks)
+    _cache.put(key, tuple(chunks), time.perf_counter() - start, size=size)
+    return chunks
+
+
+def retrieve_chunks(query: str, top_k: int = 5, backend: str = None, sources=None) -> list:
+    """与 retrieve() 相同的检索与打包流程，但返回 chunk 列表（含 id、source、content），不经缓存。
+    供评测脚本（scripts/bench_retrieval.py）等需要 chunk id 的调用方使用。"""
+    return _search(_normalize_query(query), top_k, _check_backend(backend), _resolve_sources(sources))
+
+
+def _vector_many(store, queries: list, k: int, shards: tuple, vocab=None) -> list:
+    """批量向量检索：整批查询编码为一个 CSR 查询矩阵，一次打分、逐行批量取 top_k。
+    返回每条查询的 [(行号, 分数), ...]。"""
+    import numpy as np
+    from vector_store import top_k_indices_batch
+    allowed = None
+    if shards:
+        allowed = np.zeros(len(store), dtype=bool)
+        for shard in shards:
+            allowed[store.shard_rows(shard)] = True
+    out = []
+    step = max(_BATCH_QUERIES, 1)
+    for start in range(0, len(queries), step):
+        batch = queries[start:start + step]
+        scores = store.score_batch(_query_rows(store, batch, vocab))
+        if allowed is not None:
+            scores[:, ~allowed] = -np.inf
+        top = top_k_indices_batch(scores, k)
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        for rows, row_scores in zip(top.tolist(), top_scores.tolist()):
+            out.append([(r, sc) for r, sc in zip(rows, row_scores) if sc != -np.inf])
+    return out
+
+
+def retrieve_many(queries, top_k: int = 5, backend: str = "vector", sources=None, pack: bool = False) -> list:
+    """
+    批量检索，供评测、预热缓存、批量生成报告等离线任务使用。返回与 queries 等长的列表，
+    每项为 chunk 列表 [{id, source, content, score}, ...]（按分数降序）。
+    vector / auto：全部查询一次编码为查询矩阵，与向量库做一次矩阵乘积（稀疏库为一次 gather + bincount），
+      再逐行批量取 top_k；auto 下无向量库或结果为空的查询回退到关键词检索。
+    hybrid / keyword（及 auto 的回退）：逐条走与 retrieve_chunks() 相同的流程（已打包，无 score 字段）。
+    pack=True 时向量结果也与 retrieve() 一样做近重复去重与长度预算（多取候选补位），否则返回原始 top_k。
+    """
+    backend = _check_backend(backend)
+    shards = _resolve_sources(sources)
+    qs = [_normalize_query(q) for q in queries]
+    results = [[] for _ in qs]
+    state = _load_vector_state() if backend in ("auto", "vector") else None
+    store = state.store if state is not None else None
+    if store is not None:
+        k = _fetch_k(top_k) if pack else top_k
+        todo = [i for i, q in enumerate(qs) if q]
+        for i, hits in zip(todo, _vector_many(store, [qs[i] for i in todo], k, shards, state.vocab)):
+            chunks = [dict(store.meta[r], score=round(sc, 6)) for r, sc in hits]
+            results[i] = _pack_refs(chunks, top_k) if pack else chunks
+    for i, q in enumerate(qs):
+        if results[i] or not q:
+            continue
+        if backend == "auto":
+            results[i] = _retrieve_keyword(q, top_k, shards)
+        elif backend in ("hybrid", "keyword"):
+            results[i] = _search(q, top_k, backend, shards)
+    return results
+
+
+def retrieve(query: str, top_k: int = 5, backend: str = None, sources=None) -> str:
     """
     根据用户问题从知识库检索相关片段，返回拼接后的参考文本。
-    优先使用白话文向量库语义检索；无向量库或无结果时回退到关键词检索。
+    backend（默认取环境变量 RAG_BACKEND，未设置为 "hybrid"）：
+      hybrid   关键词倒排索引取候选 + 向量重排，RRF 融合；无索引时按 auto 处理
+      auto     优先白话文向量库语义检索，无向量库或无结果时回退到关键词检索
+      vector / keyword  只走单一路径
+    sources：可选，书 id 或书名列表（如 ["ditiansui", "子平真诠评注"]），只在这些书内检索；
+      向量检索只对这些书的行打分，多本书时并行打分后合并 top-k。
+    结果按（归一化 query, top_k, backend, sources）缓存，知识库热切换到新版本后自动失效。
+    """
+    backend = _check_backend(backend)
+    return _format_refs(_cached_search(_normalize_query(query), top_k, backend, _resolve_sources(sources)))
+
+
+class _ConversationState:
+    """一个对话最近一轮的检索上下文：知识库版本、检索参数、最近几轮问题、组合查询的稀疏向量、选中的 chunk 与参考文本。"""
+
+    __slots__ = ("version", "params", "queries", "vec", "chunks", "ref")
+
+    def __init__(self, version, params, queries, vec, chunks):
+        self.version = version
+        self.params = params
+        self.queries = queries
+        self.vec = vec
+        self.chunks = chunks
+        self.ref = _format_refs(chunks)
+
+
+def _query_vector(query: str, vocab):
+    """查询的稀疏 TF-IDF 行 (indices, data)，已归一化；无词表时返回 None。"""
+    if vocab is None:
+        return None
+    try:
+        from embedding_utils import embed_query_sparse
+        return embed_query_sparse(query, vocab)
+    except Exception:
+        return None
+
+
+def _sparse_cosine(a, b) -> float:
+    """两个已归一化稀疏行的余弦相似度（indices 已升序）。"""
+    import numpy as np
+    if a is None or b is None:
+        return 0.0
+    _, ia, ib = np.intersect1d(a[0], b[0], assume_unique=True, return_indices=True)
+    return float(np.dot(a[1][ia], b[1][ib]))
+
+
+def _merge_chunks(previous: list, fresh: list) -> list:
+    """上一轮选中且本轮仍命中的 chunk 保持原顺序排在前面，其余新命中的按本轮排名补在后面。"""
+    fresh_ids = {c.get("id") for c in fresh}
+    kept = [c for c in previous if c.get("id") in fresh_ids]
+    kept_ids = {c.get("id") for c in kept}
+    return kept + [c for c in fresh if c.get("id") not in kept_ids]
+
+
+def retrieve_for_conversation(conversation_id, query: str, top_k: int = 5, backend: str = None, sources=None) -> str:
     """
-    ref = _retrieve_vector(query, top_k)
-    if ref:
-        return ref
-    return _retrieve_keyword(query, top_k)
+    对话内的检索：返回与 retrieve() 相同格式的参考文本，但结合该对话上一轮的检索上下文——
+      复用   追问很短、带追问说法且不含命理术语（如「详细说说」「那我明年呢」）：沿用上一轮的参考文本，不再检索
+      扩展   与上一轮组合查询的向量余弦不低于 RAG_FOLLOWUP_MIN_SIM：用最近几轮问题组合成查询检索，
+             上一轮选中且仍命中的 chunk 保持原顺序在前，新命中的补在后面
+      新话题  其余情况只按本轮问题检索，重置上下文
+    多轮间参考文本前缀保持稳定，也有利于模型服务端的提示词缓存。知识库热切换或检索参数变化后上下文失效。
+    新话题与扩展的检索与 retrieve() 共用检索缓存（键同为归一化查询与检索参数）。
+    """
+    backend = _check_backend(backend)
+    shards = _resolve_sources(sources)
+    q = _normalize_query(query)
+    if not q:
+        return ""
+    version = _store_version()
+    params = (top_k, backend, shards)
+    prev = _conversations.get(conversation_id)
+    if prev is not None and (prev.version != version or prev.params != params):
+        prev = None
+    vocab = _load_vector_state().vocab
+    q_vec = _query_vector(q, vocab)
+
+    mode = "new"
+    if prev is not None:
+        followup = len(q) <= _FOLLOWUP_MAX_CHARS and any(m in q for m in _FOLLOWUP_MARKERS)
+        if followup and not _get_term_matcher().find(q):
+            mode = "reuse"
+        elif _sparse_cosine(q_vec, prev.vec) >= _FOLLOWUP_MIN_SIM:
+            mode = "extend"
+    _conversation_counts[mode] += 1
+
+    if mode == "reuse":
+        # 上下文不变，只刷新 LRU 位置与 TTL
+        _conversations.put(conversation_id, prev)
+        return prev.ref
+    if mode == "extend":
+        queries = (prev.queries + (q,))[-max(_CONVERSATION_TURNS, 1):]
+        combined = " ".join(queries)
+        fresh = _cached_search(combined, top_k, backend, shards)
+        chunks = _pack_refs(_merge_chunks(prev.chunks, fresh), top_k)
+        state = _ConversationState(version, params, queries, _query_vector(combined, vocab), chunks)
+    else:
+        state = _ConversationState(version, params, (q,), q_vec, _cached_search(q, top_k, backend, shards))
+    _conversations.put(conversation_id, state)
+    return state.ref
+
+
+def forget_conversation(conversation_id):
+    """丢弃对话的检索上下文（对话删除时调用）。"""
+    _conversations.pop(conversation_id)
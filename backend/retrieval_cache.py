@@ -0,0 +1,144 @@
+"""
+检索结果缓存 —— 供 rag.retrieve() 与 rag.retrieve_for_conversation() 在热路径上复用相同（归一化后）问题的检索结果。
+
+- 容量受限：按条目数与结果总字符数双重上限做 LRU 淘汰
+- TTL：条目超过存活时间即失效
+- 版本失效：调用方每次查询前传入当前已加载快照的版本（rag._store_version()：向量库版本 + chunk 打包 /
+  倒排索引快照），热切换换入新快照后版本变化，整个缓存清空；磁盘文件变化但尚未换入时缓存仍然有效
+- 统计：命中、未命中、淘汰、过期、失效次数，以及按未命中平均耗时估算的节省时间
+
+ConversationContexts：按对话保存上一轮检索的上下文（见 rag.retrieve_for_conversation），
+同样按条目数做 LRU 淘汰、超过 TTL 失效；只在本进程内有效，换 worker 时退化为冷检索。
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Hashable, Optional
+
+
+class RetrievalCache:
+    """线程安全的 TTL + LRU 缓存，值为检索结果（字符串或打包后的 chunk 元组），不原地修改。"""
+
+    def __init__(self, max_entries: int = 512, max_chars: int = 2_000_000, ttl: float = 3600.0):
+        self.max_entries = max_entries
+        self.max_chars = max_chars
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()  # key -> (value, expires_at, size)
+        self._chars = 0
+        self._version = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self._miss_seconds = 0.0
+
+    def check_version(self, version: Hashable):
+        """已加载的知识库快照版本变化（热切换）时清空缓存。"""
+        with self._lock:
+            if version != self._version:
+                if self._version is not None and self._data:
+                    self.invalidations += 1
+                self._data.clear()
+                self._chars = 0
+                self._version = version
+
+    def get(self, key: Hashable) -> Optional[str]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            value, expires_at, _ = item
+            if expires_at < time.monotonic():
+                self._pop(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: Hashable, value, cost_seconds: float = 0.0, size: Optional[int] = None):
+        """写入一条结果；cost_seconds 为本次未命中实际检索耗时，用于估算节省时间；
+        size 为计入字符上限的大小，默认 len(value)（chunk 元组由调用方传入 content 总字数）。"""
+        size = len(value) if size is None else size
+        if self.max_entries <= 0 or size > self.max_chars:
+            return
+        with self._lock:
+            self._miss_seconds += cost_seconds
+            if key in self._data:
+                self._pop(key)
+            self._data[key] = (value, time.monotonic() + self.ttl, size)
+            self._chars += size
+            while len(self._data) > self.max_entries or self._chars > self.max_chars:
+                self._pop(next(iter(self._data)))
+                self.evictions += 1
+
+    def _pop(self, key: Hashable):
+        _, _, size = self._data.pop(key)
+        self._chars -= size
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._chars = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            avg_miss = self._miss_seconds / self.misses if self.misses else 0.0
+            return {
+                "entries": len(self._data),
+                "chars": self._chars,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+                "avg_miss_ms": round(avg_miss * 1000, 3),
+                "saved_ms_estimate": round(self.hits * avg_miss * 1000, 1),
+            }
+
+
+class ConversationContexts:
+    """线程安全的「对话 id -> 检索上下文」LRU + TTL 表；值由调用方整体替换，不原地修改。"""
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 3600.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()  # key -> (value, expires_at)
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def put(self, key: Hashable, value):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def pop(self, key: Hashable):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self._data)
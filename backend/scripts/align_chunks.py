@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+原文 chunk 与白话 chunk 的段落对齐 —— 写出 knowledge/chunk_alignment.json，供 context_packer 做同段去重。
+
+原文与白话是同一段话的两种写法，共享的字符 shingle 很少（MinHash 估计的 Jaccard 多在 0.05～0.35），
+按文本相似度去不掉。这里借用白话译文的来源：translate_raw_to_baihua_llm.py 把原书切成段（segments），
+逐段翻译，进度文件 progress_llm/<书>.json 的 results[i] 即第 i 段的译文。于是：
+  原文 chunk ↔ 原书第 i 段：两者的 4-gram shingle 重叠占较小一方的比例 ≥ MIN_OVERLAP
+  白话 chunk ↔ 译文 results[i]：同上
+同一书中对齐到同一段的原文 chunk 与白话 chunk 即互为翻译。输出只保留两种写法都有 chunk 的段：
+  {"paragraphs": {chunk_id: ["<书 id>:<段号>", ...]}}
+缺原书或进度文件的书跳过。pack_chunks.py 打包时调用；也可单独执行。
+"""
+
+import json
+import os
+import re
+import sys
+from collections import Counter, defaultdict
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(SCRIPT_DIR)
+CHUNKS_DIR = os.path.join(BACKEND_DIR, "knowledge", "chunks")
+ALIGNMENT_PATH = os.path.join(BACKEND_DIR, "knowledge", "chunk_alignment.json")
+PROGRESS_DIR = os.path.join(BACKEND_DIR, "knowledge", "progress_llm")
+
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+if SCRIPT_DIR not in sys.path:
+    sys.path.insert(0, SCRIPT_DIR)
+
+SHINGLE_SIZE = 4
+# shingle 重叠占较小一方的比例达到该值即视为同一段（原文段长 ≤1200 字、chunk ≤800 字，互有包含）
+MIN_OVERLAP = 0.5
+_NON_WORD_RE = re.compile(r"[\W_]+")
+
+
+def shingles(text: str) -> set:
+    from context_packer import clean_text
+    t = _NON_WORD_RE.sub("", clean_text(text))
+    return {t[i:i + SHINGLE_SIZE] for i in range(len(t) - SHINGLE_SIZE + 1)}
+
+
+def align(segments, chunks) -> dict:
+    """segments: 段文本列表；chunks: [(chunk_id, 文本)]。返回 {chunk_id: [段号, ...]}。"""
+    postings = defaultdict(list)
+    sizes = []
+    for j, (_, text) in enumerate(chunks):
+        sh = shingles(text)
+        sizes.append(len(sh))
+        for s in sh:
+            postings[s].append(j)
+    aligned = defaultdict(list)
+    for i, seg in enumerate(segments):
+        sh = shingles(seg)
+        if not sh:
+            continue
+        hits = Counter(j for s in sh for j in postings.get(s, ()))
+        for j, n in hits.items():
+            if n >= MIN_OVERLAP * min(len(sh), sizes[j]):
+                aligned[chunks[j][0]].append(i)
+    return aligned
+
+
+def build_alignment(all_chunks) -> dict:
+    """对各书计算原文/白话 chunk 的段落对齐，返回 {chunk_id: ["书 id:段号", ...]}。"""
+    from books import BOOK_DISPLAY
+    from translate_raw_to_baihua_llm import BOOKS, load_raw_book, split_into_segments
+    book_ids = {name: bid for bid, name in BOOK_DISPLAY.items()}
+    paragraphs = {}
+    for raw_name, _, title, markers in BOOKS:
+        bid = book_ids.get(title)
+        progress = os.path.join(PROGRESS_DIR, os.path.splitext(raw_name)[0] + ".json")
+        raw = [(c["id"], c.get("content") or "") for c in all_chunks if c.get("id", "").startswith(f"{bid}_chunk_")]
+        baihua = [(c["id"], c.get("content") or "") for c in all_chunks
+                  if c.get("id", "").startswith(f"{bid}_baihua_chunk_")]
+        if not bid or not raw or not baihua or not os.path.isfile(progress):
+            continue
+        try:
+            segments = split_into_segments(load_raw_book(raw_name, markers))
+            with open(progress, "r", encoding="utf-8") as f:
+                results = json.load(f).get("results", [])
+        except Exception as e:
+            print(f"  跳过 {title}：{e}")
+            continue
+        if len(results) != len(segments):
+            print(f"  跳过 {title}：原书 {len(segments)} 段与译文 {len(results)} 段不一致")
+            continue
+        raw_aligned = align(segments, raw)
+        baihua_aligned = align(results, baihua)
+        shared = {i for idx in raw_aligned.values() for i in idx} & {i for idx in baihua_aligned.values() for i in idx}
+        for aligned in (raw_aligned, baihua_aligned):
+            for cid, idx in aligned.items():
+                keys = [f"{bid}:{i}" for i in idx if i in shared]
+                if keys:
+                    paragraphs[cid] = keys
+        print(f"  {title}：{len(shared)} 段对齐，原文 chunk {sum(1 for c, _ in raw if c in paragraphs)}/{len(raw)}，"
+              f"白话 chunk {sum(1 for c, _ in baihua if c in paragraphs)}/{len(baihua)}")
+    return paragraphs
+
+
+def write_alignment(all_chunks, path: str = ALIGNMENT_PATH) -> int:
+    """计算并写出对齐文件（临时文件 + os.replace），返回有对齐的 chunk 数。"""
+    paragraphs = build_alignment(all_chunks)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"paragraphs": paragraphs}, f, ensure_ascii=False, sort_keys=True)
+    os.replace(tmp, path)
+    return len(paragraphs)
+
+
+def main():
+    from chunk_store import load_chunk_dir
+    count = write_alignment(load_chunk_dir(CHUNKS_DIR))
+    print(f"已写入 {count} 个 chunk 的段落对齐到 {ALIGNMENT_PATH}")
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
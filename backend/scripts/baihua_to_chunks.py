@@ -8,9 +8,15 @@
 import os
 import re
 import json
+import sys
 
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 BACKEND_DIR = os.path.dirname(SCRIPT_DIR)
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+from books import BOOK_DISPLAY  # noqa: E402
+
 BAIHUA_DIR = os.path.join(BACKEND_DIR, "knowledge", "baihua")
 CHUNKS_DIR = os.path.join(BACKEND_DIR, "knowledge", "chunks")
 MAX_CHARS = 800
@@ -24,12 +30,6 @@ BAIHUA_FILE_TO_BID = {
     "三命通会": "sanmingtonghui",
     "滴天髓阐微": "ditiansui",
 }
-BOOK_DISPLAY = {
-    "yuanhaiziping": "渊海子平",
-    "zipingzhenquan": "子平真诠评注",
-    "sanmingtonghui": "三命通会",
-    "ditiansui": "滴天髓阐微",
-}
 
 
 def split_into_blocks(text: str) -> list[str]:
@@ -106,6 +106,9 @@ def main():
             count += 1
         print(f"  {name} -> {len(blocks)} chunks")
     print(f"共写入 {count} 个白话 chunk 到 {CHUNKS_DIR}")
+    # 重新打包，供 rag.py mmap 加载
+    from pack_chunks import pack_chunks, PACK_PATH
+    print(f"已打包 {pack_chunks()} 个 chunk 到 {PACK_PATH}")
     return 0
 
 
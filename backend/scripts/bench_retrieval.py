@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+"""
+检索评测：用黄金集 knowledge/golden_queries.json 逐个 backend 跑 rag.retrieve_chunks()，
+输出 recall@k、MRR、延迟 p50/p95/p99、峰值内存与冷启动加载耗时，并把结果写成 JSON，
+便于改动 rag.py / embedding_utils.py 等之后跨提交对比。
+黄金集的相关 chunk 按「内容含某术语」的字面规则标注（见各条 note），与关键词 / BM25 检索的匹配信号相同，
+数字天然偏向 keyword 与 hybrid；用于同一 backend 的前后对比，不宜单凭它在 backend 之间取舍。
+
+  recall@k  命中的相关 chunk 数 / min(k, 相关 chunk 总数)，按查询平均
+  MRR       第一个相关 chunk 排名的倒数，按查询平均（前 k 内无命中记 0）
+  延迟      每条查询先跑一次预热，再重复 --repeat 次计时（绕过结果缓存）
+  峰值内存  tracemalloc 统计的检索期间 Python/NumPy 分配峰值；另记进程 RSS 峰值
+  冷启动    新子进程中 import rag + rag.warmup() 的耗时与 RSS 峰值
+
+用法（在 backend 目录）：
+  python scripts/bench_retrieval.py
+  python scripts/bench_retrieval.py --backends hybrid,vector -k 10 --repeat 5
+  python scripts/bench_retrieval.py --compare bench_results/retrieval_1a2b3c4.json
+  RAG_ANN=0 python scripts/bench_retrieval.py --label no-ann   # 用环境变量切换索引/参数
+"""
+
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(SCRIPT_DIR)
+GOLDEN_PATH = os.path.join(BACKEND_DIR, "knowledge", "golden_queries.json")
+RESULTS_DIR = os.path.join(BACKEND_DIR, "bench_results")
+
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+# 结果里记录的检索相关环境变量（不同取值的结果不可直接比较）
+_ENV_PREFIXES = ("RAG_",)
+
+_COLD_START_CODE = """
+import json, resource, sys, time
+start = time.perf_counter()
+import rag
+imported = time.perf_counter()
+steps = rag.warmup()
+done = time.perf_counter()
+rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+rss_mb = rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+print(json.dumps({
+    "import_ms": round((imported - start) * 1000, 1),
+    "warmup_ms": round((done - imported) * 1000, 1),
+    "total_ms": round((done - start) * 1000, 1),
+    "warmup_steps": steps,
+    "peak_rss_mb": round(rss_mb, 1),
+}))
+"""
+
+
+def git_commit() -> str:
+    """当前提交的短哈希；工作区有改动时加 -dirty。"""
+    try:
+        sha = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=BACKEND_DIR, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+        dirty = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"],
+            cwd=BACKEND_DIR, capture_output=True, text=True,
+        ).stdout.strip()
+        return sha + ("-dirty" if dirty else "")
+    except Exception:
+        return "unknown"
+
+
+def peak_rss_mb() -> float:
+    import resource
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024, 1)
+
+
+def load_golden(path: str) -> list:
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    return data["queries"] if isinstance(data, dict) else data
+
+
+def cold_start() -> dict:
+    """在新子进程中测量 import rag + warmup 的耗时与 RSS 峰值。"""
+    try:
+        out = subprocess.run(
+            [sys.executable, "-c", _COLD_START_CODE],
+            cwd=BACKEND_DIR, capture_output=True, text=True, check=True,
+        ).stdout
+        return json.loads(out.strip().splitlines()[-1])
+    except Exception as e:
+        return {"error": str(e)}
+
+
+def percentile(values, q) -> float:
+    import numpy as np
+    return round(float(np.percentile(values, q)), 3) if values else 0.0
+
+
+def evaluate(rag, backend: str, golden: list, k: int, repeat: int) -> dict:
+    """跑一个 backend：质量指标、延迟分布、检索期间的分配峰值。"""
+    per_query, latencies = [], []
+    for item in golden:
+        query, sources = item["query"], item.get("sources")
+        relevant = set(item["relevant"])
+        ids = [c.get("id") for c in rag.retrieve_chunks(query, k, backend=backend, sources=sources)]
+        for _ in range(repeat):
+            start = time.perf_counter()
+            rag.retrieve_chunks(query, k, backend=backend, sources=sources)
+            latencies.append((time.perf_counter() - start) * 1000)
+        hits = [i for i, cid in enumerate(ids) if cid in relevant]
+        per_query.append({
+            "query": query,
+            "retrieved": ids,
+            "hits": len(hits),
+            "recall": round(len(hits) / max(min(k, len(relevant)), 1), 4),
+            "rr": round(1.0 / (hits[0] + 1), 4) if hits else 0.0,
+        })
+
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    for item in golden:
+        rag.retrieve_chunks(item["query"], k, backend=backend, sources=item.get("sources"))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    n = max(len(per_query), 1)
+    return {
+        "recall_at_k": round(sum(q["recall"] for q in per_query) / n, 4),
+        "mrr": round(sum(q["rr"] for q in per_query) / n, 4),
+        "latency_ms": {
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "p99": percentile(latencies, 99),
+            "mean": round(sum(latencies) / max(len(latencies), 1), 3),
+        },
+        "peak_alloc_mb": round(peak / (1024 * 1024), 2),
+        "queries": per_query,
+    }
+
+
+def print_table(results: dict):
+    print(f"{'backend':<9} {'recall@k':>9} {'MRR':>7} {'p50ms':>8} {'p95ms':>8} {'p99ms':>8} {'峰值MB':>8}")
+    for name, r in results["backends"].items():
+        lat = r["latency_ms"]
+        print(
+            f"{name:<9} {r['recall_at_k']:>9} {r['mrr']:>7} {lat['p50']:>8} {lat['p95']:>8} "
+            f"{lat['p99']:>8} {r['peak_alloc_mb']:>8}"
+        )
+    cold = results.get("cold_start", {})
+    if "total_ms" in cold:
+        print(f"冷启动：import {cold['import_ms']}ms + warmup {cold['warmup_ms']}ms，RSS 峰值 {cold['peak_rss_mb']}MB")
+    print(f"本进程 RSS 峰值：{results['process_peak_rss_mb']}MB")
+
+
+def print_compare(results: dict, base: dict):
+    """与旧结果逐 backend 对比（新 - 旧）。"""
+    print(f"\n对比 {base.get('meta', {}).get('commit', '?')} -> {results['meta']['commit']}：")
+    print(f"{'backend':<9} {'Δrecall':>9} {'ΔMRR':>8} {'Δp50ms':>9} {'Δp95ms':>9}")
+    for name, r in results["backends"].items():
+        old = base.get("backends", {}).get(name)
+        if old is None:
+            print(f"{name:<9} （旧结果中无此 backend）")
+            continue
+        print(
+            f"{name:<9} {r['recall_at_k'] - old['recall_at_k']:>+9.4f} {r['mrr'] - old['mrr']:>+8.4f} "
+            f"{r['latency_ms']['p50'] - old['latency_ms']['p50']:>+9.3f} "
+            f"{r['latency_ms']['p95'] - old['latency_ms']['p95']:>+9.3f}"
+        )
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="检索质量与性能评测（黄金集）")
+    parser.add_argument("--golden", default=GOLDEN_PATH, help="黄金集 JSON 路径")
+    parser.add_argument("--backends", default="", help="逗号分隔的 backend，默认 rag 支持的全部")
+    parser.add_argument("-k", "--top-k", type=int, default=5, help="评测的 top_k（默认 5）")
+    parser.add_argument("--repeat", type=int, default=3, help="每条查询计时重复次数（默认 3）")
+    parser.add_argument("--no-cold-start", action="store_true", help="跳过子进程冷启动测量")
+    parser.add_argument("--label", default="", help="结果文件名附加标签（如不同环境变量配置）")
+    parser.add_argument("--out", default="", help="结果 JSON 路径，默认 bench_results/retrieval_<commit>[_<label>].json")
+    parser.add_argument("--compare", default="", help="与之前保存的结果 JSON 对比")
+    args = parser.parse_args()
+
+    golden = load_golden(args.golden)
+    commit = git_commit()
+    cold = {} if args.no_cold_start else cold_start()
+
+    import rag
+    backends = [b for b in args.backends.split(",") if b] or list(rag._BACKENDS)
+    results = {
+        "meta": {
+            "commit": commit,
+            "label": args.label,
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "numpy": __import__("numpy").__version__,
+            "top_k": args.top_k,
+            "repeat": args.repeat,
+            "queries": len(golden),
+            "env": {k: v for k, v in sorted(os.environ.items()) if k.startswith(_ENV_PREFIXES)},
+        },
+        "cold_start": cold,
+        "backends": {},
+    }
+    for backend in backends:
+        results["backends"][backend] = evaluate(rag, backend, golden, args.top_k, args.repeat)
+    results["process_peak_rss_mb"] = peak_rss_mb()
+
+    print_table(results)
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            print_compare(results, json.load(f))
+
+    out = args.out
+    if not out:
+        suffix = f"_{args.label}" if args.label else ""
+        out = os.path.join(RESULTS_DIR, f"retrieval_{commit}{suffix}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=1)
+    print(f"结果已写入 {out}")
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -1,15 +1,33 @@
 #!/usr/bin/env python3
 """
 将 knowledge/chunks 下的白话文 chunk（*baihua*.json）向量化，
-保存为 knowledge/vector_store/embeddings.npy、meta.json、vocab.json，
-供 rag.retrieve() 做语义检索。
+保存为 knowledge/vector_store/ 下的一个新版本（向量 + 列式行元数据、二进制词表、manifest.json），
+供 rag.retrieve() 做语义检索。向量写盘前已 L2 归一化。
+
+版本化发布（store_versions.py）：每次构建先把当前版本硬链接到暂存目录，在暂存目录里全量/增量构建
+（含 --ann 索引），完成后写入校验和、整体 rename 为新版本并原子切换 CURRENT；构建中途失败或无变化时
+丢弃暂存目录，当前版本不受影响。运行中的服务由后台线程发现新版本并热切换，无需重启。
+--keep-versions 控制保留的版本数。
+首次构建默认 --layout csr：稀疏 CSR/CSC 存储，仅几 MB；--layout dense 存稠密矩阵，
+可再用 --dtype float16/int8 量化（量化时另存 float32 精确向量供检索时重排，--no-exact 可省略）。
+已有向量库时不指定 --layout/--dtype 即沿用其布局与存储类型（增量构建触发的自动全量重建、--full 同样沿用），
+只有显式指定不同的布局或类型才全量重建为新格式。
 
 使用字符级 n-gram TF-IDF，纯 Python + numpy 实现，
 不依赖 sentence-transformers / torch，兼容 Python 3.14 且内存友好。
 首次运行或白话 chunk 更新后执行一次即可。
+
+默认增量构建：build_state.json 记录每个 chunk 的内容哈希与所在行，只对新增/修改的 chunk
+向量化并作为新的一段追加（旧行记墓碑），词表与 IDF 沿用上次；删除/替换的行占比超过
+--max-deleted-ratio 或指定 --compact 时压实为连续的一段。增量维护的文档频率使 IDF 相对漂移
+超过 --drift-threshold 时自动全量重建（重建词表、重新向量化全部 chunk）。--full 强制全量。
+
+--lsa-dim k（建议 128～384）在全量构建时对 TF-IDF 矩阵做随机化截断 SVD（lsa.py），
+以 dense 布局存 k 维向量并保存投影矩阵，查询向量由 embed_query 同样投影；增量构建沿用已有投影。
 """
 
 import os
+import hashlib
 import json
 import sys
 
@@ -17,11 +35,11 @@ SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 BACKEND_DIR = os.path.dirname(SCRIPT_DIR)
 CHUNKS_DIR = os.path.join(BACKEND_DIR, "knowledge", "chunks")
 VECTOR_STORE_DIR = os.path.join(BACKEND_DIR, "knowledge", "vector_store")
-EMBEDDINGS_FILE = "embeddings.npy"
-META_FILE = "meta.json"
 
 sys.path.insert(0, BACKEND_DIR)
 
+import store_versions
+
 
 def load_baihua_chunks():
     """加载所有带 baihua 的 chunk JSON，返回 list[dict]。"""
@@ -46,7 +64,271 @@ def load_baihua_chunks():
     return chunks
 
 
+def chunk_hash(source: str, content: str) -> str:
+    """chunk 内容哈希：来源或正文任一变化即视为修改。"""
+    return hashlib.sha1(f"{source}\0{content}".encode("utf-8")).hexdigest()[:16]
+
+
+def load_build_state(store_dir):
+    path = os.path.join(store_dir, "build_state.json")
+    if not os.path.isfile(path):
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception:
+        return None
+
+
+def save_build_state(store_dir, ids, hashes, rows, df):
+    """ids/hashes/rows 一一对应；df 为当前词表各词条在在库文本中的文档频率。"""
+    import vector_store
+    state = {
+        "docs": len(ids),
+        "df": [int(x) for x in df],
+        "chunks": {cid: [h, int(r)] for cid, h, r in zip(ids, hashes, rows)},
+    }
+    path = os.path.join(store_dir, vector_store.BUILD_STATE_FILE)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False)
+    os.replace(path + ".tmp", path)
+
+
+def idf_drift(df, docs) -> float:
+    """按当前文档频率重算的 IDF 相对于词表 IDF 的平均相对变化。"""
+    import numpy as np
+    from embedding_utils import idf_weights
+    old_idf = idf_weights()
+    new_idf = np.log(docs / np.maximum(np.asarray(df, dtype=np.float64), 1.0)) + 1.0
+    return float(np.abs(new_idf - old_idf).mean() / max(float(old_idf.mean()), 1e-9))
+
+
+def embed_rows(contents, layout, workers):
+    from embedding_utils import embed_texts, embed_texts_sparse
+    if layout == "csr":
+        return embed_texts_sparse(contents, workers=workers)
+    return embed_texts(contents, workers=workers)
+
+
+def full_build(store_dir, ids, metas, hashes, contents, args):
+    """重建词表并向量化全部 chunk。"""
+    import vector_store
+    from embedding_utils import build_vocab, doc_freq, vocab_size
+    print(f"共 {len(contents)} 条，正在构建词汇表 ...")
+    build_vocab(contents)
+    print("词汇表构建完成，正在向量化 ...")
+    layout = args.layout or "csr"
+    # 整批向量化：一次完成分词、查表与 TF-IDF 计算
+    if args.lsa_dim:
+        rows = fit_lsa_rows(contents, args)
+    else:
+        rows = embed_rows(contents, layout, args.workers)
+    if layout == "csr":
+        manifest = vector_store.save_sparse_store(store_dir, rows, vocab_size(), metas)
+        print(f"稀疏存储：{manifest['rows']} 行 × {manifest['dim']} 维，非零元 {manifest['nnz']}")
+    else:
+        manifest = vector_store.save_store(
+            store_dir,
+            rows,
+            metas,
+            dtype=args.dtype,
+            keep_exact=not args.no_exact,
+            lsa_dim=args.lsa_dim,
+        )
+        print(f"向量已归一化，存储类型 {manifest['dtype']}，精确重排向量：{'有' if manifest['exact'] else '无'}")
+    save_build_state(store_dir, ids, hashes, range(len(ids)), doc_freq(contents))
+    print(f"已写入 {len(metas)} 条")
+
+
+def fit_lsa_rows(contents, args):
+    """对全部 chunk 的 TF-IDF 矩阵拟合 LSA 投影并保存，返回投影后的 (N, k) 文档向量。"""
+    import time
+    import lsa
+    from embedding_utils import embed_texts_sparse, save_projection, vocab_size
+    sparse = embed_texts_sparse(contents, workers=args.workers)
+    print(f"正在计算截断 SVD（k={args.lsa_dim}，幂迭代 {args.lsa_iters} 次）...")
+    start = time.perf_counter()
+    projection, energy = lsa.fit_lsa(sparse, vocab_size(), args.lsa_dim, n_iter=args.lsa_iters)
+    save_projection(projection)
+    print(f"LSA：{vocab_size()} 维 -> {projection.shape[1]} 维，保留能量 {energy:.1%}，"
+          f"耗时 {time.perf_counter() - start:.1f}s")
+    return lsa.csr_matmul(sparse, projection)
+
+
+def incremental_build(store_dir, ids, metas, hashes, contents, args):
+    """只向量化新增/修改的 chunk；返回 None 表示需要全量构建，否则返回向量库是否有改动。
+    LSA 库的新行由 embed_texts 按已有投影矩阵投影（投影不随增量更新，IDF 漂移触发全量时重新拟合）。"""
+    import numpy as np
+    import vector_store
+    from embedding_utils import doc_freq, vocab_size
+    store = vector_store.load_store(store_dir)
+    state = load_build_state(store_dir)
+    if store is None or state is None:
+        print("未找到已有向量库或构建状态，执行全量构建。")
+        return None
+    if (args.layout and args.layout != store.layout) or (store.layout == "dense" and args.dtype != store.dtype):
+        print("存储布局或类型变化，执行全量构建。")
+        return None
+    if args.lsa_dim and args.lsa_dim != store.lsa_dim:
+        print("LSA 维度变化，执行全量构建。")
+        return None
+    old = state["chunks"]
+    if any(row >= len(store) for _, row in old.values()) or len(state["df"]) != vocab_size():
+        print("构建状态与向量库不一致，执行全量构建。")
+        return None
+
+    keep_rows, new_idx = {}, []
+    for i, (cid, h) in enumerate(zip(ids, hashes)):
+        prev = old.get(cid)
+        if prev is not None and prev[0] == h:
+            keep_rows[cid] = prev[1]
+        else:
+            new_idx.append(i)
+    current = set(ids)
+    dead = [row for cid, (h, row) in old.items() if cid not in current or cid not in keep_rows]
+    if not new_idx and not dead and not args.compact:
+        print(f"白话 chunk 无变化（{len(ids)} 条），跳过向量化。")
+        return False
+
+    # 增量维护文档频率：减去被替换/删除的旧文本，加上新文本
+    df = np.asarray(state["df"], dtype=np.int64)
+    df -= doc_freq([store.meta.content(r) for r in dead])
+    new_contents = [contents[i] for i in new_idx]
+    df += doc_freq(new_contents)
+    drift = idf_drift(df, len(ids))
+    print(f"新增/修改 {len(new_idx)} 条，删除/替换旧行 {len(dead)} 条，IDF 漂移 {drift:.4f}")
+    if drift > args.drift_threshold:
+        print(f"IDF 漂移超过阈值 {args.drift_threshold}，执行全量构建。")
+        return None
+
+    if new_idx or dead:
+        base = len(store)
+        manifest = vector_store.append_rows(
+            store_dir,
+            embed_rows(new_contents, store.layout, args.workers),
+            [metas[i] for i in new_idx],
+            dead,
+        )
+        for k, i in enumerate(new_idx):
+            keep_rows[ids[i]] = base + k
+        print(f"已追加第 {len(manifest['segments'])} 段（{len(new_idx)} 行），墓碑 {manifest['deleted']} 行")
+    else:
+        manifest = {"rows": len(store), "deleted": 0 if store.deleted is None else len(store.deleted)}
+
+    if args.compact or manifest["deleted"] > args.max_deleted_ratio * manifest["rows"]:
+        mapping = vector_store.compact_store(store_dir)
+        keep_rows = {cid: int(mapping[r]) for cid, r in keep_rows.items()}
+        print(f"已压实为 1 段，共 {len(keep_rows)} 行")
+    save_build_state(store_dir, ids, hashes, [keep_rows[cid] for cid in ids], df)
+    return True
+
+
+def build_ann_index(store_dir, contents, args):
+    """在刚写出的向量库上构建 ANN 索引，并按需输出 recall / 耗时报告。"""
+    import numpy as np
+    import ann_index
+    import vector_store
+    from embedding_utils import embed_query
+    store = vector_store.load_store(store_dir)
+    out_dir = os.path.join(store_dir, vector_store.ANN_DIR)
+    print("正在构建 ANN 索引 ...")
+    meta = ann_index.build_ann(store, out_dir, nlist=args.ann_nlist, pq_m=args.ann_pq_m)
+    print(f"ANN：{meta['nlist']} 个簇，PQ 分段 {meta['pq_m'] or '无'}，默认 nprobe={meta['nprobe']}")
+    if not args.ann_report:
+        return
+    # 以各 chunk 中间截取的短句模拟用户查询
+    rng = np.random.default_rng(0)
+    picks = rng.choice(len(contents), size=min(200, len(contents)), replace=False)
+    queries = []
+    for i in picks:
+        text = contents[i]
+        mid = len(text) // 2
+        queries.append(np.asarray(embed_query(text[mid:mid + 20]), dtype=np.float32))
+    index = ann_index.load_ann(out_dir, store)
+    print(f"{'nprobe':>8} {'recall@5':>9} {'候选数':>8} {'耗时ms':>8}")
+    for row in ann_index.recall_report(store, index, queries, top_k=5):
+        print(f"{row['nprobe']:>8} {row['recall']:>9} {row['candidates']:>8} {row['ms']:>8}")
+
+
+def inherited_format(manifest, layout, lsa_dim):
+    """
+    未指定 --layout/--dtype 时沿用的 (布局, 存储类型)：已有向量库与本次构建是同一种库（LSA 维度相同）时
+    沿用其布局，dense 库再沿用其量化类型（显式 --layout dense 时同样沿用）；否则 (None, "float32")，
+    即首次构建默认 csr。量化的 dense 库因此不会被不带参数的构建静默重建为 csr / float32。
+    """
+    if not manifest or int(manifest.get("lsa_dim", 0)) != lsa_dim:
+        return None, "float32"
+    current_layout = manifest.get("layout", "dense")
+    if current_layout == "dense" and (layout or current_layout) == "dense":
+        return current_layout, manifest.get("dtype", "float32")
+    return current_layout, "float32"
+
+
 def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="构建白话文 TF-IDF 向量库")
+    parser.add_argument(
+        "--layout", choices=["csr", "dense"], default=None,
+        help="存储布局：csr 稀疏（首次构建默认，体积小、打分与非零元成正比），dense 稠密矩阵；"
+             "不指定则沿用已有向量库的布局",
+    )
+    parser.add_argument(
+        "--dtype", choices=["float32", "float16", "int8"], default=None,
+        help="dense 布局的存储类型：float32 原样，float16 体积减半，int8（每行 scale）体积约 1/4；"
+             "不指定则沿用已有 dense 库的类型，否则 float32",
+    )
+    parser.add_argument(
+        "--no-exact", action="store_true",
+        help="量化存储时不另存 float32 精确向量（检索时不做精确重排）",
+    )
+    parser.add_argument(
+        "--workers", type=int, default=1,
+        help="向量化进程数（语料很大时可开多进程分片编码，默认 1）",
+    )
+    parser.add_argument("--full", action="store_true", help="强制全量构建（重建词表并向量化全部 chunk）")
+    parser.add_argument("--compact", action="store_true", help="增量构建后把全部段压实为一段、去掉墓碑行")
+    parser.add_argument(
+        "--drift-threshold", type=float, default=0.05,
+        help="IDF 平均相对漂移超过该值时自动全量构建（默认 0.05）",
+    )
+    parser.add_argument(
+        "--max-deleted-ratio", type=float, default=0.25,
+        help="墓碑行占比超过该值时自动压实（默认 0.25）",
+    )
+    parser.add_argument(
+        "--ann", action="store_true",
+        help="额外构建 IVF 近似最近邻索引（语料很大时用，rag.py 检测到后自动启用）",
+    )
+    parser.add_argument(
+        "--lsa-dim", type=int, default=0,
+        help="全量构建时做截断 SVD（LSA），以 dense 布局存该维度的稠密向量（建议 128～384，0 不做）",
+    )
+    parser.add_argument("--lsa-iters", type=int, default=4, help="随机化 SVD 的幂迭代次数（默认 4）")
+    parser.add_argument("--ann-nlist", type=int, default=0, help="IVF 簇数，0 为自动（约 4·sqrt(N)）")
+    parser.add_argument("--ann-pq-m", type=int, default=0, help="PQ 分段数，0 不做 PQ")
+    parser.add_argument(
+        "--ann-report", action="store_true",
+        help="构建后输出 ANN 与精确检索的 recall@k / 耗时对比",
+    )
+    parser.add_argument(
+        "--keep-versions", type=int, default=store_versions.KEEP_VERSIONS,
+        help=f"发布后保留的向量库版本数（含新版本，默认 {store_versions.KEEP_VERSIONS}）",
+    )
+    args = parser.parse_args()
+    import vector_store
+    current = store_versions.current_dir(VECTOR_STORE_DIR)
+    manifest = vector_store._read_manifest(current) if current else {}
+    if not args.full and not args.lsa_dim and not args.layout:
+        # 未指定时沿用已有 LSA 库的维度，增量构建触发的自动全量重建同样重新拟合投影
+        args.lsa_dim = int(manifest.get("lsa_dim", 0))
+    inherit_layout, inherit_dtype = inherited_format(manifest, args.layout, args.lsa_dim)
+    args.layout = args.layout or inherit_layout
+    args.dtype = args.dtype or inherit_dtype
+    if args.lsa_dim:
+        if args.layout == "csr":
+            parser.error("--lsa-dim 输出稠密向量，只能用 dense 布局")
+        args.layout = "dense"
+
     print("加载白话文 chunks ...")
     chunks = load_baihua_chunks()
     if not chunks:
@@ -54,50 +336,46 @@ def main():
         return 1
 
     ids = []
-    sources = []
+    metas = []
+    hashes = []
     contents = []
+    seen = set()
     for c in chunks:
         cid = c.get("id", "")
         content = (c.get("content") or "").strip()
         source = c.get("source", "")
-        if not cid or not content:
+        if not cid or not content or cid in seen:
             continue
+        seen.add(cid)
         ids.append(cid)
-        sources.append(source)
+        metas.append({"id": cid, "source": source, "content": content})
+        hashes.append(chunk_hash(source, content))
         contents.append(content)
 
-    print(f"共 {len(contents)} 条，正在构建词汇表 ...")
-    from embedding_utils import build_vocab, embed_texts
-    build_vocab(contents)
-    print("词汇表构建完成，正在向量化 ...")
-
-    # 分批向量化以节省内存
-    import numpy as np
-    batch_size = 500
-    all_embeddings = []
-    for start in range(0, len(contents), batch_size):
-        batch = contents[start:start + batch_size]
-        embs = embed_texts(batch)
-        all_embeddings.extend(embs)
-        done = min(start + batch_size, len(contents))
-        print(f"  已向量化 {done}/{len(contents)} 条")
-
-    os.makedirs(VECTOR_STORE_DIR, exist_ok=True)
-    np.save(
-        os.path.join(VECTOR_STORE_DIR, EMBEDDINGS_FILE),
-        np.array(all_embeddings, dtype=np.float32),
-    )
-
-    meta = [
-        {"id": i, "source": s, "content": c}
-        for i, s, c in zip(ids, sources, contents)
-    ]
-    with open(
-        os.path.join(VECTOR_STORE_DIR, META_FILE), "w", encoding="utf-8"
-    ) as f:
-        json.dump(meta, f, ensure_ascii=False, indent=0)
+    import embedding_utils
+    staging = store_versions.stage(VECTOR_STORE_DIR)
+    embedding_utils.use_store_dir(staging)
+    try:
+        changed = None if args.full else incremental_build(staging, ids, metas, hashes, contents, args)
+        if changed is None:
+            full_build(staging, ids, metas, hashes, contents, args)
+            changed = True
+        if args.ann:
+            build_ann_index(staging, contents, args)
+            changed = True
+    except BaseException:
+        store_versions.discard(staging)
+        raise
+    finally:
+        embedding_utils.use_store_dir(None)
 
-    print(f"已写入 {len(meta)} 条到 {VECTOR_STORE_DIR}")
+    # 旧版平铺目录即使无变化也发布一次，迁移到版本目录
+    if not changed and store_versions.current_version(VECTOR_STORE_DIR) is not None:
+        store_versions.discard(staging)
+        print("向量库无变化，保留当前版本。")
+        return 0
+    version = store_versions.publish(VECTOR_STORE_DIR, staging, keep=args.keep_versions)
+    print(f"已发布向量库版本 {version}（{store_versions.version_dir(VECTOR_STORE_DIR, version)}）")
     return 0
 
 
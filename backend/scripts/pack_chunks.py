@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+"""
+将 knowledge/chunks/ 下所有 chunk JSON 打包为 knowledge/chunks.pack，
+并构建与之对应的 BM25 倒排索引 knowledge/keyword_index/（用 rag 的术语词典预打术语词条），
+供 rag.py 以只读 mmap 方式加载，关键词检索时不再逐请求扫描目录。
+同时写出原文/白话 chunk 的段落对齐 knowledge/chunk_alignment.json（见 align_chunks.py），供参考文本打包去重。
+raw_to_chunks.py / baihua_to_chunks.py 写完 chunk 后会自动调用；手动编辑 chunk 后可单独执行。
+"""
+
+import os
+import sys
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(SCRIPT_DIR)
+CHUNKS_DIR = os.path.join(BACKEND_DIR, "knowledge", "chunks")
+PACK_PATH = os.path.join(BACKEND_DIR, "knowledge", "chunks.pack")
+INDEX_DIR = os.path.join(BACKEND_DIR, "knowledge", "keyword_index")
+
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+if SCRIPT_DIR not in sys.path:
+    sys.path.insert(0, SCRIPT_DIR)
+
+
+def pack_chunks() -> int:
+    """读取 chunks 目录，写出打包文件与倒排索引，返回条数。"""
+    from chunk_store import load_chunk_dir, write_pack
+    from keyword_index import build_index
+    from rag import _get_term_matcher
+    from align_chunks import write_alignment
+    chunks = load_chunk_dir(CHUNKS_DIR)
+    count = write_pack(chunks, PACK_PATH)
+    build_index(chunks, INDEX_DIR, _get_term_matcher())
+    write_alignment(chunks)
+    return count
+
+
+def main():
+    if not os.path.isdir(CHUNKS_DIR):
+        print(f"目录不存在: {CHUNKS_DIR}，请先运行 raw_to_chunks.py 或 baihua_to_chunks.py。")
+        return 1
+    count = pack_chunks()
+    print(f"已打包 {count} 个 chunk 到 {PACK_PATH}")
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -88,6 +88,9 @@ def main():
             count += 1
         print(f"  {name} -> {len(blocks)} chunks")
     print(f"共写入 {count} 个 chunk 到 {CHUNKS_DIR}")
+    # 重新打包，供 rag.py mmap 加载
+    from pack_chunks import pack_chunks, PACK_PATH
+    print(f"已打包 {pack_chunks()} 个 chunk 到 {PACK_PATH}")
     return 0
 
 
@@ -0,0 +1,179 @@
+"""
+向量库版本管理 —— 每次构建写到独立的新目录，完成后整体发布，运行中的服务在请求路径之外热切换。
+
+目录 knowledge/vector_store/：
+  CURRENT                  当前版本名（单行文本，写临时文件后 os.replace 原子替换）
+  versions/<版本>/         一次构建的完整向量库：向量、列式元数据、词表、manifest、build_state、ann/
+    checksums.json         {相对路径: sha256}，发布时写入，加载新版本前校验
+  versions/.staging-*      构建中的目录（以已发布版本的硬链接为起点增量修改），发布时整体 rename
+
+构建流程（build_vector_store.py）：stage() 建暂存目录 → 在其中全量/增量构建 → publish() 写校验和、
+rename 为正式版本、原子更新 CURRENT、清理旧版本。已发布的版本目录此后不再修改：增量构建改写文件时
+一律先删后写（新 inode），硬链接共享的旧文件内容不变。旧版本被清理时，仍在 mmap 它的进程不受影响。
+
+读取方（rag.py）用 current_dir() 定位当前版本；后台线程轮询 current_version()，发现新版本后校验、
+加载并整体换入（见 rag.start_reloader）。没有 CURRENT 的旧版平铺目录仍按原样读取，下次构建时迁移。
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import shutil
+import time
+from typing import Dict, List, Optional
+
+CURRENT_FILE = "CURRENT"
+VERSIONS_DIR = "versions"
+CHECKSUM_FILE = "checksums.json"
+STAGING_PREFIX = ".staging-"
+# 发布后保留的版本数（含当前版本），旧 worker 换入新版本前仍可能在读上一个版本
+KEEP_VERSIONS = 3
+# 超过该时长（秒）的暂存目录视为中断构建的残留，清理
+STALE_STAGING_SECONDS = 24 * 3600
+_CHUNK_BYTES = 1 << 20
+
+
+def current_version(root: str) -> Optional[str]:
+    """当前发布的版本名；未发布过（或旧版平铺目录）返回 None。"""
+    try:
+        with open(os.path.join(root, CURRENT_FILE), "r", encoding="utf-8") as f:
+            name = f.read().strip()
+    except OSError:
+        return None
+    return name or None
+
+
+def version_dir(root: str, version: str) -> str:
+    return os.path.join(root, VERSIONS_DIR, version)
+
+
+def current_dir(root: str) -> Optional[str]:
+    """当前版本目录；无发布版本时若根目录本身是旧版平铺向量库则返回根目录，否则 None。"""
+    version = current_version(root)
+    if version is not None and os.path.isdir(version_dir(root, version)):
+        return version_dir(root, version)
+    if os.path.isfile(os.path.join(root, "manifest.json")):
+        return root
+    return None
+
+
+def list_versions(root: str) -> List[str]:
+    """已发布的版本名（按时间升序）。"""
+    base = os.path.join(root, VERSIONS_DIR)
+    if not os.path.isdir(base):
+        return []
+    return sorted(
+        name for name in os.listdir(base)
+        if not name.startswith(".") and os.path.isdir(os.path.join(base, name))
+    )
+
+
+def _sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(_CHUNK_BYTES), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def file_checksums(directory: str) -> Dict[str, str]:
+    """目录下全部文件（含子目录，不含 checksums.json 本身）的 sha256。"""
+    sums = {}
+    for dirpath, _, filenames in os.walk(directory):
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            rel = os.path.relpath(path, directory).replace(os.sep, "/")
+            if rel != CHECKSUM_FILE:
+                sums[rel] = _sha256(path)
+    return dict(sorted(sums.items()))
+
+
+def verify(directory: str) -> bool:
+    """按 checksums.json 校验版本目录的文件完整性；缺少校验和文件、文件缺失或内容不符均返回 False。"""
+    try:
+        with open(os.path.join(directory, CHECKSUM_FILE), "r", encoding="utf-8") as f:
+            expected = json.load(f)
+        return all(_sha256(os.path.join(directory, rel)) == digest for rel, digest in expected.items())
+    except Exception:
+        return False
+
+
+def _link_or_copy(src: str, dst: str):
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def stage(root: str) -> str:
+    """新建暂存目录并以当前版本（或旧版平铺目录）的文件为起点（硬链接，跨设备时复制），返回其路径。"""
+    base = os.path.join(root, VERSIONS_DIR)
+    os.makedirs(base, exist_ok=True)
+    _remove_stale_staging(base)
+    staging = os.path.join(base, f"{STAGING_PREFIX}{os.getpid()}-{int(time.time())}")
+    shutil.rmtree(staging, ignore_errors=True)
+    src = current_dir(root)
+    if src is None:
+        os.makedirs(staging)
+    else:
+        shutil.copytree(
+            src, staging, copy_function=_link_or_copy,
+            ignore=shutil.ignore_patterns(CURRENT_FILE, VERSIONS_DIR, CHECKSUM_FILE, "*.tmp"),
+        )
+    return staging
+
+
+def discard(staging: str):
+    """放弃暂存目录（构建失败或无变化时）。"""
+    shutil.rmtree(staging, ignore_errors=True)
+
+
+def publish(root: str, staging: str, keep: int = KEEP_VERSIONS) -> str:
+    """写入校验和，把暂存目录 rename 为新版本并原子更新 CURRENT，清理多余的旧版本，返回新版本名。"""
+    sums = file_checksums(staging)
+    with open(os.path.join(staging, CHECKSUM_FILE), "w", encoding="utf-8") as f:
+        json.dump(sums, f, ensure_ascii=False, indent=0)
+    # 版本名按字典序即按发布先后（list_versions / prune 依赖这一点），同一秒内靠微秒区分
+    now = time.time()
+    version = (time.strftime("%Y%m%d-%H%M%S", time.localtime(now))
+               + f".{int(now * 1e6) % 1000000:06d}-{os.urandom(3).hex()}")
+    os.rename(staging, version_dir(root, version))
+    tmp = os.path.join(root, CURRENT_FILE + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(version + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, os.path.join(root, CURRENT_FILE))
+    _remove_legacy_files(root)
+    prune(root, keep)
+    return version
+
+
+def prune(root: str, keep: int = KEEP_VERSIONS):
+    """只保留最新的 keep 个版本（当前版本始终保留）。"""
+    current = current_version(root)
+    old = [v for v in list_versions(root) if v != current]
+    for version in old[:max(len(old) - max(keep - 1, 0), 0)]:
+        shutil.rmtree(version_dir(root, version), ignore_errors=True)
+
+
+def _remove_stale_staging(base: str):
+    now = time.time()
+    for name in os.listdir(base):
+        path = os.path.join(base, name)
+        if name.startswith(STAGING_PREFIX) and now - os.path.getmtime(path) > STALE_STAGING_SECONDS:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def _remove_legacy_files(root: str):
+    """迁移到版本目录后删除根目录下旧版平铺的向量库文件。"""
+    for name in os.listdir(root):
+        if name in (CURRENT_FILE, VERSIONS_DIR):
+            continue
+        path = os.path.join(root, name)
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            os.remove(path)
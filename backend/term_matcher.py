@@ -0,0 +1,107 @@
+"""
+术语匹配 —— 把命理术语词典一次编译为 Aho-Corasick 自动机，对文本只扫一遍即可找出其中出现的全部术语。
+
+查询扩展（rag._expand_query）与构建期 chunk 预打术语标签（keyword_index.build_index）共用同一个自动机：
+逐个术语做子串判断的耗时随词典大小线性增长，自动机的匹配耗时只与文本长度和命中数有关，
+词典从几十个词扩充到数千个同义词时仍保持线性。
+
+  TermMatcher(terms)      编译自动机（术语统一小写；重复术语只保留一个）
+  matcher.find(text)      文本中出现过的术语集合
+  matcher.counts(text)    各术语出现次数（允许重叠，如「伤官见官」同时计入「伤官」「官」）
+  GroupMatcher(groups)    同义词组版本：expand(text) 返回命中的全部组内术语
+"""
+
+from __future__ import annotations
+
+from collections import Counter, deque
+from typing import Dict, Iterable, Iterator, List, Sequence, Set, Tuple
+
+
+class TermMatcher:
+    """Aho-Corasick 自动机：goto 表为每个状态一个 dict（字符 -> 状态），fail 指针按 BFS 构建，
+    每个状态的输出（以该状态结尾的术语下标）在构建时沿 fail 链合并，匹配时无需再回溯。"""
+
+    def __init__(self, terms: Iterable[str]):
+        self.terms: List[str] = []
+        index: Dict[str, int] = {}
+        for t in terms:
+            t = (t or "").lower()
+            if t and t not in index:
+                index[t] = len(self.terms)
+                self.terms.append(t)
+        self.term_index = index
+        self._goto: List[Dict[str, int]] = [{}]
+        self._out: List[Tuple[int, ...]] = [()]
+        for i, term in enumerate(self.terms):
+            state = 0
+            for ch in term:
+                nxt = self._goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[state][ch] = nxt
+                    self._goto.append({})
+                    self._out.append(())
+                state = nxt
+            self._out[state] += (i,)
+        self._fail = [0] * len(self._goto)
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self._goto[state].items():
+                queue.append(nxt)
+                f = self._fail[state]
+                while f and ch not in self._goto[f]:
+                    f = self._fail[f]
+                self._fail[nxt] = self._goto[f].get(ch, 0)
+                self._out[nxt] += self._out[self._fail[nxt]]
+
+    def __len__(self) -> int:
+        return len(self.terms)
+
+    def __contains__(self, term: str) -> bool:
+        return term in self.term_index
+
+    def iter_matches(self, text: str) -> Iterator[Tuple[int, int]]:
+        """逐个产出 (结束位置, 术语下标)；text 需已小写。"""
+        goto, fail, out = self._goto, self._fail, self._out
+        state = 0
+        for pos, ch in enumerate(text):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            for i in out[state]:
+                yield pos, i
+
+    def find(self, text: str) -> Set[str]:
+        """文本中出现过的术语集合。"""
+        if not self.terms or not text:
+            return set()
+        return {self.terms[i] for _, i in self.iter_matches(text.lower())}
+
+    def counts(self, text: str) -> Counter:
+        """各术语在文本中的出现次数。"""
+        if not self.terms or not text:
+            return Counter()
+        return Counter(self.terms[i] for _, i in self.iter_matches(text.lower()))
+
+
+class GroupMatcher(TermMatcher):
+    """同义词组匹配：文本命中组内任一术语则返回整组。一个术语可属于多个组。"""
+
+    def __init__(self, groups: Sequence[Sequence[str]]):
+        super().__init__(t for group in groups for t in group)
+        self.groups = [tuple(dict.fromkeys(t.lower() for t in group if t)) for group in groups]
+        self._term_groups: List[List[int]] = [[] for _ in self.terms]
+        for g, group in enumerate(self.groups):
+            for t in group:
+                self._term_groups[self.term_index[t]].append(g)
+
+    def matched_groups(self, text: str) -> Set[int]:
+        """命中的组下标集合。"""
+        if not self.terms or not text:
+            return set()
+        return {g for _, i in self.iter_matches(text.lower()) for g in self._term_groups[i]}
+
+    def expand(self, text: str) -> Set[str]:
+        """命中组内的全部术语。"""
+        return {t for g in self.matched_groups(text) for t in self.groups[g]}
@@ -0,0 +1,16 @@
+"""
+pytest 公共配置：后端模块是 backend/ 下的平铺模块（import intent、import app），测试从 backend 目录运行：
+    cd backend && python -m pytest -q
+导入 app 需要模型 API Key，测试里给一个占位值；数据库指向临时文件，不碰 chat_history.db。
+"""
+
+import os
+import sys
+import tempfile
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+os.environ.setdefault("SOPHNET_API_KEY", "test-key")
+os.environ.setdefault("DATABASE_PATH", os.path.join(tempfile.mkdtemp(prefix="metaphysics-test-"), "chat.db"))
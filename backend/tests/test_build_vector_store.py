@@ -0,0 +1,30 @@
+"""scripts/build_vector_store.inherited_format：未指定 --layout/--dtype 时沿用已有向量库的格式。"""
+
+import importlib.util
+import os
+
+import pytest
+
+_SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts", "build_vector_store.py")
+_spec = importlib.util.spec_from_file_location("build_vector_store", _SCRIPT)
+build_vector_store = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(build_vector_store)
+
+DENSE_F16 = {"layout": "dense", "dtype": "float16", "lsa_dim": 0}
+DENSE_INT8_LSA = {"layout": "dense", "dtype": "int8", "lsa_dim": 128}
+CSR = {"layout": "csr", "dtype": "float32", "lsa_dim": 0}
+
+
+@pytest.mark.parametrize("manifest, layout, lsa_dim, expected", [
+    ({}, None, 0, (None, "float32")),                      # 首次构建：csr / float32
+    (DENSE_F16, None, 0, ("dense", "float16")),             # 不带参数：保持量化 dense
+    (DENSE_F16, "dense", 0, ("dense", "float16")),          # 显式 dense 未指定类型：沿用类型
+    (DENSE_F16, "csr", 0, ("dense", "float32")),            # 显式 csr：布局由参数决定
+    (CSR, None, 0, ("csr", "float32")),
+    (CSR, "dense", 0, ("csr", "float32")),                  # 显式 dense：float32 重建
+    (DENSE_INT8_LSA, None, 128, ("dense", "int8")),         # LSA 库沿用维度与类型
+    (DENSE_INT8_LSA, None, 0, (None, "float32")),           # --full 不带 --lsa-dim：不再是同一种库
+    ({"dtype": "int8"}, None, 0, ("dense", "int8")),        # 旧 manifest 无 layout 字段即 dense
+])
+def test_inherited_format(manifest, layout, lsa_dim, expected):
+    assert build_vector_store.inherited_format(manifest, layout, lsa_dim) == expected
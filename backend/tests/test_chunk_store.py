@@ -0,0 +1,28 @@
+"""chunk_store：打包文件的读写与 find_all 子串匹配（与原先 content.lower() 匹配一样不区分大小写）。"""
+
+from chunk_store import open_pack, write_pack
+
+CHUNKS = [
+    {"id": "a", "source": "甲", "tags": ["用神"], "content": "论用神，BaZi 八字以月令为重。"},
+    {"id": "b", "source": "乙", "tags": [], "content": "bazi 与四柱同义。"},
+    {"id": "c", "source": "丙", "tags": [], "content": "用神不可损伤。"},
+]
+
+
+def test_pack_roundtrip_keeps_original_case(tmp_path):
+    path = str(tmp_path / "chunks.pack")
+    assert write_pack(CHUNKS, path) == 3
+    pack = open_pack(path)
+    assert [pack.get(i) for i in range(len(pack))] == CHUNKS
+    assert pack.chunk_id(1) == "b"
+
+
+def test_find_all_is_case_insensitive(tmp_path):
+    path = str(tmp_path / "chunks.pack")
+    write_pack(CHUNKS, path)
+    pack = open_pack(path)
+    assert pack.find_all("bazi".encode("utf-8")) == {0, 1}
+    assert pack.find_all("用神".encode("utf-8")) == {0, 2}
+    # 跨 chunk 边界的字节不算命中
+    assert pack.find_all("伤。bazi".encode("utf-8")) == set()
+    assert pack.find_all(b"") == set()
@@ -0,0 +1,73 @@
+"""context_packer.pack：MinHash 近重复、原文/白话段落对齐去重与字符预算；scripts/align_chunks.align 的段落对齐。"""
+
+import importlib.util
+import os
+
+from context_packer import pack
+
+_SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts", "align_chunks.py")
+_spec = importlib.util.spec_from_file_location("align_chunks", _SCRIPT)
+align_chunks = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(align_chunks)
+
+RAW = "相神无破，贵格已成；相神相伤，立败其格。如甲用酉官，透丁逢癸，癸克丁以护官，而又逢戊，则癸合戊而不克丁。"
+BAIHUA = "如果辅助用神没有受到破坏，贵格就能成立；如果辅助用神受到损伤，格局就会立刻败坏。"
+OTHER = "大运不宜与太岁相克、相冲者凶；更刑、冲、相克者亦忌。岁冲克运者吉；运克岁者凶，格局不吉者死。"
+PARAGRAPHS = {
+    "zipingzhenquan_chunk_20": ["zipingzhenquan:15"],
+    "zipingzhenquan_chunk_21": ["zipingzhenquan:15"],
+    "zipingzhenquan_baihua_chunk_69": ["zipingzhenquan:15"],
+    "zipingzhenquan_baihua_chunk_70": ["zipingzhenquan:15"],
+    "yuanhaiziping_chunk_10": ["yuanhaiziping:9"],
+}
+
+
+def _ids(chunks):
+    return [c["id"] for c in chunks]
+
+
+def test_minhash_drops_verbatim_duplicate_only():
+    chunks = [{"id": "a", "content": RAW}, {"id": "b", "content": RAW + "  "}, {"id": "c", "content": BAIHUA}]
+    assert _ids(pack(chunks, 5, dup_threshold=0.5)) == ["a", "c"]
+    assert _ids(pack(chunks, 5)) == ["a", "b", "c"]
+
+
+def test_alignment_drops_other_form_of_same_paragraph():
+    chunks = [
+        {"id": "zipingzhenquan_chunk_20", "content": RAW},
+        {"id": "yuanhaiziping_chunk_10", "content": OTHER},
+        {"id": "zipingzhenquan_baihua_chunk_69", "content": BAIHUA},
+    ]
+    assert _ids(pack(chunks, 5, dup_threshold=0.5, paragraphs=PARAGRAPHS)) == [
+        "zipingzhenquan_chunk_20", "yuanhaiziping_chunk_10",
+    ]
+    # 白话排在前面时保留白话、丢原文
+    assert _ids(pack(chunks[::-1], 5, paragraphs=PARAGRAPHS)) == [
+        "zipingzhenquan_baihua_chunk_69", "yuanhaiziping_chunk_10",
+    ]
+    # 没有对齐数据时两者都保留（MinHash 认不出互为翻译的两段）
+    assert len(pack(chunks, 5, dup_threshold=0.5)) == 3
+
+
+def test_alignment_keeps_same_form_neighbours():
+    chunks = [
+        {"id": "zipingzhenquan_baihua_chunk_69", "content": BAIHUA},
+        {"id": "zipingzhenquan_baihua_chunk_70", "content": BAIHUA[::-1]},
+        {"id": "zipingzhenquan_chunk_20", "content": RAW},
+        {"id": "zipingzhenquan_chunk_21", "content": OTHER},
+    ]
+    assert _ids(pack(chunks, 5, paragraphs=PARAGRAPHS)) == [
+        "zipingzhenquan_baihua_chunk_69", "zipingzhenquan_baihua_chunk_70",
+    ]
+
+
+def test_char_budget_trims_at_sentence_end():
+    text = "甲" * 90 + "。" + "乙" * 90 + "。"
+    out = pack([{"id": "a", "content": text}], 5, max_chars=150)
+    assert out[0]["content"] == "甲" * 90 + "。"
+
+
+def test_align_matches_contained_segments():
+    segments = [RAW, OTHER, "与任何 chunk 都无关的一段文字，长度足够生成若干 shingle。"]
+    chunks = [("raw_a", RAW[:30]), ("raw_b", OTHER + RAW[-10:]), ("raw_c", "完全不同的内容")]
+    assert dict(align_chunks.align(segments, chunks)) == {"raw_a": [0], "raw_b": [1]}
@@ -0,0 +1,94 @@
+"""intent.extract_birth / intent.classify：出生信息提取与意图分类。"""
+
+import pytest
+
+import intent
+
+
+@pytest.mark.parametrize("message, expected", [
+    ("1990年5月1日早上8点 男",
+     {"year": 1990, "month": 5, "day": 1, "hour": 8, "minute": 0, "is_male": True, "is_solar": True}),
+    ("1995-03-12 14:30 女命",
+     {"year": 1995, "month": 3, "day": 12, "hour": 14, "minute": 30, "is_male": False, "is_solar": True}),
+    ("1990/5/1 20:15 男",
+     {"year": 1990, "month": 5, "day": 1, "hour": 20, "minute": 15, "is_male": True, "is_solar": True}),
+    ("帮我排个八字，1990年5月1日早上8点，男",
+     {"year": 1990, "month": 5, "day": 1, "hour": 8, "minute": 0, "is_male": True, "is_solar": True}),
+    ("1985年十月二十三号下午3点出生，女",
+     {"year": 1985, "month": 10, "day": 23, "hour": 15, "minute": 0, "is_male": False, "is_solar": True}),
+    ("我是女生，农历一九八八年腊月初八晚上九点半出生",
+     {"year": 1988, "month": 12, "day": 8, "hour": 21, "minute": 30, "is_male": False, "is_solar": False}),
+    ("农历1990年闰五月十五辰时，男",
+     {"year": 1990, "month": -5, "day": 15, "hour": 8, "minute": 0, "is_male": True, "is_solar": False}),
+])
+def test_extract_birth(message, expected):
+    assert intent.extract_birth(message) == expected
+
+
+@pytest.mark.parametrize("message, hour", [
+    ("1990年5月1日晚上12点出生，女", 0),
+    ("1990年5月1日夜里12点出生，女", 0),
+    ("1990年5月1日凌晨12点出生，女", 0),
+    ("1990年5月1日中午12点出生，女", 12),
+    ("1990年5月1日中午1点出生，女", 13),
+    ("1990年5月1日夜里2点出生，女", 2),
+    ("1990年5月1日晚上8点出生，女", 20),
+    ("1990年5月1日子时出生，女", 0),
+])
+def test_extract_birth_clock(message, hour):
+    assert intent.extract_birth(message)["hour"] == hour
+
+
+@pytest.mark.parametrize("message", [
+    # 事件日期，不是出生日期
+    "2023年5月1日我换了工作，帮我看看",
+    "2023年5月1日早上8点我换了工作，帮我看看八字",
+    "2024年10月1日下午3点要签合同，男，这天好不好",
+    "我们2019年6月6日晚上8点领的证",
+    # 没给时辰：由模型先问
+    "1990年5月1日出生，男",
+    "我是1990年5月1日出生的女生",
+    # 时刻对应不上日期
+    "1990年5月1日出生，想问问3点钟方向，男",
+    # 没给性别 / 性别说的是别人 / 男女矛盾
+    "1990年5月1日早上8点出生",
+    "我和男朋友吵架了，我是1992年3月3日早上8点出生的",
+    "我男友1990年5月1日早上8点出生",
+    "我女朋友1990年5月1日早上8点出生",
+    "1990年5月1日早上8点出生，男，她是女生",
+    # 两个日期、农历公历并存、日期不合法
+    "我1990年5月1日早上8点出生，男，老婆1992年3月4日",
+    "公历1990年5月1日早上8点出生，农历四月初七，男",
+    "2001年2月30日早上8点出生，男",
+    "我是1990年出生的男生",
+    "",
+])
+def test_extract_birth_rejects(message):
+    assert intent.extract_birth(message) is None
+
+
+@pytest.mark.parametrize("message, label, retrieve, tools", [
+    ("你好", "smalltalk", False, ()),
+    ("谢谢老师！", "smalltalk", False, ()),
+    ("伤官见官怎么看", "knowledge", True, ()),
+    ("1990年5月1日早上8点 男", "bazi", True, ("get_bazi",)),
+    ("帮我起一卦", "divination", True, ("get_meihua", "get_liuyao")),
+    ("用梅花易数算一下 3 5 7", "divination", True, ("get_meihua",)),
+    ("摇了个六爻", "divination", True, ("get_liuyao",)),
+    ("帮我算算", "bazi", True, intent.TOOL_NAMES),
+])
+def test_classify(message, label, retrieve, tools):
+    turn = intent.classify(message)
+    assert (turn.label, turn.retrieve, turn.tools) == (label, retrieve, tools)
+
+
+def test_classify_birth_from_previous_turn():
+    turn = intent.classify("那我的事业呢", ["1990年5月1日早上8点 男"])
+    assert turn.tools == ("get_bazi",)
+    assert intent.classify("那我的事业呢").tools == ()
+
+
+def test_classify_gating_disabled(monkeypatch):
+    monkeypatch.setattr(intent, "GATING_ENABLED", False)
+    turn = intent.classify("你好")
+    assert turn.retrieve and turn.tools == intent.TOOL_NAMES
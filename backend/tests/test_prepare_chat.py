@@ -0,0 +1,59 @@
+"""app.prepare_chat：意图门控与工具结果回放一起决定本轮请求的 tools 参数。"""
+
+import json
+
+import pytest
+
+import app
+import database as db
+import rag
+
+BIRTH = "我是1990年5月1日早上8点出生的，男"
+
+
+@pytest.fixture
+def conversation(tmp_path, monkeypatch):
+    monkeypatch.setattr(db, "DB_PATH", str(tmp_path / "chat.db"))
+    monkeypatch.setattr(rag, "retrieve_for_conversation", lambda *a, **k: "")
+    monkeypatch.setattr(app, "run_divination_tool", lambda name, arguments: f"{name}:{arguments}")
+    db.init_db()
+    return db.create_conversation("user-1")["id"]
+
+
+def _chat_turn(conversation_id, message, reply="好的"):
+    history, messages, tool_kwargs, memo = app.prepare_chat(conversation_id, message)
+    app.save_reply(conversation_id, history, message, reply)
+    return messages, tool_kwargs
+
+
+def _tool_names(tool_kwargs):
+    return [t["function"]["name"] for t in tool_kwargs.get("tools", [])]
+
+
+def test_small_talk_without_replay_sends_no_tools(conversation):
+    messages, tool_kwargs = _chat_turn(conversation, "你好")
+    assert tool_kwargs == {}
+    assert not any(m["role"] == "tool" for m in messages)
+
+
+def test_small_talk_after_chart_declares_replayed_tools(conversation):
+    _, tool_kwargs = _chat_turn(conversation, BIRTH)
+    assert "get_bazi" in _tool_names(tool_kwargs)
+    assert tool_kwargs["tool_choice"] == "auto"
+
+    messages, tool_kwargs = _chat_turn(conversation, "谢谢你")
+    assert any(m["role"] == "tool" for m in messages)
+    # 回放的 get_bazi 结果需要 schema，但闲聊轮不允许调用工具
+    assert _tool_names(tool_kwargs) == ["get_bazi"]
+    assert tool_kwargs["tool_choice"] == "none"
+
+
+def test_chat_tool_kwargs_adds_replayed_tools_to_selected():
+    messages = [{"role": "assistant", "content": None, "tool_calls": [
+        {"id": "call_memo_1", "type": "function",
+         "function": {"name": "get_bazi", "arguments": json.dumps({"year": 1990})}}]},
+        {"role": "tool", "tool_call_id": "call_memo_1", "content": "BAZI"}]
+    kwargs = app.chat_tool_kwargs(("get_meihua",), messages)
+    assert sorted(_tool_names(kwargs)) == ["get_bazi", "get_meihua"]
+    assert kwargs["tool_choice"] == "auto"
+    assert app.chat_tool_kwargs((), [{"role": "user", "content": "你好"}]) == {}
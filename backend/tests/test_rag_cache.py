@@ -0,0 +1,46 @@
+"""rag 检索缓存：retrieve() 与 retrieve_for_conversation() 的冷检索共用 RetrievalCache。"""
+
+import pytest
+
+import rag
+from retrieval_cache import RetrievalCache
+
+CHUNK = {"id": "zipingzhenquan_baihua_chunk_1", "source": "子平真诠评注（白话）", "content": "用神取月令。"}
+
+
+@pytest.fixture
+def searches(monkeypatch):
+    """替换实际检索与知识库快照，记录 _search 的调用。"""
+    calls = []
+
+    def fake_search(q, top_k, backend, shards):
+        calls.append(q)
+        return [dict(CHUNK)]
+
+    monkeypatch.setattr(rag, "_search", fake_search)
+    monkeypatch.setattr(rag, "_store_version", lambda: ("v1", "k1"))
+    monkeypatch.setattr(rag, "_load_vector_state", lambda: rag._VectorState("v1"))
+    monkeypatch.setattr(rag, "_cache", RetrievalCache())
+    monkeypatch.setattr(rag, "_conversations", rag.ConversationContexts())
+    return calls
+
+
+def test_cold_query_in_new_conversation_hits_cache(searches):
+    ref = rag.retrieve_for_conversation("c1", "用神怎么取？", top_k=5, backend="keyword")
+    assert rag.retrieve_for_conversation("c2", "用神怎么取", top_k=5, backend="keyword") == ref
+    assert searches == ["用神怎么取"]
+    assert rag.cache_stats()["hits"] == 1
+
+
+def test_retrieve_and_conversation_share_entries(searches):
+    ref = rag.retrieve("用神怎么取", top_k=5, backend="keyword")
+    assert rag.retrieve_for_conversation("c1", "用神怎么取", top_k=5, backend="keyword") == ref
+    assert len(searches) == 1
+    assert "用神取月令" in ref
+
+
+def test_version_change_invalidates(searches, monkeypatch):
+    rag.retrieve("用神怎么取", top_k=5, backend="keyword")
+    monkeypatch.setattr(rag, "_store_version", lambda: ("v2", "k1"))
+    rag.retrieve("用神怎么取", top_k=5, backend="keyword")
+    assert len(searches) == 2
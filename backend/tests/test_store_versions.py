@@ -0,0 +1,71 @@
+"""store_versions：暂存、发布、校验与清理旧版本。"""
+
+import os
+
+import store_versions as sv
+
+
+def _write(path, text):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+
+
+def _read(path):
+    with open(path, encoding="utf-8") as f:
+        return f.read()
+
+
+def test_publish_and_verify(tmp_path):
+    root = str(tmp_path)
+    assert sv.current_dir(root) is None
+    staging = sv.stage(root)
+    _write(os.path.join(staging, "manifest.json"), "{}")
+    _write(os.path.join(staging, "ann", "centroids.npy"), "c")
+    version = sv.publish(root, staging)
+
+    assert sv.current_version(root) == version
+    assert sv.current_dir(root) == sv.version_dir(root, version)
+    assert not os.path.exists(staging)
+    assert sv.verify(sv.current_dir(root))
+
+    _write(os.path.join(sv.current_dir(root), "ann", "centroids.npy"), "corrupted")
+    assert not sv.verify(sv.current_dir(root))
+
+
+def test_stage_starts_from_current_without_touching_it(tmp_path):
+    root = str(tmp_path)
+    staging = sv.stage(root)
+    _write(os.path.join(staging, "manifest.json"), "v1")
+    first = sv.publish(root, staging)
+
+    staging = sv.stage(root)
+    assert _read(os.path.join(staging, "manifest.json")) == "v1"
+    assert not os.path.exists(os.path.join(staging, sv.CHECKSUM_FILE))
+    # 构建一律先删后写，硬链接共享的已发布文件不受影响
+    os.remove(os.path.join(staging, "manifest.json"))
+    _write(os.path.join(staging, "manifest.json"), "v2")
+    assert _read(os.path.join(sv.version_dir(root, first), "manifest.json")) == "v1"
+    sv.discard(staging)
+    assert sv.current_version(root) == first and not os.path.exists(staging)
+
+
+def test_prune_keeps_latest_versions(tmp_path):
+    root = str(tmp_path)
+    published = []
+    for i in range(4):
+        staging = sv.stage(root)
+        _write(os.path.join(staging, "manifest.json"), str(i))
+        published.append(sv.publish(root, staging, keep=2))
+    assert sv.list_versions(root) == sorted(published)[-2:]
+    assert sv.current_version(root) == published[-1]
+
+
+def test_legacy_flat_store_is_migrated(tmp_path):
+    root = str(tmp_path)
+    _write(os.path.join(root, "manifest.json"), "legacy")
+    assert sv.current_dir(root) == root
+    staging = sv.stage(root)
+    sv.publish(root, staging)
+    assert _read(os.path.join(sv.current_dir(root), "manifest.json")) == "legacy"
+    assert sorted(os.listdir(root)) == [sv.CURRENT_FILE, sv.VERSIONS_DIR]
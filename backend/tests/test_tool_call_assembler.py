@@ -0,0 +1,55 @@
+"""app.ToolCallAssembler：从流式 delta 拼装 tool_calls。"""
+
+from types import SimpleNamespace
+
+import app
+
+
+def _tc(index=None, id=None, name=None, arguments=None):
+    return SimpleNamespace(index=index, id=id, function=SimpleNamespace(name=name, arguments=arguments))
+
+
+def _names_args(calls):
+    return [(c["id"], c["function"]["name"], c["function"]["arguments"]) for c in calls]
+
+
+def test_single_call_arguments_across_deltas():
+    asm = app.ToolCallAssembler()
+    assert asm.feed([_tc(0, "call_1", "get_bazi", "")]) == []
+    assert asm.feed([_tc(0, None, None, '{"year": 19')]) == []
+    assert asm.feed([_tc(0, None, None, '90, "month": 5, "day": 1}')]) == []
+    assert asm.feed(None) == []
+    assert _names_args(asm.flush()) == [("call_1", "get_bazi", '{"year": 1990, "month": 5, "day": 1}')]
+    assert asm.flush() == []
+
+
+def test_previous_call_completes_when_next_index_starts():
+    asm = app.ToolCallAssembler()
+    asm.feed([_tc(0, "call_1", "get_meihua", '{"numbers": [3, 5, 7]}')])
+    done = asm.feed([_tc(1, "call_2", "get_liuyao", "{")])
+    assert _names_args(done) == [("call_1", "get_meihua", '{"numbers": [3, 5, 7]}')]
+    asm.feed([_tc(1, None, None, "}")])
+    assert _names_args(asm.flush()) == [("call_2", "get_liuyao", "{}")]
+
+
+def test_missing_index_uses_id_to_start_new_call():
+    asm = app.ToolCallAssembler()
+    asm.feed([_tc(None, "call_1", "get_meihua", "{}")])
+    done = asm.feed([_tc(None, "call_2", "get_liuyao", "")])
+    asm.feed([_tc(None, None, None, '{"by_time": true}')])
+    assert _names_args(done) == [("call_1", "get_meihua", "{}")]
+    assert _names_args(asm.flush()) == [("call_2", "get_liuyao", '{"by_time": true}')]
+
+
+def test_empty_arguments_become_empty_object():
+    asm = app.ToolCallAssembler()
+    asm.feed([_tc(0, "call_1", "get_meihua", None)])
+    call = asm.flush()[0]
+    assert call["type"] == "function" and call["function"]["arguments"] == "{}"
+
+
+def test_several_calls_in_one_delta():
+    asm = app.ToolCallAssembler()
+    done = asm.feed([_tc(0, "a", "get_meihua", "{}"), _tc(1, "b", "get_liuyao", "{}")])
+    assert [c["id"] for c in done] == ["a"]
+    assert [c["id"] for c in asm.flush()] == ["b"]
@@ -0,0 +1,91 @@
+"""工具结果备忘：app.memo_key / ToolMemo / replay_tool_results / prefetch_bazi 与 tool_results 表。"""
+
+import json
+
+import pytest
+
+import app
+import database as db
+
+
+@pytest.fixture
+def conversation(tmp_path, monkeypatch):
+    monkeypatch.setattr(db, "DB_PATH", str(tmp_path / "chat.db"))
+    db.init_db()
+    return db.create_conversation("user-1")["id"]
+
+
+def _call(name, args, call_id="call_1"):
+    return {"id": call_id, "type": "function",
+            "function": {"name": name, "arguments": json.dumps(args, ensure_ascii=False)}}
+
+
+def _memo(conversation_id):
+    history = db.get_conversation_messages(conversation_id)
+    return app.ToolMemo(conversation_id, history[-1]["id"], db.get_tool_results(conversation_id))
+
+
+def test_memo_key_normalizes_defaults_and_key_order():
+    a = app.memo_key("get_bazi", '{"year": 1990, "month": 5, "day": 1, "hour": 8}')
+    b = app.memo_key("get_bazi", {"hour": "8", "day": 1, "month": 5, "year": 1990, "minute": 0,
+                                  "is_male": True, "is_solar": True})
+    assert a == b
+    assert a != app.memo_key("get_bazi", {"year": 1990, "month": 5, "day": 1, "hour": 8, "is_male": False})
+    assert app.memo_key("get_meihua", {"numbers": [3, 5, 7, 9]}) == app.memo_key("get_meihua", {"numbers": [3, 5, 7]})
+    assert app.memo_key("get_meihua", {"numbers": [3, 5, 7]}) != app.memo_key("get_liuyao", {"numbers": [3, 5, 7]})
+
+
+@pytest.mark.parametrize("name, arguments", [
+    ("get_meihua", "{}"),
+    ("get_liuyao", '{"by_time": true}'),
+    ("get_bazi", "not json"),
+    ("unknown", "{}"),
+])
+def test_memo_key_not_memoizable(name, arguments):
+    assert app.memo_key(name, arguments) is None
+
+
+def test_tool_memo_records_and_replays(conversation):
+    db.add_message(conversation, "user", "1990年5月1日早上8点 男")
+    memo = _memo(conversation)
+    bazi = _call("get_bazi", {"year": 1990, "month": 5, "day": 1, "hour": 8})
+    memo.record(bazi, "BAZI")
+    memo.record(_call("get_meihua", {"by_time": True}, "call_2"), "MEIHUA")
+    memo.record(_call("get_liuyao", {"numbers": [1, 2, 3]}, "call_3"), "工具执行超时: get_liuyao")
+    memo.record(bazi, "BAZI-AGAIN")
+    db.add_message(conversation, "assistant", "解读")
+    db.add_message(conversation, "user", "那我的事业呢")
+
+    memo = _memo(conversation)
+    assert memo.lookup(_call("get_bazi", {"day": 1, "month": 5, "year": 1990, "hour": 8, "minute": 0})) == "BAZI"
+    assert memo.lookup(_call("get_meihua", {"by_time": True})) is None
+    assert memo.lookup(_call("get_liuyao", {"numbers": [1, 2, 3]})) is None
+
+    messages = app.replay_tool_results(db.get_conversation_messages(conversation), db.get_tool_results(conversation))
+    assert [m["role"] for m in messages] == ["user", "assistant", "tool", "tool", "assistant", "user"]
+    assert [c["function"]["name"] for c in messages[1]["tool_calls"]] == ["get_bazi", "get_meihua"]
+    assert [m["content"] for m in messages[2:4]] == ["BAZI", "MEIHUA"]
+    assert [m["tool_call_id"] for m in messages[2:4]] == [c["id"] for c in messages[1]["tool_calls"]]
+
+
+def test_prefetch_bazi_uses_memo_for_earlier_message(conversation):
+    first = "1990年5月1日早上8点 男"
+    db.add_message(conversation, "user", first)
+    prefetched = app.prefetch_bazi(first, [], _memo(conversation))
+    assert prefetched is not None
+    call, result = prefetched
+    assert json.loads(call["function"]["arguments"])["hour"] == 8
+    assert len(db.get_tool_results(conversation)) == 1
+
+    db.add_message(conversation, "assistant", "解读")
+    db.add_message(conversation, "user", "那我的事业呢")
+    # 之前那一轮已排过盘：由回放提供，不再计算、不再注入
+    assert app.prefetch_bazi("那我的事业呢", [first], _memo(conversation)) is None
+    assert len(db.get_tool_results(conversation)) == 1
+
+
+def test_delete_conversation_removes_tool_results(conversation):
+    db.add_message(conversation, "user", "起一卦")
+    _memo(conversation).record(_call("get_meihua", {"numbers": [3, 5, 7]}), "MEIHUA")
+    db.delete_conversation(conversation)
+    assert db.get_tool_results(conversation) == []
@@ -0,0 +1,66 @@
+"""工具调用的并行执行与超时：app.submit_tool / collect_tools / abandon_tool。"""
+
+import json
+import threading
+import time
+
+import pytest
+
+import app
+
+
+def _call(name, **args):
+    return {"id": f"call_{name}", "type": "function", "function": {"name": name, "arguments": json.dumps(args)}}
+
+
+@pytest.fixture
+def tool_pool(monkeypatch):
+    """单线程工具池、0.2 秒超时；工具按参数睡眠或一直卡住，测试结束时放行卡住的线程。"""
+    release = threading.Event()
+
+    def fake_tool(name, arguments):
+        args = json.loads(arguments)
+        if args.get("hang"):
+            release.wait()
+        time.sleep(args.get("sleep", 0))
+        return f"{name}-done"
+
+    monkeypatch.setattr(app, "TOOL_THREADS", 1)
+    monkeypatch.setattr(app, "TOOL_TIMEOUT", 0.2)
+    monkeypatch.setattr(app, "run_divination_tool", fake_tool)
+    monkeypatch.setattr(app, "_tool_pool", app._new_tool_pool())
+    yield
+    release.set()
+
+
+def test_results_keep_call_order_and_run_concurrently(tool_pool, monkeypatch):
+    monkeypatch.setattr(app, "TOOL_THREADS", 3)
+    monkeypatch.setattr(app, "_tool_pool", app._new_tool_pool())
+    calls = [_call("a", sleep=0.1), _call("b", sleep=0.05), _call("c", sleep=0.1)]
+    start = time.monotonic()
+    results = app.collect_tools([app.submit_tool(c) for c in calls])
+    assert [r for _, r in results] == ["a-done", "b-done", "c-done"]
+    assert [c["id"] for c, _ in results] == ["call_a", "call_b", "call_c"]
+    assert time.monotonic() - start < 0.2
+
+
+def test_timed_out_tool_does_not_block_next_turn(tool_pool):
+    start = time.monotonic()
+    first = app.collect_tools([app.submit_tool(_call("hung", hang=True))])
+    assert first[0][1] == app.tool_timeout_result(_call("hung"))
+    assert time.monotonic() - start < 1
+
+    # 卡住的线程仍在旧池里；下一轮的调用在新池中执行，按时返回
+    start = time.monotonic()
+    second = app.collect_tools([app.submit_tool(_call("next"))])
+    assert second[0][1] == "next-done"
+    assert time.monotonic() - start < 0.2
+
+
+def test_memo_hit_skips_pool(tool_pool):
+    class Memo:
+        def lookup(self, call):
+            return "cached"
+
+    call, future, _, pool = app.submit_tool(_call("hung", hang=True), Memo())
+    assert pool is None and future.result(timeout=0) == "cached"
@@ -0,0 +1,66 @@
+"""vector_store：top_k_indices 与按书分片打分（score_shard / prepare_shards）。"""
+
+import numpy as np
+import pytest
+
+import vector_store
+from vector_store import load_store, save_sparse_store, save_store, top_k_indices
+
+# 两本书的行交错排列，分片行号不连续
+IDS = ["ditiansui_baihua_chunk_1", "ditiansui_baihua_chunk_2", "sanmingtonghui_baihua_chunk_1",
+       "ditiansui_baihua_chunk_3", "sanmingtonghui_baihua_chunk_2", "sanmingtonghui_baihua_chunk_3"]
+
+
+def _meta():
+    return [{"id": i, "source": i.split("_")[0], "content": i} for i in IDS]
+
+
+def _matrix():
+    rng = np.random.default_rng(0)
+    emb = rng.random((len(IDS), 16), dtype=np.float32)
+    emb[emb < 0.6] = 0
+    return emb
+
+
+def _to_csr(emb):
+    rows, cols = np.nonzero(emb)
+    indptr = np.zeros(len(emb) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=len(emb)), out=indptr[1:])
+    return indptr, cols.astype(np.int32), emb[rows, cols].astype(np.float32)
+
+
+def test_top_k_indices_sorted_desc():
+    scores = np.array([0.1, 0.9, 0.3, 0.7, 0.5], dtype=np.float32)
+    assert top_k_indices(scores, 3).tolist() == [1, 3, 4]
+    assert top_k_indices(scores, 10).tolist() == [1, 3, 4, 2, 0]
+    assert len(top_k_indices(scores, 0)) == 0
+
+
+@pytest.mark.parametrize("layout, dtype", [("csr", "float32"), ("dense", "float32"),
+                                           ("dense", "float16"), ("dense", "int8")])
+def test_score_shard_matches_full_scores(tmp_path, monkeypatch, layout, dtype):
+    # 分块小于区间长度，覆盖区间内多块的情况
+    monkeypatch.setattr(vector_store, "SCORE_BLOCK_ROWS", 2)
+    emb = _matrix()
+    if layout == "csr":
+        save_sparse_store(str(tmp_path), _to_csr(emb), emb.shape[1], _meta())
+    else:
+        save_store(str(tmp_path), emb, _meta(), dtype=dtype, keep_exact=False)
+    store = load_store(str(tmp_path))
+    assert store.prepare_shards() == {"ditiansui": 3, "sanmingtonghui": 3}
+    q = np.zeros(emb.shape[1], dtype=np.float32)
+    q[[1, 4, 9]] = [0.6, 0.8, 0.2]
+    nz = np.flatnonzero(q)
+    full = store.score(q)
+    for shard, expected in (("ditiansui", [0, 1, 3]), ("sanmingtonghui", [2, 4, 5])):
+        rows, scores = store.score_shard(shard, nz, q[nz])
+        assert rows.tolist() == expected
+        np.testing.assert_allclose(scores, full[rows], rtol=1e-5, atol=1e-6)
+
+
+def test_dense_shard_view_is_row_runs(tmp_path):
+    save_store(str(tmp_path), _matrix(), _meta())
+    store = load_store(str(tmp_path))
+    store.prepare_shards()
+    assert store._shard_views["ditiansui"] == [(0, 2), (3, 4)]
+    assert store._shard_views["sanmingtonghui"] == [(2, 3), (4, 6)]
@@ -0,0 +1,715 @@
+"""
+命理知识库向量库存取 —— build_vector_store.py 负责写，rag.py 负责读。
+
+向量在写盘前已做 L2 归一化，检索时只需一次乘积即得余弦相似度，
+不再每次查询重算范数、复制整份归一化矩阵。支持两种布局：
+
+csr（默认）：TF-IDF 向量极稀疏（几百字的 chunk 只涉及几百个 n-gram），按 CSR 存储；
+  另存转置后的 CSC（按词条列组织），检索时只遍历查询非零项对应的列，
+  打分耗时与非零元个数成正比，整个库只有几 MB。
+dense：(N, d) 稠密矩阵，可选量化存储以缩小常驻内存：
+  float32  原样存储
+  float16  半精度，体积减半
+  int8     每行按最大绝对值缩放到 [-127, 127]，另存每行 scale（float32），体积约 1/4
+  量化存储时默认另存一份 float32 精确向量（embeddings_f32.npy），检索时只读取 shortlist
+  所在的行做精确重排。
+所有数组均以 np.load(mmap_mode="r") 加载，多 worker 共享页缓存。
+
+分书分片：chunk id 以书 id 开头（见 books.BOOK_DISPLAY，如 ditiansui_baihua_chunk_1），
+shard_rows(书 id) 返回该书的全部行。prepare_shards() 为每本书建好分片视图（rag.warmup() 在 preload 的
+master 中调用，worker 共享）：csr 布局为该书单独转置出一份 CSC，score_shard 只遍历该书的列数据；
+dense 布局记录该书行号的连续区间，score_shard 按区间对 mmap 切片原地打分，不复制行。
+manifest 的 "shards" 记录各书行数。
+
+增量构建（build_vector_store.py 默认）：新增/修改的 chunk 向量化后作为新的一段追加到行尾
+（append_rows），旧行只记墓碑；墓碑占比过高或指定 --compact 时 compact_store 重写为连续的一段。
+
+版本化（store_versions.py）：构建写到 knowledge/vector_store/versions/ 下的暂存目录，完成后整体发布为
+新版本并原子切换 CURRENT；下列文件均位于某个版本目录内，已发布版本不再原地修改。
+
+版本目录 knowledge/vector_store/versions/<版本>/：
+  csr_indptr.npy / csr_indices.npy / csr_data.npy   csr 布局：按行（chunk）
+  csc_indptr.npy / csc_indices.npy / csc_data.npy   csr 布局：按列（词条），打分用
+  embeddings.npy       dense 布局：(N, d) 归一化向量，dtype 见 manifest
+  scales.npy           dense + int8 时每行的反量化系数
+  embeddings_f32.npy   dense 量化时可选，float32 精确向量，供重排
+  meta_ids.npy         列式元数据：各行 chunk id（定长 unicode）
+  meta_sources.npy     各行来源在 manifest "sources"（去重后的来源名）中的下标，int32
+  meta_offsets.npy     int64 (N + 1)：各行 content 在 meta_content.bin 中的起止字节偏移
+  meta_content.bin     全部 content 的 UTF-8 字节顺序拼接；mmap 只读，只有命中的行才解码
+  deleted.npy          增量构建时被替换/删除的行号（墓碑），检索时这些行不参与排序
+  manifest.json        {"format", "layout", "dtype", "normalized", "rows", "dim", "exact",
+                        "segments": [各段行数], "deleted": 墓碑数, "shards", "sources",
+                        "lsa_dim": dense 布局存 LSA 投影向量时的维度（0 为 TF-IDF）}
+  lsa_projection.npy   可选，LSA 投影矩阵 (vocab_size, lsa_dim)，由 embedding_utils 读写
+  checksums.json       发布时写入的各文件 sha256，热加载前校验（store_versions.verify）
+  旧版向量库的 meta.json（[{id, source, content}, ...]）仍可读取，重新构建后改写为列式文件。
+  build_state.json     增量构建状态：各 chunk 内容哈希与所在行、词表词条的当前文档频率
+  ann/                 可选的 IVF(-PQ) 近似最近邻索引，见 ann_index.py
+"""
+
+from __future__ import annotations
+
+import json
+import mmap
+import os
+import shutil
+from typing import Iterator, List, Optional, Tuple, Union
+
+import numpy as np
+
+EMBEDDINGS_FILE = "embeddings.npy"
+EXACT_FILE = "embeddings_f32.npy"
+SCALES_FILE = "scales.npy"
+CSR_FILES = ("csr_indptr", "csr_indices", "csr_data")
+CSC_FILES = ("csc_indptr", "csc_indices", "csc_data")
+META_FILE = "meta.json"
+META_IDS_FILE = "meta_ids.npy"
+META_SOURCES_FILE = "meta_sources.npy"
+META_OFFSETS_FILE = "meta_offsets.npy"
+META_CONTENT_FILE = "meta_content.bin"
+MANIFEST_FILE = "manifest.json"
+TOMBSTONE_FILE = "deleted.npy"
+BUILD_STATE_FILE = "build_state.json"
+ANN_DIR = "ann"
+FORMAT_VERSION = 2
+LAYOUTS = ("csr", "dense")
+DTYPES = ("float32", "float16", "int8")
+# 分块打分的行数：量化矩阵逐块转 float32 参与乘法，临时内存只占一块
+SCORE_BLOCK_ROWS = 512
+
+# 写新库前清理的数据文件（切换布局/类型时避免残留旧文件）
+_DATA_FILES = (
+    EMBEDDINGS_FILE, EXACT_FILE, SCALES_FILE, TOMBSTONE_FILE,
+    META_FILE, META_IDS_FILE, META_SOURCES_FILE, META_OFFSETS_FILE, META_CONTENT_FILE,
+) + tuple(name + ".npy" for name in CSR_FILES + CSC_FILES)
+
+Csr = Tuple[np.ndarray, np.ndarray, np.ndarray]
+
+
+def shard_of(chunk_id: str) -> str:
+    """chunk id 所属的分片（书 id）：第一个下划线之前的部分。"""
+    return chunk_id.split("_", 1)[0]
+
+
+def _score_columns(csc: Csr, n_rows: int, q_indices: np.ndarray, q_data: np.ndarray) -> np.ndarray:
+    """按 CSC 只遍历查询非零项对应的列累加分数，返回 float32 (n_rows,)。"""
+    col_ptr, col_rows, col_data = csc
+    scores = np.zeros(n_rows, dtype=np.float32)
+    for j, v in zip(q_indices.tolist(), q_data.tolist()):
+        start, end = int(col_ptr[j]), int(col_ptr[j + 1])
+        if start < end:
+            # 同一列内行号唯一，可直接花式索引累加
+            scores[col_rows[start:end]] += v * col_data[start:end]
+    return scores
+
+
+def _row_runs(rows: np.ndarray) -> List[Tuple[int, int]]:
+    """升序行号拆成连续区间 [(start, end), ...]（end 不含）。"""
+    if len(rows) == 0:
+        return []
+    breaks = np.flatnonzero(np.diff(rows) != 1) + 1
+    starts = np.concatenate(([0], breaks))
+    ends = np.concatenate((breaks, [len(rows)]))
+    return [(int(rows[a]), int(rows[b - 1]) + 1) for a, b in zip(starts.tolist(), ends.tolist())]
+
+
+def _shard_counts(meta: "StoreMeta") -> dict:
+    counts = {}
+    for i in range(len(meta)):
+        shard = shard_of(meta.chunk_id(i))
+        counts[shard] = counts.get(shard, 0) + 1
+    return counts
+
+
+class StoreMeta:
+    """列式行元数据：id 与来源下标常驻内存（紧凑数组），content 按字节偏移从 blob（mmap）按需解码。
+    meta[i] 返回 {"id", "source", "content"} 字典，与旧版 meta.json 的条目一致。"""
+
+    def __init__(self, ids: np.ndarray, source_codes: np.ndarray, sources: List[str], offsets: np.ndarray, blob):
+        self.ids = ids
+        self.source_codes = source_codes
+        self.sources = list(sources)
+        self.offsets = offsets
+        self._blob = blob
+
+    @classmethod
+    def from_records(cls, records) -> "StoreMeta":
+        """由 [{id, source, content}, ...] 构建（内存中的 blob）。"""
+        records = list(records)
+        sources, codes, blobs = {}, [], []
+        offsets = np.zeros(len(records) + 1, dtype=np.int64)
+        for i, m in enumerate(records):
+            codes.append(sources.setdefault(m.get("source", ""), len(sources)))
+            blobs.append((m.get("content") or "").encode("utf-8"))
+            offsets[i + 1] = offsets[i] + len(blobs[-1])
+        ids = [m.get("id", "") for m in records]
+        return cls(
+            np.array(ids, dtype=str) if ids else np.array([], dtype="<U1"),
+            np.array(codes, dtype=np.int32),
+            list(sources),
+            offsets,
+            b"".join(blobs),
+        )
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def chunk_id(self, i: int) -> str:
+        return str(self.ids[i])
+
+    def source(self, i: int) -> str:
+        return self.sources[int(self.source_codes[i])]
+
+    def content(self, i: int) -> str:
+        return self._blob[int(self.offsets[i]):int(self.offsets[i + 1])].decode("utf-8")
+
+    def __getitem__(self, i) -> dict:
+        i = int(i)
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return {"id": self.chunk_id(i), "source": self.source(i), "content": self.content(i)}
+
+    def __iter__(self) -> Iterator[dict]:
+        return (self[i] for i in range(len(self)))
+
+    def write(self, store_dir: str) -> List[str]:
+        """写出列式文件，返回来源名列表（记入 manifest）。"""
+        np.save(os.path.join(store_dir, META_IDS_FILE), self.ids)
+        np.save(os.path.join(store_dir, META_SOURCES_FILE), self.source_codes)
+        np.save(os.path.join(store_dir, META_OFFSETS_FILE), self.offsets)
+        with open(os.path.join(store_dir, META_CONTENT_FILE), "wb") as f:
+            f.write(self._blob[:int(self.offsets[-1])])
+        return self.sources
+
+
+def load_meta(store_dir: str, manifest: dict) -> StoreMeta:
+    """读取行元数据：列式文件（ids / 来源下标 / 偏移常驻内存，content blob mmap），或旧版 meta.json。"""
+    content_path = os.path.join(store_dir, META_CONTENT_FILE)
+    if os.path.isfile(content_path):
+        offsets = np.load(os.path.join(store_dir, META_OFFSETS_FILE))
+        blob = b""
+        if int(offsets[-1]) > 0:
+            with open(content_path, "rb") as f:
+                blob = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return StoreMeta(
+            np.load(os.path.join(store_dir, META_IDS_FILE)),
+            np.load(os.path.join(store_dir, META_SOURCES_FILE)),
+            manifest.get("sources", []),
+            offsets,
+            blob,
+        )
+    with open(os.path.join(store_dir, META_FILE), "r", encoding="utf-8") as f:
+        return StoreMeta.from_records(json.load(f))
+
+
+def _has_meta(store_dir: str) -> bool:
+    return any(os.path.isfile(os.path.join(store_dir, name)) for name in (META_CONTENT_FILE, META_FILE))
+
+
+def l2_normalize(mat: np.ndarray) -> np.ndarray:
+    """按行 L2 归一化，返回 float32 新数组；全零行保持为零。"""
+    mat = np.asarray(mat, dtype=np.float32)
+    norms = np.linalg.norm(mat, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return mat / norms
+
+
+def csr_normalize(csr: Csr) -> Csr:
+    """CSR 矩阵按行 L2 归一化，返回新的 data；全零行保持为零。"""
+    indptr, indices, data = csr
+    data = np.asarray(data, dtype=np.float32)
+    row_of = np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))
+    sq = np.zeros(len(indptr) - 1, dtype=np.float64)
+    np.add.at(sq, row_of, data.astype(np.float64) ** 2)
+    norms = np.sqrt(sq).astype(np.float32)
+    norms[norms == 0] = 1.0
+    return indptr, indices, data / norms[row_of]
+
+
+def csr_transpose(csr: Csr, n_cols: int) -> Csr:
+    """CSR (N, d) 转置为按列组织的 CSC（即转置矩阵的 CSR），列内行号升序。"""
+    indptr, indices, data = csr
+    row_of = np.repeat(np.arange(len(indptr) - 1, dtype=np.int32), np.diff(indptr))
+    order = np.argsort(indices, kind="stable")
+    col_ptr = np.zeros(n_cols + 1, dtype=np.int64)
+    np.cumsum(np.bincount(indices, minlength=n_cols), out=col_ptr[1:])
+    return col_ptr, row_of[order], data[order]
+
+
+def _row_positions(indptr: np.ndarray, rows: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """CSR 中指定各行非零元在 indices/data 里的位置（拼接后）与每行长度。"""
+    starts = np.asarray(indptr[rows], dtype=np.int64)
+    lengths = np.asarray(indptr[rows + 1], dtype=np.int64) - starts
+    # 每个非零元的位置：所在行起点 + 行内偏移
+    pos = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(int(lengths.sum()))
+    return pos, lengths
+
+
+def csr_take(csr: Csr, rows: np.ndarray) -> Csr:
+    """取出指定行组成新的 CSR。"""
+    indptr, indices, data = csr
+    pos, lengths = _row_positions(indptr, np.asarray(rows, dtype=np.int64))
+    new_indptr = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=new_indptr[1:])
+    return new_indptr, np.asarray(indices[pos]), np.asarray(data[pos])
+
+
+def csr_vstack(parts) -> Csr:
+    """按行拼接多个 CSR。"""
+    indptrs, offset = [np.zeros(1, dtype=np.int64)], 0
+    for indptr, _, _ in parts:
+        indptrs.append(np.asarray(indptr[1:], dtype=np.int64) + offset)
+        offset += int(indptr[-1])
+    return (
+        np.concatenate(indptrs),
+        np.concatenate([np.asarray(p[1], dtype=np.int32) for p in parts]),
+        np.concatenate([np.asarray(p[2], dtype=np.float32) for p in parts]),
+    )
+
+
+def quantize(emb_n: np.ndarray, dtype: str):
+    """将归一化矩阵量化为指定 dtype，返回 (data, scales)；非 int8 时 scales 为 None。"""
+    if dtype == "float32":
+        return emb_n.astype(np.float32, copy=False), None
+    if dtype == "float16":
+        return emb_n.astype(np.float16), None
+    if dtype == "int8":
+        scales = np.abs(emb_n).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        data = np.rint(emb_n / scales[:, None]).astype(np.int8)
+        return data, scales.astype(np.float32)
+    raise ValueError(f"不支持的向量存储类型: {dtype}，可选 {DTYPES}")
+
+
+def _clear_data_files(store_dir: str):
+    os.makedirs(store_dir, exist_ok=True)
+    for name in _DATA_FILES:
+        path = os.path.join(store_dir, name)
+        if os.path.isfile(path):
+            os.remove(path)
+    # 旧的 ANN 索引与新向量不再对应，一并删除（需要时由 build_vector_store.py --ann 重建）
+    shutil.rmtree(os.path.join(store_dir, ANN_DIR), ignore_errors=True)
+
+
+def _write_meta_manifest(store_dir: str, meta: Union[StoreMeta, List[dict]], manifest: dict) -> dict:
+    if not isinstance(meta, StoreMeta):
+        meta = StoreMeta.from_records(meta)
+    manifest["shards"] = _shard_counts(meta)
+    manifest["sources"] = meta.write(store_dir)
+    # manifest 最后写、且写临时文件后替换：读取方看到新 manifest 时数据文件已全部就位
+    path = os.path.join(store_dir, MANIFEST_FILE)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(path + ".tmp", path)
+    return manifest
+
+
+def save_store(
+    store_dir: str,
+    embeddings: np.ndarray,
+    meta: Union[StoreMeta, List[dict]],
+    dtype: str = "float32",
+    keep_exact: bool = True,
+    lsa_dim: int = 0,
+) -> dict:
+    """dense 布局：归一化（并按需量化）后写出向量库，返回 manifest。
+    keep_exact 仅在量化存储时生效：额外保存 float32 精确向量供 shortlist 重排。
+    lsa_dim 非 0 表示向量为 LSA 投影后的 k 维向量（投影矩阵由 embedding_utils 保存）。"""
+    emb_n = l2_normalize(embeddings)
+    data, scales = quantize(emb_n, dtype)
+    _clear_data_files(store_dir)
+    np.save(os.path.join(store_dir, EMBEDDINGS_FILE), data)
+    if scales is not None:
+        np.save(os.path.join(store_dir, SCALES_FILE), scales)
+    exact = dtype != "float32" and keep_exact
+    if exact:
+        np.save(os.path.join(store_dir, EXACT_FILE), emb_n)
+    return _write_meta_manifest(store_dir, meta, {
+        "format": FORMAT_VERSION,
+        "layout": "dense",
+        "dtype": dtype,
+        "normalized": True,
+        "rows": int(emb_n.shape[0]),
+        "dim": int(emb_n.shape[1]) if emb_n.ndim == 2 else 0,
+        "exact": exact,
+        "segments": [int(emb_n.shape[0])],
+        "deleted": 0,
+        "lsa_dim": int(lsa_dim),
+    })
+
+
+def save_sparse_store(store_dir: str, csr: Csr, dim: int, meta: Union[StoreMeta, List[dict]]) -> dict:
+    """csr 布局：归一化后写出 CSR 行与其转置 CSC 列，返回 manifest。"""
+    csr = csr_normalize(csr)
+    indptr, indices, data = csr
+    csc = csr_transpose(csr, dim)
+    _clear_data_files(store_dir)
+    for names, arrays in ((CSR_FILES, csr), (CSC_FILES, csc)):
+        for name, arr in zip(names, arrays):
+            np.save(os.path.join(store_dir, name + ".npy"), arr)
+    return _write_meta_manifest(store_dir, meta, {
+        "format": FORMAT_VERSION,
+        "layout": "csr",
+        "dtype": "float32",
+        "normalized": True,
+        "rows": int(len(indptr) - 1),
+        "dim": int(dim),
+        "nnz": int(len(data)),
+        "exact": False,
+        "segments": [int(len(indptr) - 1)],
+        "deleted": 0,
+    })
+
+
+def _read_manifest(store_dir: str) -> dict:
+    path = os.path.join(store_dir, MANIFEST_FILE)
+    if not os.path.isfile(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def append_rows(store_dir: str, rows, meta: List[dict], dead_rows) -> dict:
+    """增量构建：把新向量作为新的一段追加到行尾，并把 dead_rows 记为墓碑，返回新 manifest。
+    rows 在 csr 布局下为 CSR 三元组，dense 布局下为 (n, d) 矩阵；旧数组先整体读入内存，
+    写盘前删除旧文件（新 inode），正在 mmap 旧库的进程不受影响。"""
+    manifest = _read_manifest(store_dir)
+    layout = manifest.get("layout", "dense")
+    all_meta = list(load_meta(store_dir, manifest)) + list(meta)
+    dead = np.asarray(sorted(set(int(r) for r in dead_rows)), dtype=np.int64)
+    tomb_path = os.path.join(store_dir, TOMBSTONE_FILE)
+    if os.path.isfile(tomb_path):
+        dead = np.union1d(np.load(tomb_path), dead)
+
+    def load(name):
+        return np.load(os.path.join(store_dir, name))
+
+    if layout == "csr":
+        csr = csr_vstack([tuple(load(n + ".npy") for n in CSR_FILES), csr_normalize(rows)])
+        csc = csr_transpose(csr, manifest["dim"])
+        _clear_data_files(store_dir)
+        for names, arrays in ((CSR_FILES, csr), (CSC_FILES, csc)):
+            for name, arr in zip(names, arrays):
+                np.save(os.path.join(store_dir, name + ".npy"), arr)
+        manifest["nnz"] = int(len(csr[2]))
+        n_new = len(rows[0]) - 1
+    else:
+        emb_n = l2_normalize(np.asarray(rows, dtype=np.float32).reshape(-1, manifest["dim"]))
+        data, scales = quantize(emb_n, manifest["dtype"])
+        arrays = {EMBEDDINGS_FILE: np.concatenate([load(EMBEDDINGS_FILE), data])}
+        if scales is not None:
+            arrays[SCALES_FILE] = np.concatenate([load(SCALES_FILE), scales])
+        if manifest.get("exact"):
+            arrays[EXACT_FILE] = np.concatenate([load(EXACT_FILE), emb_n])
+        _clear_data_files(store_dir)
+        for name, arr in arrays.items():
+            np.save(os.path.join(store_dir, name), arr)
+        n_new = len(emb_n)
+    if len(dead):
+        np.save(tomb_path, dead)
+    manifest["rows"] = len(all_meta)
+    manifest["segments"] = manifest.get("segments", [manifest["rows"] - n_new]) + [int(n_new)]
+    manifest["deleted"] = int(len(dead))
+    return _write_meta_manifest(store_dir, all_meta, manifest)
+
+
+def compact_store(store_dir: str) -> np.ndarray:
+    """去掉墓碑行，把全部段重写为连续的一段；返回旧行号 -> 新行号映射（已删除的为 -1）。"""
+    store = load_store(store_dir)
+    if store is None:
+        raise FileNotFoundError(f"向量库不存在或已损坏: {store_dir}")
+    live = store.live_rows()
+    mapping = np.full(len(store), -1, dtype=np.int64)
+    mapping[live] = np.arange(len(live))
+    meta = [store.meta[i] for i in live]
+    if store.layout == "csr":
+        csr = csr_take(store.csr, live)
+        save_sparse_store(store_dir, csr, store.dim, meta)
+    else:
+        keep_exact = store.exact is not None
+        save_store(
+            store_dir, store.dense_rows(live), meta,
+            dtype=store.dtype, keep_exact=keep_exact, lsa_dim=store.lsa_dim,
+        )
+    return mapping
+
+
+class VectorStore:
+    """mmap 只读的向量库。打分只额外分配 O(N) 的分数数组（dense 量化时另加一块临时矩阵）。"""
+
+    def __init__(self, store_dir: str):
+        manifest_path = os.path.join(store_dir, MANIFEST_FILE)
+        manifest = {}
+        if os.path.isfile(manifest_path):
+            with open(manifest_path, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+        self.layout = manifest.get("layout", "dense")
+        self.lsa_dim = int(manifest.get("lsa_dim", 0))
+        self.embeddings = None
+        self.scales = None
+        self.exact = None
+        self._row_ids = None
+        self._shard_rows = None
+        self._shard_views = {}  # 书 id -> csr: 该书的 CSC；dense: 该书行号的连续区间
+        self.deleted = None
+        if manifest.get("deleted"):
+            self.deleted = np.load(os.path.join(store_dir, TOMBSTONE_FILE))
+        if self.layout == "csr":
+            self.csr = tuple(
+                np.load(os.path.join(store_dir, name + ".npy"), mmap_mode="r")
+                for name in CSR_FILES
+            )
+            self.csc = tuple(
+                np.load(os.path.join(store_dir, name + ".npy"), mmap_mode="r")
+                for name in CSC_FILES
+            )
+            self.rows = len(self.csr[0]) - 1
+            self.dim = len(self.csc[0]) - 1
+            self.dtype = "float32"
+        else:
+            emb = np.load(os.path.join(store_dir, EMBEDDINGS_FILE), mmap_mode="r")
+            if not manifest.get("normalized"):
+                # 旧版向量库（未归一化、无 manifest）：加载时归一化一次，不再逐查询计算
+                emb = l2_normalize(emb)
+            self.embeddings = emb
+            self.rows, self.dim = emb.shape
+            self.dtype = str(emb.dtype)
+            if self.dtype == "int8":
+                self.scales = np.load(os.path.join(store_dir, SCALES_FILE))
+            exact_path = os.path.join(store_dir, EXACT_FILE)
+            if manifest.get("exact") and os.path.isfile(exact_path):
+                self.exact = np.load(exact_path, mmap_mode="r")
+        self.meta = load_meta(store_dir, manifest)
+
+    def __len__(self) -> int:
+        return self.rows
+
+    def score(self, q: np.ndarray) -> np.ndarray:
+        """q 为已归一化的 float32 (d,) 稠密查询向量，返回 float32 (N,) 余弦相似度（量化时为近似值）。"""
+        if self.layout == "csr":
+            nz = np.flatnonzero(q)
+            return self.score_sparse(nz, q[nz])
+        emb = self.embeddings
+        if self.dtype == "float32":
+            return self._mask_deleted(np.asarray(emb @ q, dtype=np.float32))
+        scores = np.empty(len(self), dtype=np.float32)
+        for start in range(0, len(self), SCORE_BLOCK_ROWS):
+            block = np.asarray(emb[start:start + SCORE_BLOCK_ROWS], dtype=np.float32)
+            scores[start:start + len(block)] = block @ q
+        if self.scales is not None:
+            scores *= self.scales
+        return self._mask_deleted(scores)
+
+    def _mask_deleted(self, scores: np.ndarray, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """墓碑行分数置为 -inf，不参与排序。"""
+        if self.deleted is not None and len(scores):
+            if rows is None:
+                scores[self.deleted] = -np.inf
+            else:
+                scores[np.isin(rows, self.deleted)] = -np.inf
+        return scores
+
+    def live_rows(self) -> np.ndarray:
+        """未被删除的行号（升序）。"""
+        rows = np.arange(self.rows)
+        if self.deleted is None:
+            return rows
+        return np.setdiff1d(rows, self.deleted)
+
+    def score_batch(self, q_csr: Csr) -> np.ndarray:
+        """多条查询一次打分：q_csr 为查询 CSR 三元组（m 行，已归一化），返回 float32 (m, N)。
+        csr 布局按整批查询涉及的不同词条分组，每个词条的 CSC 列只读一次，
+        以（含该词条的查询 × 该列的行）外积一次性累加进分数矩阵；dense 布局为分块的矩阵 × 矩阵乘积。"""
+        q_indptr, q_indices, q_data = q_csr
+        m = len(q_indptr) - 1
+        if self.layout == "csr":
+            col_ptr, col_rows, col_data = (np.asarray(a) for a in self.csc)
+            scores = np.zeros((m, self.rows), dtype=np.float32)
+            q_rows = np.repeat(np.arange(m, dtype=np.int64), np.diff(q_indptr))
+            order = np.argsort(q_indices, kind="stable")
+            terms, q_rows, q_vals = np.asarray(q_indices)[order], q_rows[order], np.asarray(q_data)[order]
+            uniq, first = np.unique(terms, return_index=True)
+            bounds = np.append(first, len(terms)).tolist()
+            for t, a, b in zip(uniq.tolist(), bounds[:-1], bounds[1:]):
+                start, end = int(col_ptr[t]), int(col_ptr[t + 1])
+                if start < end:
+                    # 同一词条下查询互不相同、列内行号互不相同，外积位置不重复，可直接花式索引累加
+                    scores[q_rows[a:b, None], col_rows[None, start:end]] += (
+                        q_vals[a:b, None] * col_data[None, start:end]
+                    )
+        else:
+            q = np.zeros((m, self.dim), dtype=np.float32)
+            q[np.repeat(np.arange(m), np.diff(q_indptr)), q_indices] = q_data
+            scores = np.empty((m, self.rows), dtype=np.float32)
+            # 量化库有精确向量时直接用精确向量打分，批量场景不再单独重排
+            emb = self.exact if self.exact is not None else self.embeddings
+            for start in range(0, self.rows, SCORE_BLOCK_ROWS):
+                block = np.asarray(emb[start:start + SCORE_BLOCK_ROWS], dtype=np.float32)
+                scores[:, start:start + len(block)] = q @ block.T
+            if self.exact is None and self.scales is not None:
+                scores *= self.scales[None, :]
+        if self.deleted is not None:
+            scores[:, self.deleted] = -np.inf
+        return scores
+
+    def score_sparse(self, q_indices: np.ndarray, q_data: np.ndarray) -> np.ndarray:
+        """稀疏查询 (indices, data) 打分。csr 布局只遍历查询非零项对应的 CSC 列。"""
+        if self.layout != "csr":
+            q = np.zeros(self.dim, dtype=np.float32)
+            q[q_indices] = q_data
+            return self.score(q)
+        return self._mask_deleted(_score_columns(self.csc, self.rows, q_indices, q_data))
+
+    def dense_rows(self, rows: np.ndarray) -> np.ndarray:
+        """取指定行的稠密 float32 向量 (len(rows), d)；量化库优先用精确向量，否则反量化。"""
+        rows = np.asarray(rows, dtype=np.int64)
+        if self.layout == "csr":
+            indptr, indices, data = self.csr
+            pos, lengths = _row_positions(indptr, rows)
+            out = np.zeros((len(rows), self.dim), dtype=np.float32)
+            out[np.repeat(np.arange(len(rows)), lengths), indices[pos]] = data[pos]
+            return out
+        if self.exact is not None:
+            return np.asarray(self.exact[rows], dtype=np.float32)
+        out = np.asarray(self.embeddings[rows], dtype=np.float32)
+        if self.scales is not None:
+            out *= self.scales[rows][:, None]
+        return out
+
+    def score_rows(self, q: np.ndarray, rows: np.ndarray) -> np.ndarray:
+        """只对指定行打分（混合检索的第二阶段），q 为归一化 float32 (d,) 稠密查询向量。
+        csr 布局把各行的非零段拼成一次 gather + bincount，耗时与这些行的非零元个数成正比。"""
+        rows = np.asarray(rows, dtype=np.int64)
+        if len(rows) == 0:
+            return np.zeros(0, dtype=np.float32)
+        if self.layout == "csr":
+            indptr, indices, data = self.csr
+            pos, lengths = _row_positions(indptr, rows)
+            seg = np.repeat(np.arange(len(rows)), lengths)
+            prod = np.asarray(data[pos], dtype=np.float32) * q[indices[pos]]
+            scores = np.bincount(seg, weights=prod, minlength=len(rows)).astype(np.float32)
+            return self._mask_deleted(scores, rows)
+        exact = self.exact_scores(q, rows)
+        if exact is not None:
+            return self._mask_deleted(exact, rows)
+        scores = np.asarray(self.embeddings[rows], dtype=np.float32) @ q
+        if self.scales is not None:
+            scores *= self.scales[rows]
+        return self._mask_deleted(scores, rows)
+
+    def row_ids(self) -> dict:
+        """chunk id -> 行号（首次调用时构建并缓存，不含墓碑行）。"""
+        if self._row_ids is None:
+            self._row_ids = {self.meta.chunk_id(i): int(i) for i in self.live_rows().tolist()}
+        return self._row_ids
+
+    def _shard_groups(self) -> dict:
+        """书 id -> 该书在库行号（升序）；首次调用时按 chunk id 前缀分组并缓存。"""
+        if self._shard_rows is None:
+            groups = {}
+            for i in self.live_rows().tolist():
+                groups.setdefault(shard_of(self.meta.chunk_id(i)), []).append(i)
+            self._shard_rows = {k: np.array(v, dtype=np.int64) for k, v in groups.items()}
+        return self._shard_rows
+
+    def shard_rows(self, shard: str) -> np.ndarray:
+        """某本书（分片）的全部在库行号。"""
+        return self._shard_groups().get(shard, np.empty(0, dtype=np.int64))
+
+    def _shard_view(self, shard: str):
+        view = self._shard_views.get(shard)
+        if view is None:
+            rows = self.shard_rows(shard)
+            if self.layout == "csr":
+                view = csr_transpose(csr_take(self.csr, rows), self.dim)
+            else:
+                view = _row_runs(rows)
+            self._shard_views[shard] = view
+        return view
+
+    def prepare_shards(self) -> dict:
+        """预先为每本书建好分片视图（见模块说明），返回各书行数。未预建时首次按书检索再建。"""
+        groups = self._shard_groups()
+        for shard in groups:
+            self._shard_view(shard)
+        return {shard: len(rows) for shard, rows in groups.items()}
+
+    def score_shard(self, shard: str, q_indices: np.ndarray, q_data: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """只在某本书内打分，返回 (行号, 分数)。csr 布局用该书自己的 CSC，耗时只与该书的列数据量有关；
+        dense 布局按该书的连续行区间分块打分，float32 库直接对 mmap 切片做乘积。"""
+        rows = self.shard_rows(shard)
+        view = self._shard_view(shard)
+        if self.layout == "csr":
+            return rows, _score_columns(view, len(rows), q_indices, q_data)
+        q = np.zeros(self.dim, dtype=np.float32)
+        q[q_indices] = q_data
+        # 与 score_rows 一致：量化库有精确向量时用精确向量，否则反量化
+        emb = self.exact if self.exact is not None else self.embeddings
+        scales = self.scales if self.exact is None else None
+        scores = np.empty(len(rows), dtype=np.float32)
+        pos = 0
+        for run_start, run_end in view:
+            for start in range(run_start, run_end, SCORE_BLOCK_ROWS):
+                end = min(start + SCORE_BLOCK_ROWS, run_end)
+                block = emb[start:end]
+                if block.dtype != np.float32:
+                    block = np.asarray(block, dtype=np.float32)
+                out = scores[pos:pos + end - start]
+                np.matmul(block, q, out=out)
+                if scales is not None:
+                    out *= scales[start:end]
+                pos += end - start
+        return rows, scores
+
+    def exact_scores(self, q: np.ndarray, rows: np.ndarray) -> Optional[np.ndarray]:
+        """用 float32 精确向量重算指定行的分数；无精确向量时返回 None。"""
+        if self.exact is None:
+            return None
+        return np.asarray(self.exact[rows], dtype=np.float32) @ q
+
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """argpartition 取前 k 大，再只对这 k 个排序（不对全部分数做全排序）。"""
+    n = scores.shape[0]
+    if k <= 0 or n == 0:
+        return np.empty(0, dtype=np.int64)
+    if k < n:
+        part = np.argpartition(-scores, k - 1)[:k]
+    else:
+        part = np.arange(n)
+    return part[np.argsort(-scores[part], kind="stable")]
+
+
+def top_k_indices_batch(scores: np.ndarray, k: int) -> np.ndarray:
+    """对 (m, N) 分数矩阵逐行取前 k 大（按分数降序），返回 int64 (m, min(k, N))。"""
+    m, n = scores.shape
+    k = min(k, n)
+    if k <= 0:
+        return np.empty((m, 0), dtype=np.int64)
+    if k < n:
+        part = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        part = np.broadcast_to(np.arange(n), (m, n)).copy()
+    order = np.argsort(-np.take_along_axis(scores, part, axis=1), axis=1, kind="stable")
+    return np.take_along_axis(part, order, axis=1)
+
+
+def load_store(store_dir: str) -> Optional[VectorStore]:
+    """加载向量库；未构建、条数不一致或损坏时返回 None。"""
+    if not _has_meta(store_dir):
+        return None
+    if not any(
+        os.path.isfile(os.path.join(store_dir, name))
+        for name in (EMBEDDINGS_FILE, CSR_FILES[0] + ".npy")
+    ):
+        return None
+    try:
+        store = VectorStore(store_dir)
+    except Exception:
+        return None
+    if len(store.meta) == 0 or len(store) != len(store.meta):
+        return None
+    return store
@@ -5,8 +5,13 @@ import os
 # 将 backend 目录加入 Python 路径，这样 import 能找到 backend 下的模块
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), "backend"))
 
-from app import app
+from app import create_app
+
+# 初始化数据库并预热知识库（数据库不再在模块导入时初始化）
+app = create_app()
 
 if __name__ == "__main__":
+    import rag
+    rag.start_reloader()
     port = int(os.getenv("PORT", 5000))
     app.run(host="0.0.0.0", port=port)